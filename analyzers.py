@@ -0,0 +1,254 @@
+"""
+Content statistics computed alongside the line count. Analyzers never read
+the file themselves, every analyzer enabled by "ScanConfig.analyzers" gets
+the chunks read for the line count, so any number of them costs a single
+read of each file.
+"""
+
+import hashlib
+import re
+from typing import Any, Dict, List, Optional, Pattern, Sequence, Tuple, Type
+
+
+class FileAnalyzer:
+    """
+    Base of the analyzers. A new instance is created for every file read, it's
+    fed the file's chunks in order and then asked for its "result", values of
+    its "columns". Analyzers run only on files that are read whole (binary
+    files skipped or sampled by "LineCountConfig.binary_file_policy" are not),
+    the columns of the other files are NULL.
+
+    Columns are appended to the "file" records, their names must be unique
+    across all of the analyzers.
+    """
+
+    name = ""
+    columns: List[Tuple[str, str]] = []
+
+    def __init__(self, filetype: str) -> None:
+        """
+        filetype:   see "utils.get_file_type"
+        """
+        self.filetype = filetype
+
+    @classmethod
+    def is_applicable(cls, filetype: str) -> bool:
+        """
+        Whether the analyzer has a result for the text files of the type, its
+        columns of the other files are NULL.
+        """
+        return True
+
+    def update(self, chunk: bytes) -> None:
+        raise NotImplementedError()
+
+    def result(self) -> Tuple[Any, ...]:
+        raise NotImplementedError()
+
+
+ANALYZERS: Dict[str, Type[FileAnalyzer]] = {}
+
+
+def register_analyzer(analyzer: Type[FileAnalyzer]) -> Type[FileAnalyzer]:
+    """
+    Makes the analyzer available to "ScanConfig.analyzers" under its "name",
+    usable as a class decorator.
+    """
+    ANALYZERS[analyzer.name] = analyzer
+    return analyzer
+
+
+def get_analyzers(names: List[str]) -> List[Type[FileAnalyzer]]:
+    for name in names:
+        if name not in ANALYZERS:
+            raise Exception(
+                f"Invalid analyzer, expected one of [{', '.join(ANALYZERS)}], received: {name}."
+            )
+    return [ANALYZERS[name] for name in names]
+
+
+def get_analyzer_columns(
+    analyzers: Sequence[Type[FileAnalyzer]],
+) -> List[Tuple[str, str]]:
+    return [column for analyzer in analyzers for column in analyzer.columns]
+
+
+class LineAnalyzer(FileAnalyzer):
+    """
+    Base of the analyzers looking at whole lines. Chunks end in the middle
+    of a line, the unfinished line is carried over to the next chunk in the
+    short form given by "reduce_line", a line spanning many chunks is never
+    kept whole. Last line without a trailing newline counts as a line, same as
+    in the line count.
+    """
+
+    def __init__(self, filetype: str) -> None:
+        super().__init__(filetype)
+        self.tail = b""
+
+    def update(self, chunk: bytes) -> None:
+        end = chunk.rfind(b"\n")
+        if end == -1:
+            self.tail = self.reduce_line(self.tail + chunk)
+            return
+
+        self.update_lines(self.tail + chunk[:end])
+        self.tail = self.reduce_line(chunk[end + 1 :])
+
+    def result(self) -> Tuple[Any, ...]:
+        if self.tail:
+            self.update_lines(self.tail)
+            self.tail = b""
+        return self.get_result()
+
+    def update_lines(self, lines: bytes) -> None:
+        """
+        lines:  complete lines joined by newlines, without the last newline
+        """
+        raise NotImplementedError()
+
+    def reduce_line(self, line: bytes) -> bytes:
+        """
+        Returns a line of bounded length the analyzer can't tell apart from
+        "line", the start of an unfinished line, whatever follows it.
+        """
+        raise NotImplementedError()
+
+    def get_result(self) -> Tuple[Any, ...]:
+        raise NotImplementedError()
+
+
+WHITESPACE = b" \t\r\f\v"
+
+
+class PatternCounter(LineAnalyzer):
+    """
+    Counts lines matching "get_pattern" (a multiline pattern anchored at "^"),
+    the count is NULL for file types without a pattern. The pattern may look
+    at the line's leading whitespace (matched by character classes repeated
+    with "*") and at most "prefix_size" bytes after it.
+    """
+
+    prefix_size = 8
+
+    def __init__(self, filetype: str) -> None:
+        super().__init__(filetype)
+        self.pattern = self.get_pattern(filetype)
+        self.count = 0
+
+    @classmethod
+    def is_applicable(cls, filetype: str) -> bool:
+        return cls(filetype).pattern is not None
+
+    def get_pattern(self, filetype: str) -> Optional[Pattern[bytes]]:
+        raise NotImplementedError()
+
+    def update(self, chunk: bytes) -> None:
+        if self.pattern is not None:
+            super().update(chunk)
+
+    def update_lines(self, lines: bytes) -> None:
+        assert self.pattern is not None
+        self.count += sum(1 for _ in self.pattern.finditer(lines))
+
+    def reduce_line(self, line: bytes) -> bytes:
+        indent = len(line) - len(line.lstrip(WHITESPACE))
+        # The characters of the leading whitespace matter, not their count
+        # or order.
+        return (
+            bytes(sorted(set(line[:indent]))) + line[indent : indent + self.prefix_size]
+        )
+
+    def get_result(self) -> Tuple[Any, ...]:
+        return (self.count if self.pattern is not None else None,)
+
+
+BLANK_LINE_RE = re.compile(rb"^[ \t\r\f\v]*$", re.MULTILINE)
+
+
+@register_analyzer
+class BlankLines(PatternCounter):
+    name = "blank_lines"
+    columns = [("blank_lines", "INTEGER")]
+
+    def get_pattern(self, filetype: str) -> Optional[Pattern[bytes]]:
+        return BLANK_LINE_RE
+
+
+# Line comment markers of the common languages by file type, block comments
+# are not recognized.
+COMMENT_MARKERS: Dict[str, bytes] = {
+    **dict.fromkeys(
+        ["py", "sh", "bash", "rb", "pl", "r", "yaml", "yml", "toml", "cfg", "ini"],
+        b"#",
+    ),
+    **dict.fromkeys(
+        ["c", "h", "cc", "cpp", "hpp", "cs", "java", "js", "ts", "go", "rs", "kt"],
+        b"//",
+    ),
+    **dict.fromkeys(["swift", "scala", "php", "dart"], b"//"),
+    **dict.fromkeys(["sql", "lua", "hs"], b"--"),
+    **dict.fromkeys(["tex", "erl", "m"], b"%"),
+}
+COMMENT_LINE_RES: Dict[str, Pattern[bytes]] = {
+    filetype: re.compile(rb"^[ \t]*" + re.escape(marker), re.MULTILINE)
+    for filetype, marker in COMMENT_MARKERS.items()
+}
+
+
+@register_analyzer
+class CommentLines(PatternCounter):
+    name = "comment_lines"
+    columns = [("comment_lines", "INTEGER")]
+
+    def get_pattern(self, filetype: str) -> Optional[Pattern[bytes]]:
+        return COMMENT_LINE_RES.get(filetype)
+
+
+@register_analyzer
+class LongestLine(FileAnalyzer):
+    """
+    Length of the longest line in bytes, without the newline. Only the length
+    of the unfinished line is carried over to the next chunk.
+    """
+
+    name = "longest_line"
+    columns = [("longest_line", "INTEGER")]
+
+    def __init__(self, filetype: str) -> None:
+        super().__init__(filetype)
+        self.longest_line = 0
+        self.line_length = 0
+
+    def update(self, chunk: bytes) -> None:
+        start = chunk.find(b"\n")
+        if start == -1:
+            self.line_length += len(chunk)
+            return
+
+        end = chunk.rfind(b"\n")
+        self.longest_line = max(
+            self.longest_line,
+            self.line_length + start,
+            *map(len, chunk[start + 1 : end].split(b"\n")),
+        )
+        self.line_length = len(chunk) - end - 1
+
+    def result(self) -> Tuple[Any, ...]:
+        return (max(self.longest_line, self.line_length),)
+
+
+@register_analyzer
+class ContentHash(FileAnalyzer):
+    name = "content_hash"
+    columns = [("content_hash", "TEXT")]
+
+    def __init__(self, filetype: str) -> None:
+        super().__init__(filetype)
+        self.hash = hashlib.blake2b(digest_size=16)
+
+    def update(self, chunk: bytes) -> None:
+        self.hash.update(chunk)
+
+    def result(self) -> Tuple[Any, ...]:
+        return (self.hash.hexdigest(),)
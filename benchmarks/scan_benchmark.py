@@ -0,0 +1,324 @@
+"""
+Benchmarks the scanner on reproducible synthetic trees.
+
+Trees are generated under the work directory (/tmp by default) from a seed,
+the same spec always produces the same tree and an existing tree is reused.
+Every run scans the tree with a fresh database in its own process and appends
+one JSON line per scan to the results file.
+
+    python benchmarks/scan_benchmark.py --preset small
+    python benchmarks/scan_benchmark.py --preset large --runs 3 --incremental
+    python benchmarks/scan_benchmark.py --preset small --files 50000 --binary-share 0.3
+    python benchmarks/scan_benchmark.py --preset small --analyzer content_hash
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from multiprocessing import get_context
+from typing import Any, Dict, List
+
+from pydantic import BaseModel, Field
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import Environment, LargeFileConfig, ScanConfig  # noqa: E402
+import analyzers  # noqa: E402
+import file_scanner  # noqa: E402
+
+
+class TreeSpec(BaseModel):
+    files: int = Field(ge=1)
+    depth: int = Field(ge=0)  # levels of directories below the root
+    fanout: int = Field(ge=1)  # subdirectories of each directory
+    # File sizes are log-normally distributed around the median.
+    size_median: int = Field(ge=1)
+    size_sigma: float = Field(ge=0)
+    size_max: int = Field(default=64 * 1024 * 1024, ge=1)
+    binary_share: float = Field(default=0.1, ge=0, le=1)
+    tracked_share: float = Field(default=0.8, ge=0, le=1)
+    seed: int = 0
+
+    @property
+    def name(self) -> str:
+        return (
+            f"f{self.files}_d{self.depth}_o{self.fanout}_m{self.size_median}"
+            f"_s{self.size_sigma}_b{self.binary_share}_t{self.tracked_share}"
+            f"_r{self.seed}"
+        )
+
+
+PRESETS: Dict[str, TreeSpec] = {
+    "smoke": TreeSpec(files=2_000, depth=3, fanout=4, size_median=2048, size_sigma=1.0),
+    "small": TreeSpec(
+        files=20_000, depth=4, fanout=5, size_median=2048, size_sigma=1.2
+    ),
+    "medium": TreeSpec(
+        files=200_000, depth=5, fanout=6, size_median=2048, size_sigma=1.2
+    ),
+    "large": TreeSpec(
+        files=1_000_000, depth=6, fanout=6, size_median=1024, size_sigma=1.0
+    ),
+    "xlarge": TreeSpec(
+        files=5_000_000, depth=6, fanout=8, size_median=1024, size_sigma=1.0
+    ),
+}
+
+TEXT_EXTENSIONS = [".py", ".md", ".txt", ".json", ".c"]
+BINARY_EXTENSIONS = [".bin", ".dat", ".png"]
+
+# Contents are sliced from these blocks, generating every file byte by byte
+# would take longer than scanning it.
+BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def make_blocks(rng: random.Random) -> Dict[bool, bytes]:
+    words = [
+        "".join(
+            rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(1, 9))
+        )
+        for _ in range(512)
+    ]
+    lines = []
+    size = 0
+    while size < BLOCK_SIZE:
+        line = " ".join(rng.choice(words) for _ in range(rng.randint(0, 12))) + "\n"
+        lines.append(line)
+        size += len(line)
+    text = "".join(lines).encode()[:BLOCK_SIZE]
+
+    binary = bytearray(rng.getrandbits(8) for _ in range(BLOCK_SIZE))
+    # Make sure the binary sniffing recognizes the files as binary.
+    for i in range(0, BLOCK_SIZE, 1024):
+        binary[i] = 0
+
+    return {False: text, True: bytes(binary)}
+
+
+def get_content(block: bytes, offset: int, size: int) -> bytes:
+    repeats = math.ceil((offset + size) / len(block))
+    if repeats == 1:
+        return block[offset : offset + size]
+    return (block * repeats)[offset : offset + size]
+
+
+def get_directories(root: str, depth: int, fanout: int) -> List[str]:
+    directories = [root]
+    level = [root]
+    for d in range(depth):
+        level = [
+            os.path.join(parent, f"d{d}_{i}") for parent in level for i in range(fanout)
+        ]
+        directories.extend(level)
+    return directories
+
+
+def generate_tree(spec: TreeSpec, tree_path: str) -> None:
+    rng = random.Random(spec.seed)
+    blocks = make_blocks(rng)
+    directories = get_directories(tree_path, spec.depth, spec.fanout)
+    for directory in directories:
+        os.makedirs(directory, exist_ok=True)
+
+    mu = math.log(spec.size_median)
+    for i in range(spec.files):
+        is_binary = rng.random() < spec.binary_share
+        extension = rng.choice(BINARY_EXTENSIONS if is_binary else TEXT_EXTENSIONS)
+        size = min(int(rng.lognormvariate(mu, spec.size_sigma)), spec.size_max)
+        filepath = os.path.join(rng.choice(directories), f"f{i}{extension}")
+
+        with open(filepath, "wb") as f:
+            f.write(
+                get_content(
+                    blocks[is_binary], rng.randrange(len(blocks[is_binary])), size
+                )
+            )
+
+        if rng.random() < spec.tracked_share:
+            os.setxattr(filepath, "user.tracked", b"true")
+
+
+def ensure_tree(spec: TreeSpec, workdir: str, regenerate: bool) -> str:
+    """
+    Returns path of the spec's tree, the tree is generated only if it doesn't
+    exist yet (or "regenerate" is set).
+    """
+    tree_path = os.path.join(workdir, "trees", spec.name)
+    # Written once the tree is complete, a partially generated tree is never reused.
+    manifest_path = f"{tree_path}.json"
+
+    if os.path.exists(manifest_path) and not regenerate:
+        return tree_path
+
+    if os.path.exists(tree_path):
+        shutil.rmtree(tree_path)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    print(f"Generating {spec.files} files in {tree_path}.")
+    start_time = time.time()
+    generate_tree(spec, tree_path)
+    with open(manifest_path, "w") as f:
+        f.write(spec.model_dump_json())
+    print(f"Generated in {round(time.time() - start_time, 2)}s.")
+
+    return tree_path
+
+
+def run_scan(scan_config_json: str, scan_start_time: datetime) -> Dict[str, Any]:
+    """
+    Runs in a separate process so that the peak RSS is the scan's own.
+    """
+    scan_config = ScanConfig.model_validate_json(scan_config_json)
+    scan = file_scanner.Scan(scan_config)
+
+    start_time = time.perf_counter()
+    scan_stat = scan.perform_scan(scan_start_time=scan_start_time)
+    elapsed_time = time.perf_counter() - start_time
+
+    return {
+        "elapsed_time": round(elapsed_time, 3),
+        "files_walked": scan_stat.files_scanned + scan_stat.files_skipped,
+        "files_scanned": scan_stat.files_scanned,
+        "bytes_read": scan_stat.bytes_read,
+        "files_per_sec": round(
+            (scan_stat.files_scanned + scan_stat.files_skipped) / elapsed_time, 1
+        ),
+        "mb_per_sec": round(scan_stat.bytes_read / elapsed_time / 1_000_000, 2),
+        "peak_rss": scan_stat.peak_rss,
+    }
+
+
+def run_benchmark(args: argparse.Namespace) -> None:
+    spec = PRESETS[args.preset].model_copy(
+        update={
+            name: value
+            for name, value in [
+                ("files", args.files),
+                ("depth", args.depth),
+                ("fanout", args.fanout),
+                ("size_median", args.size_median),
+                ("size_sigma", args.size_sigma),
+                ("binary_share", args.binary_share),
+                ("tracked_share", args.tracked_share),
+                ("seed", args.seed),
+            ]
+            if value is not None
+        }
+    )
+    spec = TreeSpec.model_validate(spec.model_dump())  # validate the overrides
+    # Generated in a separate process as well, the scans' processes are forked
+    # from this one and the peak RSS would include the generator's memory.
+    with ProcessPoolExecutor(
+        max_workers=1, mp_context=get_context("spawn")
+    ) as executor:
+        tree_path = executor.submit(
+            ensure_tree, spec, args.workdir, args.regenerate
+        ).result()
+
+    run_path = os.path.join(args.workdir, "run")
+    results_path = args.results or os.path.join(args.workdir, "results.jsonl")
+    modes = ["full", "incremental"] if args.incremental else ["full"]
+
+    for run in range(args.runs):
+        # Every run starts from an empty database.
+        if os.path.exists(run_path):
+            shutil.rmtree(run_path)
+
+        for i, mode in enumerate(modes):
+            scan_config = ScanConfig(
+                scan_paths=[tree_path],
+                database_filepath=os.path.join(run_path, "data", "db.dat"),
+                scan_period_wait_time_hours=0,
+                csv_dump_path=os.path.join(run_path, "csv"),
+                log_file=os.path.join(run_path, "logs", "debug.log"),
+                reports_path=os.path.join(run_path, "reports"),
+                environment=Environment.DEV,
+                incremental_scan=mode == "incremental",
+                analyzers=args.analyzer,
+                large_files=LargeFileConfig(size_threshold=args.large_file_threshold),
+            )
+            os.makedirs(os.path.dirname(scan_config.log_file), exist_ok=True)
+
+            with ProcessPoolExecutor(
+                max_workers=1, mp_context=get_context("spawn")
+            ) as executor:
+                result = executor.submit(
+                    run_scan,
+                    scan_config.model_dump_json(),
+                    # Records are keyed by the day of the scan, the incremental
+                    # scan pretends to run on the following day.
+                    datetime.now() + timedelta(days=i),
+                ).result()
+
+            record = {
+                "date": datetime.now().isoformat(timespec="seconds"),
+                "preset": args.preset,
+                "spec": spec.model_dump(),
+                "run": run,
+                "mode": mode,
+                "analyzers": args.analyzer,
+                "large_file_threshold": args.large_file_threshold,
+                "cpu_count": os.cpu_count(),
+                **result,
+            }
+            with open(results_path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+
+            print(
+                f"[{args.preset} run {run} {mode}] {result['files_per_sec']} files/s, "
+                f"{result['mb_per_sec']} MB/s, peak RSS {result['peak_rss'] / 1024 / 1024:.1f} MiB"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="scan benchmark")
+    parser.add_argument("--preset", choices=list(PRESETS), default="small")
+    parser.add_argument("--files", type=int, help="override the preset's file count")
+    parser.add_argument("--depth", type=int, help="override the preset's depth")
+    parser.add_argument("--fanout", type=int, help="override the preset's fanout")
+    parser.add_argument("--size-median", type=int, help="median file size in bytes")
+    parser.add_argument("--size-sigma", type=float, help="spread of the file sizes")
+    parser.add_argument("--binary-share", type=float, help="share of binary files")
+    parser.add_argument(
+        "--tracked-share", type=float, help="share of files with the xattr set"
+    )
+    parser.add_argument("--seed", type=int, help="seed of the generated tree")
+    parser.add_argument("--runs", type=int, default=1, help="number of runs")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        default=False,
+        help="scan once more in incremental mode after each full scan",
+    )
+    parser.add_argument(
+        "--analyzer",
+        action="append",
+        default=[],
+        choices=list(analyzers.ANALYZERS),
+        help="run the analyzer during the scans, can be repeated",
+    )
+    parser.add_argument(
+        "--large-file-threshold",
+        type=int,
+        help="size in bytes from which files are read by the large file workers",
+    )
+    parser.add_argument("--workdir", default="/tmp/scanner_benchmark")
+    parser.add_argument(
+        "--results", help="JSON lines results file, defaults to <workdir>/results.jsonl"
+    )
+    parser.add_argument(
+        "--regenerate",
+        action="store_true",
+        default=False,
+        help="generate the tree even if it already exists",
+    )
+
+    run_benchmark(parser.parse_args())
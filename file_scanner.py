@@ -1,23 +1,30 @@
+import glob
+import hashlib
 import logging
 import os
+import re
+import resource
 import shutil
 import threading
 import time
 import traceback
 from datetime import datetime, timedelta
 from logging.handlers import RotatingFileHandler
-from typing import List
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 import argparse
 
 import apsw
 
 from models import (
-    FileStat,
     Environment,
     ScanConfig,
+    ScanPhaseStat,
     ScanStat,
+    SlowFileStat,
     TableDescription,
 )
+from scan_engine import PHASES, RootScan, ScanPipeline, Shard
+import analyzers
 import utils
 
 # Enable for easier debugging if for some reason we need to troubleshoot prod version.
@@ -26,49 +33,337 @@ LOG_TO_CONSOLE = False
 
 
 class Scan:
+    # Scan bookkeeping stays in the main database when roots are sharded.
+    MAIN_DATABASE_TABLES = ["scan", "scan_phase", "scan_slow_file"]
+    # Ids of these tables are local to each database, across shards they are
+    # queried only through the "file" view.
+    DATABASE_LOCAL_TABLES = ["file_record", "scan_date", "path", "filetype"]
+    # Tables whose rows may be repeated by several databases, their union views
+    # merge the copies. An error is stored by every shard it occurred in.
+    MERGED_TABLES = {
+        "file_error": """
+            SELECT
+                error_fingerprint,
+                MAX(error_class) as error_class,
+                MAX(error_traceback) as error_traceback,
+                MIN(date_first_seen) as date_first_seen,
+                MAX(date_last_seen) as date_last_seen
+            FROM ({union_sql})
+            GROUP BY
+                error_fingerprint
+        """,
+    }
+
     def __init__(self, scan_config: ScanConfig) -> None:
         self.scan_config = scan_config
 
-        self.tracking_tables = {
+        self.tracking_tables = self.create_tracking_tables(
+            self.scan_config.database_filepath
+        )
+
+        self.initialize_logger()
+        self.initialize_dirs()
+        self.intialize_tracking_tables(self.tracking_tables)
+        self.intialize_shards()
+
+    def create_tracking_tables(
+        self, database_filepath: str
+    ) -> Dict[str, TableDescription]:
+        # Appended to the records, see "ScanConfig.analyzers".
+        analysis_columns = analyzers.get_analyzer_columns(
+            analyzers.get_analyzers(self.scan_config.analyzers)
+        )
+        file_columns = [
+            ("date__inode", "TEXT"),  # PK shortcut - date + device + inode
+            ("date_scanned", "DATETIME"),
+            ("inode", "INTEGER"),
+            ("filename", "TEXT"),
+            ("filepath", "TEXT"),
+            ("filetype", "TEXT"),
+            ("lines", "INTEGER"),
+            ("date_created", "DATETIME"),
+            ("date_modified", "DATETIME"),
+            ("error_occured", "INTEGER"),
+            ("error_traceback", "TEXT"),
+            ("size", "INTEGER"),
+            ("mtime_ns", "INTEGER"),
+            ("error_fingerprint", "TEXT"),  # see "file_error"
+            ("error_class", "TEXT"),
+            # st_dev of the file, unknown (NULL) in records of older versions.
+            ("dev", "INTEGER"),
+            *analysis_columns,
+        ]
+
+        return {
+            # Records of every scan in the original layout, a view of the
+            # compact "file_record" table joined with its dictionaries.
             "file": TableDescription(
                 table_name="file",
-                file_path=self.scan_config.database_filepath,
+                file_path=database_filepath,
+                lock=threading.Lock(),
+                columns=file_columns,
+                primary_key=[],
+                csv_dump_file=os.path.join(self.scan_config.csv_dump_path, "files"),
+                # Partitioned by the date of the scan, the dates are looked up
+                # in the small "scan_date" table.
+                csv_partition_column="date_scanned",
+                csv_partition_table="scan_date",
+                view_sql=f"""
+                    SELECT
+                        SUBSTR(s.date_scanned, 1, 10) || '__' || IFNULL(r.dev || '__', '')
+                            || r.inode as date__inode,
+                        s.date_scanned,
+                        r.inode,
+                        p.filename,
+                        p.filepath,
+                        t.filetype,
+                        r.lines,
+                        r.date_created,
+                        r.date_modified,
+                        r.error_occured,
+                        e.error_traceback,
+                        r.size,
+                        r.mtime_ns,
+                        r.error_fingerprint,
+                        r.error_class,
+                        r.dev
+                        {"".join(f", r.{column}" for column, _ in analysis_columns)}
+                    FROM file_record as r
+                    JOIN scan_date as s ON s.scan_id = r.scan_id
+                    JOIN path as p ON p.path_id = r.path_id
+                    JOIN filetype as t ON t.filetype_id = p.filetype_id
+                    LEFT JOIN file_error as e ON e.error_fingerprint = r.error_fingerprint
+                """,
+            ),
+            # One row per scanned file per scan, keyed by integers only.
+            "file_record": TableDescription(
+                table_name="file_record",
+                file_path=database_filepath,
                 lock=threading.Lock(),
                 columns=[
-                    ("date__inode", "TEXT"),  # PK shortcut - date + inode
-                    ("date_scanned", "DATETIME"),
+                    ("scan_id", "INTEGER"),
+                    ("path_id", "INTEGER"),
                     ("inode", "INTEGER"),
-                    ("filename", "TEXT"),
-                    ("filepath", "TEXT"),
-                    ("filetype", "TEXT"),
                     ("lines", "INTEGER"),
                     ("date_created", "DATETIME"),
                     ("date_modified", "DATETIME"),
                     ("error_occured", "INTEGER"),
+                    ("size", "INTEGER"),
+                    ("mtime_ns", "INTEGER"),
+                    ("error_fingerprint", "TEXT"),  # see "file_error"
+                    ("error_class", "TEXT"),
+                    ("dev", "INTEGER"),
+                    *analysis_columns,
+                ],
+                primary_key=["scan_id", "path_id", "inode"],
+                csv_dump_file=None,
+                without_rowid=True,
+                indexes=[["inode", "scan_id"]],
+            ),
+            # Dictionaries of the strings repeated by every scan's records.
+            "scan_date": TableDescription(
+                table_name="scan_date",
+                file_path=database_filepath,
+                lock=threading.Lock(),
+                columns=[("scan_id", "INTEGER"), ("date_scanned", "DATETIME")],
+                primary_key=["scan_id"],
+                csv_dump_file=None,
+                unique_indexes=[["date_scanned"]],
+            ),
+            "path": TableDescription(
+                table_name="path",
+                file_path=database_filepath,
+                lock=threading.Lock(),
+                columns=[
+                    ("path_id", "INTEGER"),
+                    ("filepath", "TEXT"),
+                    ("filename", "TEXT"),
+                    ("filetype_id", "INTEGER"),
+                ],
+                primary_key=["path_id"],
+                csv_dump_file=None,
+                unique_indexes=[["filepath"]],
+            ),
+            "filetype": TableDescription(
+                table_name="filetype",
+                file_path=database_filepath,
+                lock=threading.Lock(),
+                columns=[("filetype_id", "INTEGER"), ("filetype", "TEXT")],
+                primary_key=["filetype_id"],
+                csv_dump_file=None,
+                unique_indexes=[["filetype"]],
+            ),
+            # Copy of the latest "file" record of each (inode, device), maintained
+            # by the scan's writer.
+            "file_latest": TableDescription(
+                table_name="file_latest",
+                file_path=database_filepath,
+                lock=threading.Lock(),
+                columns=file_columns,
+                primary_key=["inode", "dev"],
+                csv_dump_file=None,
+                indexes=[["date_modified"], ["error_fingerprint"]],
+            ),
+            # Distinct errors of the scanned files keyed by their fingerprint.
+            "file_error": TableDescription(
+                table_name="file_error",
+                file_path=database_filepath,
+                lock=threading.Lock(),
+                columns=[
+                    ("error_fingerprint", "TEXT"),
+                    ("error_class", "TEXT"),
                     ("error_traceback", "TEXT"),
+                    ("date_first_seen", "DATETIME"),
+                    ("date_last_seen", "DATETIME"),
                 ],
-                primary_key=["date__inode"],
-                csv_dump_file=os.path.join(self.scan_config.csv_dump_path, "files.csv"),
+                primary_key=["error_fingerprint"],
+                csv_dump_file=os.path.join(self.scan_config.csv_dump_path, "errors"),
+                without_rowid=True,
             ),
             "scan": TableDescription(
                 table_name="scan",
-                file_path=self.scan_config.database_filepath,
+                file_path=database_filepath,
                 lock=threading.Lock(),
                 columns=[
                     ("date_scanned", "DATETIME"),
                     ("scan_time", "REAL"),
                     ("files_scanned", "INTEGER"),
                     ("files_skipped", "INTEGER"),
+                    ("bytes_read", "INTEGER"),
+                    ("peak_rss", "INTEGER"),
+                    ("dirs_deferred", "INTEGER"),
+                    ("large_files_left", "INTEGER"),
                 ],
                 primary_key=[],
-                csv_dump_file=os.path.join(self.scan_config.csv_dump_path, "scans.csv"),
+                csv_dump_file=os.path.join(self.scan_config.csv_dump_path, "scans"),
+            ),
+            # Directories whose records are written, an interrupted scan
+            # is resumed from these, see "resume_scan_start_time".
+            "scan_checkpoint": TableDescription(
+                table_name="scan_checkpoint",
+                file_path=database_filepath,
+                lock=threading.Lock(),
+                columns=[
+                    ("date_scanned", "DATETIME"),
+                    ("dirpath", "TEXT"),
+                    ("root_path", "TEXT"),
+                    ("files_scanned", "INTEGER"),
+                    ("files_skipped", "INTEGER"),
+                ],
+                primary_key=["date_scanned", "dirpath"],
+                csv_dump_file=None,
+                without_rowid=True,
+            ),
+            # Entries of each directory, see "utils.DirListingCache". Listings
+            # are large, they are kept out of the primary key's b-tree.
+            "dir_listing": TableDescription(
+                table_name="dir_listing",
+                file_path=database_filepath,
+                lock=threading.Lock(),
+                columns=[
+                    ("dirpath", "TEXT"),
+                    ("dir_inode", "INTEGER"),
+                    ("dir_mtime_ns", "INTEGER"),
+                    ("entries", "BLOB"),
+                ],
+                primary_key=["dirpath"],
+                csv_dump_file=None,
+            ),
+            # How often each directory changed in the earlier scans and whether
+            # it was deferred by the last one, see "update_dir_history".
+            "dir_history": TableDescription(
+                table_name="dir_history",
+                file_path=database_filepath,
+                lock=threading.Lock(),
+                columns=[
+                    ("dirpath", "TEXT"),
+                    ("root_path", "TEXT"),
+                    ("change_rate", "REAL"),
+                    ("date_last_scanned", "DATETIME"),
+                    ("date_last_changed", "DATETIME"),
+                    ("deferred", "INTEGER"),
+                ],
+                primary_key=["dirpath"],
+                csv_dump_file=None,
+                without_rowid=True,
+            ),
+            # Timing of each phase of each root's scan, see "PhaseStat".
+            "scan_phase": TableDescription(
+                table_name="scan_phase",
+                file_path=database_filepath,
+                lock=threading.Lock(),
+                columns=[
+                    ("date_scanned", "DATETIME"),
+                    ("root_path", "TEXT"),
+                    ("phase", "TEXT"),
+                    ("busy_time", "REAL"),
+                    ("items", "INTEGER"),
+                    ("bytes_read", "INTEGER"),
+                ],
+                primary_key=["date_scanned", "root_path", "phase"],
+                csv_dump_file=os.path.join(
+                    self.scan_config.csv_dump_path, "scan_phases"
+                ),
+            ),
+            # Files that took the longest to read during each scan.
+            "scan_slow_file": TableDescription(
+                table_name="scan_slow_file",
+                file_path=database_filepath,
+                lock=threading.Lock(),
+                columns=[
+                    ("date_scanned", "DATETIME"),
+                    ("root_path", "TEXT"),
+                    ("filepath", "TEXT"),
+                    ("stat_time", "REAL"),
+                    ("line_count_time", "REAL"),
+                    ("size", "INTEGER"),
+                    ("bytes_read", "INTEGER"),
+                    ("lines", "INTEGER"),
+                ],
+                primary_key=["date_scanned", "filepath"],
+                csv_dump_file=os.path.join(
+                    self.scan_config.csv_dump_path, "scan_slow_files"
+                ),
+            ),
+            "tracking_cache": TableDescription(
+                table_name="tracking_cache",
+                file_path=database_filepath,
+                lock=threading.Lock(),
+                columns=[
+                    ("st_dev", "INTEGER"),
+                    ("st_ino", "INTEGER"),
+                    ("st_ctime_ns", "INTEGER"),
+                    ("tracked", "INTEGER"),
+                    ("date_last_seen", "DATETIME"),
+                ],
+                primary_key=["st_dev", "st_ino"],
+                csv_dump_file=None,
+                without_rowid=True,
+            ),
+            # Daily totals of the latest record of each inode, maintained by
+            # the scan's writer. Reports are generated from these tables.
+            "rollup_daily_total": TableDescription(
+                table_name="rollup_daily_total",
+                file_path=database_filepath,
+                lock=threading.Lock(),
+                columns=[("date", "TEXT")]
+                + [(metric, "INTEGER") for metric in utils.ROLLUP_METRICS],
+                primary_key=["date"],
+                csv_dump_file=None,
+                without_rowid=True,
+            ),
+            "rollup_daily_by_type": TableDescription(
+                table_name="rollup_daily_by_type",
+                file_path=database_filepath,
+                lock=threading.Lock(),
+                columns=[("date", "TEXT"), ("filetype", "TEXT")]
+                + [(metric, "INTEGER") for metric in utils.ROLLUP_METRICS],
+                primary_key=["date", "filetype"],
+                csv_dump_file=None,
+                without_rowid=True,
             ),
         }
 
-        self.initialize_logger()
-        self.initialize_dirs()
-        self.intialize_tracking_tables()
-
     def initialize_dirs(self) -> None:
         if not os.path.exists(self.scan_config.csv_dump_path):
             os.makedirs(self.scan_config.csv_dump_path)
@@ -82,6 +377,11 @@ class Scan:
         if not os.path.exists(os.path.dirname(self.scan_config.database_filepath)):
             os.makedirs(os.path.dirname(self.scan_config.database_filepath))
 
+        if self.scan_config.shard_by_root and not os.path.exists(
+            self.scan_config.shards_path
+        ):
+            os.makedirs(self.scan_config.shards_path)
+
     def initialize_logger(self) -> None:
         self.logger = logging.getLogger("scan_logger")
         self.logger.setLevel(logging.DEBUG)
@@ -103,143 +403,1024 @@ class Scan:
         if LOG_TO_CONSOLE or self.scan_config.environment == Environment.DEV:
             self.logger.addHandler(console_handler)
 
-    def intialize_tracking_tables(self) -> None:
-        conn, curs = utils.get_sqlite_conn(filepath=self.scan_config.database_filepath)
+    def intialize_tracking_tables(
+        self, tracking_tables: Dict[str, TableDescription]
+    ) -> None:
+        """
+        The database is switched to WAL mode, the pipeline's readers then don't
+        block the writer's transaction (spilled to the database once it outgrows
+        the page cache) and vice versa.
+        """
+        conn, curs = utils.get_sqlite_conn(filepath=tracking_tables["file"].file_path)
+        # Takes effect only in a new database, see "compact_history".
+        curs.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        curs.execute("PRAGMA journal_mode=WAL")
+        existing_tables = {
+            name
+            for (name,) in curs.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"
+            ).fetchall()
+        }
+
+        for table in tracking_tables.values():
+            if table.view_sql is not None:
+                continue
 
-        for table in self.tracking_tables.values():
-            sql = f"""
-                CREATE TABLE IF NOT EXISTS {table.table_name} (
-                    {table.columns_string}
-                    {table.primary_key_string}
-                )
-            """
-            curs.execute(sql)
+            curs.execute(table.create_table_sql)
+            utils.add_missing_columns(curs, table)
+            utils.update_primary_key(curs, table)
+            for index_sql in table.create_indexes_sql:
+                curs.execute(index_sql)
+
+        if curs.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'file'"
+        ).fetchall():
+            self.migrate_file_table(curs, tracking_tables)
+
+        for table in tracking_tables.values():
+            if table.view_sql is not None:
+                curs.execute(f"DROP VIEW IF EXISTS {table.table_name}")
+                curs.execute(f"CREATE VIEW {table.table_name} AS {table.view_sql}")
 
         conn.close()
         curs.close()
 
-    def dump_db_to_csv(self):
+        self.initialize_derived_tables(
+            tracking_tables,
+            build_latest=tracking_tables["file_latest"].table_name
+            not in existing_tables,
+        )
+
+    def migrate_file_table(
+        self, curs: Any, tracking_tables: Dict[str, TableDescription]
+    ) -> None:
+        """
+        Moves records of the "file" table written by older versions of the
+        scanner, with all of the strings repeated in every row, into
+        "file_record" and its dictionaries. The "file" view replaces the table.
+        """
+        file_table = tracking_tables["file"]
+        record_table = tracking_tables["file_record"]
+        error_table = tracking_tables["file_error"]
+        self.logger.debug(f"Migrating file records of {file_table.file_path}.")
+
+        # Tracebacks written before "file_error" existed are deduplicated
+        # as they are, without normalizing them.
+        curs.getconnection().createscalarfunction(
+            "error_fingerprint", utils.get_error_fingerprint, 1, deterministic=True
+        )
+        utils.add_missing_columns(curs, file_table)
+
+        curs.execute("begin")
+        curs.execute("""
+            INSERT OR IGNORE INTO scan_date (date_scanned)
+            SELECT DISTINCT date_scanned FROM file
+            """)
+        curs.execute("""
+            INSERT OR IGNORE INTO filetype (filetype)
+            SELECT DISTINCT filetype FROM file
+            """)
+        curs.execute("""
+            INSERT OR IGNORE INTO path (filepath, filename, filetype_id)
+            SELECT f.filepath, f.filename, t.filetype_id
+            FROM (SELECT DISTINCT filepath, filename, filetype FROM file) as f
+            JOIN filetype as t ON t.filetype = f.filetype
+            """)
+        curs.execute(f"""
+            INSERT OR IGNORE INTO {error_table.table_name} ({error_table.column_names_string})
+            SELECT
+                error_fingerprint(error_traceback),
+                NULL,
+                error_traceback,
+                MIN(date_scanned),
+                MAX(date_scanned)
+            FROM file
+            WHERE
+                error_fingerprint IS NULL
+                AND error_traceback != ''
+            GROUP BY
+                error_traceback
+            """)
+        curs.execute(f"""
+            INSERT OR REPLACE INTO {record_table.table_name} ({record_table.column_names_string})
+            SELECT
+                s.scan_id,
+                p.path_id,
+                f.inode,
+                f.lines,
+                f.date_created,
+                f.date_modified,
+                f.error_occured,
+                f.size,
+                f.mtime_ns,
+                CASE
+                    WHEN f.error_fingerprint IS NULL AND f.error_traceback != ''
+                    THEN error_fingerprint(f.error_traceback)
+                    ELSE f.error_fingerprint END,
+                f.error_class,
+                {", ".join(f"f.{column}" for column, _ in record_table.columns[11:])}
+            FROM file as f
+            JOIN scan_date as s ON s.date_scanned = f.date_scanned
+            JOIN path as p ON p.filepath = f.filepath
+            """)
+        curs.execute("DROP TABLE file")
+        curs.execute("commit")
+
+        # Gives the space of the dropped table back to the file system.
+        curs.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        curs.execute("VACUUM")
+
+    def initialize_derived_tables(
+        self, tracking_tables: Dict[str, TableDescription], build_latest: bool = True
+    ) -> None:
+        """
+        Builds "file_latest" and the rollup tables from the whole "file" history.
+        This happens only once, when the tables are introduced to an existing
+        database. From then on they are updated incrementally by every scan.
+
+        build_latest:   build "file_latest" if it's empty, a shard whose files
+                        all have their latest records kept by other shards
+                        (see "scan_engine.LatestFileOwners") has it empty
+        """
+        file_table = tracking_tables["file"]
+        file_latest_table = tracking_tables["file_latest"]
+        by_type_table = tracking_tables["rollup_daily_by_type"]
+        total_table = tracking_tables["rollup_daily_total"]
+
+        with utils.SqliteCursorWithLock(
+            filepath=file_table.file_path, lock=file_table.lock
+        ) as curs:
+            if not curs.execute(
+                f"SELECT 1 FROM {file_table.table_name} LIMIT 1"
+            ).fetchall():
+                return
+
+            curs.execute("begin")
+
+            if (
+                build_latest
+                and not curs.execute(
+                    f"SELECT 1 FROM {file_latest_table.table_name} LIMIT 1"
+                ).fetchall()
+            ):
+                self.logger.debug("Building latest file records from the file history.")
+                curs.execute(f"""
+                    INSERT INTO {file_latest_table.table_name} ({file_latest_table.column_names_string})
+                    SELECT
+                        {", ".join(f"t1.{column}" for column, _ in file_table.columns)}
+                    FROM {file_table.table_name} as t1
+                    JOIN (
+                        SELECT
+                            inode,
+                            dev,
+                            MAX(date_scanned) as max_date_scanned
+                        FROM {file_table.table_name}
+                        GROUP BY
+                            inode,
+                            dev
+                    ) as t2
+                    ON
+                        t1.inode = t2.inode
+                        AND t1.dev IS t2.dev
+                        AND t1.date_scanned = t2.max_date_scanned
+                    """)
+
+            if not curs.execute(
+                f"SELECT 1 FROM {total_table.table_name} LIMIT 1"
+            ).fetchall():
+                self.logger.debug(
+                    "Building rollup tables from the latest file records."
+                )
+                curs.execute(f"""
+                    INSERT INTO {by_type_table.table_name} ({by_type_table.column_names_string})
+                    SELECT
+                        DATE(date_modified) as date,
+                        filetype,
+                        SUM(CASE
+                            WHEN JULIANDAY(date_modified) - JULIANDAY(date_created) <= 1 THEN lines
+                            ELSE 0 END
+                        ) as new_lines,
+                        SUM(CASE
+                            WHEN JULIANDAY(date_modified) - JULIANDAY(date_created) > 1 THEN lines
+                            ELSE 0 END
+                        ) as lines_modified,
+                        SUM(lines) as total_lines,
+                        SUM(CASE
+                            WHEN JULIANDAY(date_modified) - JULIANDAY(date_created) <= 1 THEN 1
+                            ELSE 0 END
+                        ) as count_new_files,
+                        SUM(CASE
+                            WHEN JULIANDAY(date_modified) - JULIANDAY(date_created) > 1 THEN 1
+                            ELSE 0 END
+                        ) as count_files_modified,
+                        COUNT(*) as count_files
+                    FROM {file_latest_table.table_name}
+                    GROUP BY
+                        DATE(date_modified),
+                        filetype
+                    """)
+                curs.execute(f"""
+                    INSERT INTO {total_table.table_name} ({total_table.column_names_string})
+                    SELECT
+                        date,
+                        {", ".join(f"SUM({metric})" for metric in utils.ROLLUP_METRICS)}
+                    FROM {by_type_table.table_name}
+                    GROUP BY
+                        date
+                    """)
+
+            curs.execute("commit")
+
+    def get_shard_filepath(self, root_path: str) -> str:
+        name = re.sub(r"[^A-Za-z0-9]+", "_", root_path).strip("_")
+        digest = hashlib.sha1(root_path.encode()).hexdigest()[:8]
+        return os.path.join(self.scan_config.shards_path, f"{name}__{digest}.db")
+
+    def create_shard_tracking_tables(
+        self, shard_filepath: str
+    ) -> Dict[str, TableDescription]:
+        """
+        All of the tracking tables except for "MAIN_DATABASE_TABLES".
+        """
+        tracking_tables = self.create_tracking_tables(shard_filepath)
+        for table_name in self.MAIN_DATABASE_TABLES:
+            del tracking_tables[table_name]
+        return tracking_tables
+
+    def intialize_shards(self) -> None:
+        """
+        Brings the tables of every existing shard up to date, shards of roots
+        no longer scanned included, all of them are a part of the union views
+        (see "get_query_conn").
+        """
+        for shard_filepath in sorted(
+            glob.glob(os.path.join(self.scan_config.shards_path, "*.db"))
+        ):
+            self.intialize_tracking_tables(
+                self.create_shard_tracking_tables(shard_filepath)
+            )
+
+    def get_shard_tracking_tables(self, root_path: str) -> Dict[str, TableDescription]:
+        """
+        Tables of the root's shard, a new shard gets the records of the root
+        scanned before it had a shard of its own.
+        """
+        shard_filepath = self.get_shard_filepath(root_path)
+        is_new_shard = not os.path.exists(shard_filepath)
+
+        tracking_tables = self.create_shard_tracking_tables(shard_filepath)
+        self.intialize_tracking_tables(tracking_tables)
+
+        if is_new_shard:
+            self.move_root_to_shard(root_path, tracking_tables)
+
+        return tracking_tables
+
+    def move_root_to_shard(
+        self, root_path: str, shard_tracking_tables: Dict[str, TableDescription]
+    ) -> None:
+        """
+        Moves records of a root scanned before it got its own shard from the main
+        database to the shard and rebuilds the rollup tables of both databases.
+        Otherwise the union views would see the root's latest records twice.
+        """
+        file_table = self.tracking_tables["file"]
+        record_table = self.tracking_tables["file_record"]
+        file_latest_table = self.tracking_tables["file_latest"]
+        shard_filepath = shard_tracking_tables["file"].file_path
+        # Paths under the root, "0" is the character following "/".
+        root_prefix = os.path.join(root_path, "")
+        root_bounds = (root_prefix, f"{root_prefix[:-1]}0")
+
+        with utils.SqliteCursorWithLock(
+            filepath=file_table.file_path, lock=file_table.lock
+        ) as curs:
+            curs.execute("ATTACH DATABASE ? AS shard", (shard_filepath,))
+            curs.execute("begin")
+
+            # The shard has dictionaries of its own, records get its ids.
+            curs.execute("""
+                INSERT OR IGNORE INTO shard.scan_date (date_scanned)
+                SELECT date_scanned FROM main.scan_date
+                """)
+            curs.execute("""
+                INSERT OR IGNORE INTO shard.filetype (filetype)
+                SELECT filetype FROM main.filetype
+                """)
+            curs.execute(
+                """
+                    INSERT OR IGNORE INTO shard.path (filepath, filename, filetype_id)
+                    SELECT p.filepath, p.filename, st.filetype_id
+                    FROM main.path as p
+                    JOIN main.filetype as t ON t.filetype_id = p.filetype_id
+                    JOIN shard.filetype as st ON st.filetype = t.filetype
+                    WHERE p.filepath >= ? AND p.filepath < ?
+                """,
+                root_bounds,
+            )
+            curs.execute(
+                f"""
+                    INSERT INTO shard.{record_table.table_name} ({record_table.column_names_string})
+                    SELECT
+                        ss.scan_id,
+                        sp.path_id,
+                        {", ".join(f"r.{column}" for column, _ in record_table.columns[2:])}
+                    FROM main.path as p
+                    JOIN main.{record_table.table_name} as r ON r.path_id = p.path_id
+                    JOIN main.scan_date as s ON s.scan_id = r.scan_id
+                    JOIN shard.scan_date as ss ON ss.date_scanned = s.date_scanned
+                    JOIN shard.path as sp ON sp.filepath = p.filepath
+                    WHERE p.filepath >= ? AND p.filepath < ?
+                """,
+                root_bounds,
+            )
+            curs.execute(
+                f"""
+                    DELETE FROM main.{record_table.table_name}
+                    WHERE path_id IN (
+                        SELECT path_id FROM main.path
+                        WHERE filepath >= ? AND filepath < ?
+                    )
+                """,
+                root_bounds,
+            )
+            moved_rows = curs.getconnection().changes()
+            curs.execute(
+                "DELETE FROM main.path WHERE filepath >= ? AND filepath < ?",
+                root_bounds,
+            )
+
+            curs.execute(
+                f"""
+                    INSERT INTO shard.{file_latest_table.table_name} ({file_latest_table.column_names_string})
+                    SELECT {file_latest_table.column_names_string} FROM main.{file_latest_table.table_name}
+                    WHERE filepath >= ? AND filepath < ?
+                """,
+                root_bounds,
+            )
+            curs.execute(
+                f"""
+                    DELETE FROM main.{file_latest_table.table_name}
+                    WHERE filepath >= ? AND filepath < ?
+                """,
+                root_bounds,
+            )
+            moved_rows += curs.getconnection().changes()
+
+            # Errors go with the records referring to them, the ones still
+            # referred to by the main database's records stay there as well.
+            error_table = self.tracking_tables["file_error"]
+            curs.execute(f"""
+                    INSERT OR IGNORE INTO shard.{error_table.table_name}
+                    SELECT * FROM main.{error_table.table_name}
+                    WHERE error_fingerprint IN (
+                        SELECT error_fingerprint FROM shard.{record_table.table_name}
+                    )
+                """)
+            curs.execute(f"""
+                    DELETE FROM main.{error_table.table_name}
+                    WHERE
+                        error_fingerprint IN (
+                            SELECT error_fingerprint FROM shard.{error_table.table_name}
+                        )
+                        AND error_fingerprint NOT IN (
+                            SELECT error_fingerprint FROM main.{record_table.table_name}
+                            WHERE error_fingerprint IS NOT NULL
+                        )
+                """)
+
+            if moved_rows:
+                for table_name in ["rollup_daily_total", "rollup_daily_by_type"]:
+                    curs.execute(f"DELETE FROM main.{table_name}")
+
+            curs.execute("commit")
+            curs.execute("DETACH DATABASE shard")
+
+        if moved_rows:
+            self.logger.debug(f"Moved records of {root_path} to {shard_filepath}.")
+            self.initialize_derived_tables(self.tracking_tables)
+            self.initialize_derived_tables(shard_tracking_tables)
+
+    def check_shard_count(
+        self, n_shards: int, conn: Optional[apsw.Connection] = None
+    ) -> None:
+        """
+        All of the shards are attached to the query connection, their number is
+        limited by SQLite's "SQLITE_MAX_ATTACHED" (10 unless SQLite was compiled
+        with a higher one).
+        """
+        max_shards = utils.raise_attached_databases_limit(conn)
+        if n_shards > max_shards:
+            raise Exception(
+                f"Too many shards in {self.scan_config.shards_path}, expected at most "
+                f"{max_shards} (SQLITE_MAX_ATTACHED), received: {n_shards}."
+            )
+
+    def get_query_conn(self) -> Tuple[apsw.Connection, Any]:
+        """
+        Connection to the main database with all of the shards attached. Every
+        table kept in shards is shadowed by a temporary view of the same name
+        unioning the main database's table with the shards' ones, so queries
+        don't need to know about the shards at all.
+        """
+        conn, curs = utils.get_sqlite_conn(self.scan_config.database_filepath)
+
+        shard_filepaths = sorted(
+            glob.glob(os.path.join(self.scan_config.shards_path, "*.db"))
+        )
+        if not shard_filepaths:
+            return conn, curs
+
+        try:
+            self.check_shard_count(len(shard_filepaths), conn)
+        except Exception:
+            conn.close()
+            raise
+
+        schemas = ["main"]
+        for i, shard_filepath in enumerate(shard_filepaths):
+            schemas.append(f"shard_{i}")
+            curs.execute(f"ATTACH DATABASE ? AS {schemas[-1]}", (shard_filepath,))
+
         for table in self.tracking_tables.values():
-            conn, curs = utils.get_sqlite_conn(
-                filepath=self.scan_config.database_filepath
+            if (
+                table.table_name in self.MAIN_DATABASE_TABLES
+                or table.table_name in self.DATABASE_LOCAL_TABLES
+            ):
+                continue
+
+            union_sql = " UNION ALL ".join(
+                f"SELECT {table.column_names_string} FROM {schema}.{table.table_name}"
+                for schema in schemas
             )
-            sql = f"""
-                SELECT * FROM {table.table_name}
-            """
-            curs.execute(sql)
-            try:
-                df = utils.pandas_read_sql_without_warnings(sql, conn)
-                df.to_csv(table.csv_dump_file, index=False, header=True)
-            except apsw.ExecutionCompleteError:
-                # Apparently, this exception will be thrown when pandas
-                # is tring to get column description (curs.description) when
-                # no recrods exist in the queried table. Therefore we are skipping
-                # this error.
-                self.logger.debug("Skipping write to csv. No records found.")
+            merge_sql = self.MERGED_TABLES.get(table.table_name)
+            if merge_sql is not None:
+                union_sql = merge_sql.format(union_sql=union_sql)
+            curs.execute(f"CREATE TEMP VIEW {table.table_name} AS {union_sql}")
+
+        return conn, curs
+
+    def dump_db(self):
+        """
+        Streams the tables into files of the configured export format.
+        Partitioned tables are dumped one file per scan date, only missing
+        partitions and the latest one (the current scan) are written, older
+        ones are never rewritten.
+        """
+        export_format = self.scan_config.export_format
+        conn, curs = self.get_query_conn()
+
+        for table in self.tracking_tables.values():
+            if table.csv_dump_file is None:
+                continue
+
+            column_types = dict(table.columns)
+
+            if table.csv_partition_column is None:
+                utils.write_query(
+                    curs,
+                    f"SELECT * FROM {table.table_name}",
+                    table.csv_dump_file,
+                    export_format=export_format,
+                    column_types=column_types,
+                )
+                continue
+
+            os.makedirs(table.csv_dump_file, exist_ok=True)
+            partition_dates = self.get_partition_dates(curs, table)
+
+            for i, date in enumerate(partition_dates):
+                filepath = os.path.join(table.csv_dump_file, date)
+                if (
+                    os.path.exists(f"{filepath}{export_format.extension}")
+                    and i < len(partition_dates) - 1
+                ):
+                    continue
+
+                n_rows = utils.write_query(
+                    curs,
+                    f"""
+                        SELECT * FROM {table.table_name}
+                        WHERE
+                            {table.csv_partition_column} >= ?
+                            AND {table.csv_partition_column} < ?
+                    """,
+                    filepath,
+                    export_format=export_format,
+                    column_types=column_types,
+                    bindings=(date, self.get_next_date(date)),
+                )
+                self.logger.debug(
+                    f"Dumped {n_rows} rows of {table.table_name} ({date})."
+                )
+
+        curs.close()
+        conn.close()
+
+    def compact_history(self, now: Optional[datetime] = None) -> None:
+        """
+        Applies "ScanConfig.retention" to the file records of the main database
+        and of the shards. Only the scans that fell out of their level since
+        the previous run are deleted, they are removed by the prefix of the
+        "file_record" key and the freed pages are given back to the file system.
+        """
+        retention = self.scan_config.retention
+        if retention.daily_days is None:
+            return
+
+        now = now or datetime.now()
+        daily_cutoff = utils.get_sqlite_datetime(
+            now - timedelta(days=retention.daily_days)
+        )
+        weekly_cutoff = (
+            utils.get_sqlite_datetime(now - timedelta(days=retention.weekly_days))
+            if retention.weekly_days is not None
+            else None
+        )
+        record_table = self.tracking_tables["file_record"]
+        scan_date_table = self.tracking_tables["scan_date"]
+
+        database_filepaths = [self.scan_config.database_filepath] + sorted(
+            glob.glob(os.path.join(self.scan_config.shards_path, "*.db"))
+        )
+        for database_filepath in database_filepaths:
+            conn, curs = utils.get_sqlite_conn(database_filepath)
+            scans = curs.execute(
+                f"SELECT scan_id, date_scanned FROM {scan_date_table.table_name}"
+            ).fetchall()
+            expired_scan_ids = self.get_expired_scan_ids(
+                scans, daily_cutoff, weekly_cutoff
+            )
+
+            if expired_scan_ids:
+                curs.execute("begin")
+                for scan_id in expired_scan_ids:
+                    curs.execute(
+                        f"DELETE FROM {record_table.table_name} WHERE scan_id = ?",
+                        (scan_id,),
+                    )
+                    curs.execute(
+                        f"DELETE FROM {scan_date_table.table_name} WHERE scan_id = ?",
+                        (scan_id,),
+                    )
+                curs.execute("commit")
+                self.logger.debug(
+                    f"Compacted {len(expired_scan_ids)} scans of {database_filepath}."
+                )
+
+                # Databases created before the incremental mode was enabled
+                # are converted once.
+                ((auto_vacuum,),) = curs.execute("PRAGMA auto_vacuum").fetchall()
+                if auto_vacuum != 2:
+                    curs.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                    curs.execute("VACUUM")
+                curs.execute("PRAGMA incremental_vacuum").fetchall()
 
             curs.close()
             conn.close()
 
-    def create_daily_file_report(self):
-        daily_report_total = os.path.join(
-            self.scan_config.reports_path, "daily_total.csv"
-        )
-        daily_report_by_type = os.path.join(
-            self.scan_config.reports_path, "daily_by_type.csv"
+    @staticmethod
+    def get_expired_scan_ids(
+        scans: List[Tuple[int, str]], daily_cutoff: str, weekly_cutoff: Optional[str]
+    ) -> List[int]:
+        """
+        Scans older than "daily_cutoff" that are not the last scan of their week
+        and scans older than "weekly_cutoff" that are not the last remaining
+        scan of their month. Months are downsampled from the weekly scans only,
+        otherwise a month whose last scan was dropped by the weekly level
+        would lose all of its scans.
+        """
+
+        def get_week(date_scanned: str) -> str:
+            day = datetime.strptime(date_scanned[:10], "%Y-%m-%d")
+            return (day - timedelta(days=day.weekday())).strftime("%Y-%m-%d")
+
+        def get_last_scans(
+            scans: List[Tuple[int, str]], get_period: Callable[[str], str]
+        ) -> Dict[str, str]:
+            last_scans: Dict[str, str] = {}  # period -> date of its last scan
+            for _, date_scanned in scans:
+                period = get_period(date_scanned)
+                last_scans[period] = max(last_scans.get(period, ""), date_scanned)
+            return last_scans
+
+        expired_scan_ids = []
+        weekly_scans = []
+        last_weekly_scans = get_last_scans(scans, get_week)
+        for scan_id, date_scanned in scans:
+            if (
+                date_scanned < daily_cutoff
+                and last_weekly_scans[get_week(date_scanned)] != date_scanned
+            ):
+                expired_scan_ids.append(scan_id)
+            else:
+                weekly_scans.append((scan_id, date_scanned))
+
+        if weekly_cutoff is None:
+            return expired_scan_ids
+
+        last_monthly_scans = get_last_scans(weekly_scans, lambda date: date[:7])
+        for scan_id, date_scanned in weekly_scans:
+            if (
+                date_scanned < min(daily_cutoff, weekly_cutoff)
+                and last_monthly_scans[date_scanned[:7]] != date_scanned
+            ):
+                expired_scan_ids.append(scan_id)
+
+        return expired_scan_ids
+
+    @staticmethod
+    def get_next_date(date: str) -> str:
+        return (datetime.strptime(date, "%Y-%m-%d") + timedelta(days=1)).strftime(
+            "%Y-%m-%d"
         )
 
+    def get_partition_dates(self, curs: Any, table: TableDescription) -> List[str]:
+        """
+        Distinct dates of the table's partition column. Jumps through the column's
+        index from one date to the next one instead of reading the whole table.
+        Every database (main and shards) is searched on its own, the index can't
+        be used through the union view.
+        """
+        column = table.csv_partition_column
+        table_name = table.csv_partition_table or table.table_name
+        dates: Set[str] = set()
+
+        for _, schema, _ in curs.execute("PRAGMA database_list").fetchall():
+            if schema == "temp":
+                continue
+
+            lower_bound = ""
+            while True:
+                ((value,),) = curs.execute(
+                    f"SELECT MIN({column}) FROM {schema}.{table_name} WHERE {column} >= ?",
+                    (lower_bound,),
+                ).fetchall()
+                if value is None:
+                    break
+
+                dates.add(value[:10])
+                lower_bound = self.get_next_date(value[:10])
+
+        return sorted(dates)
+
+    def create_daily_file_report(self):
+        """
+        Writes daily, weekly and monthly reports. All of them are read from
+        the small rollup tables, the "file" history is never aggregated here.
+        """
         if os.path.exists(self.scan_config.reports_path):
             shutil.rmtree(self.scan_config.reports_path)
 
         os.makedirs(self.scan_config.reports_path)
 
-        conn, curs = utils.get_sqlite_conn(self.tracking_tables["file"].file_path)
+        total_table = self.tracking_tables["rollup_daily_total"]
+        by_type_table = self.tracking_tables["rollup_daily_by_type"]
 
-        sql = f"""
-            SELECT
-                DATE(date_modified) as date,
-                filetype,
-                SUM(CASE 
-                    WHEN JULIANDAY(date_modified) - JULIANDAY(date_created) <= 1 THEN lines 
-                    ELSE 0 END
-                ) as new_lines,
-                SUM(CASE 
-                    WHEN JULIANDAY(date_modified) - JULIANDAY(date_created) > 1 THEN lines 
-                    ELSE 0 END
-                ) as lines_modified,
-                SUM(lines) as total_lines,
-                SUM(CASE 
-                    WHEN JULIANDAY(date_modified) - JULIANDAY(date_created) <= 1 THEN 1 
-                    ELSE 0 END
-                ) as count_new_files,
-                SUM(CASE 
-                    WHEN JULIANDAY(date_modified) - JULIANDAY(date_created) > 1 THEN 1 
-                    ELSE 0 END
-                ) as count_files_modified,
-                COUNT(*) as count_files
-            FROM {self.tracking_tables["file"].table_name} as t1
-            JOIN (                                              -- use this join to get only the latest record for
-                                                                -- each file to avoid counting duplicates
-                SELECT 
-                    inode,
-                    MAX(date_scanned) as max_date_scanned
-                FROM {self.tracking_tables["file"].table_name}
+        # Start of the period each date falls into.
+        periods = {
+            "daily": "date",
+            "weekly": "DATE(date, 'weekday 0', '-6 days')",  # monday of the week
+            "monthly": "DATE(date, 'start of month')",
+        }
+
+        column_types = {**dict(by_type_table.columns), "date": "DATE"}
+
+        conn, curs = self.get_query_conn()
+
+        for period_name, period_start in periods.items():
+            sql = f"""
+                SELECT
+                    {period_start} as date,
+                    filetype,
+                    SUM(new_lines) as new_lines,
+                    SUM(lines_modified) as lines_modified,
+                    SUM(total_lines) as total_lines,
+                    SUM(count_new_files) as count_new_files,
+                    SUM(count_files_modified) as count_files_modified,
+                    SUM(count_files) as count_files
+                FROM {by_type_table.table_name}
+                WHERE
+                    count_files > 0
                 GROUP BY
-                    inode
-            ) as t2
-            ON t1.inode = t2.inode AND t1.date_scanned = t2.max_date_scanned
-            GROUP BY 
-                DATE(date_modified),
-                filetype
-            ORDER BY 
-                DATE(date_modified)
+                    {period_start},
+                    filetype
+                ORDER BY
+                    {period_start}
+            """
+
+            utils.write_query(
+                curs,
+                sql,
+                os.path.join(self.scan_config.reports_path, f"{period_name}_by_type"),
+                export_format=self.scan_config.export_format,
+                column_types=column_types,
+            )
+
+            sql = f"""
+                SELECT
+                    {period_start} as date,
+                    SUM(new_lines) as new_lines,
+                    SUM(lines_modified) as lines_modified,
+                    SUM(total_lines) as total_lines,
+                    SUM(count_files_modified) as count_files_modified,
+                    SUM(count_new_files) as count_new_files,
+                    SUM(count_files) as count_files
+                FROM {total_table.table_name}
+                WHERE
+                    count_files > 0
+                GROUP BY
+                    {period_start}
+                ORDER BY
+                    {period_start}
+            """
+
+            utils.write_query(
+                curs,
+                sql,
+                os.path.join(self.scan_config.reports_path, f"{period_name}_total"),
+                export_format=self.scan_config.export_format,
+                column_types=column_types,
+            )
+
+        curs.close()
+        conn.close()
+
+    def perform_scan(self, scan_start_time: datetime) -> ScanStat:
+        """
+        Scans all of the configured roots and stores the results. The roots are
+        scanned in parallel by a staged pipeline, see "ScanPipeline".
         """
+        start_time = time.time()
+
+        def on_root_done(root: RootScan) -> None:
+            self.logger.debug(
+                f"Scanned {root.root_path} in {root.elapsed_time}s. Files scanned: {root.files_scanned}. Files skipped: {root.files_skipped}."
+            )
 
-        df = utils.pandas_read_sql_without_warnings(sql, conn)
-        df.to_csv(daily_report_by_type, index=False, header=True)
+        for root_path in self.scan_config.scan_paths:
+            self.logger.debug(f"Scanning root dir: {root_path}")
 
-        sql = f"""
-            SELECT
-                DATE(date_modified) as date,
-                SUM(CASE 
-                    WHEN JULIANDAY(date_modified) - JULIANDAY(date_created) <= 1 THEN lines 
-                    ELSE 0 END
-                ) as new_lines,
-                SUM(CASE 
-                    WHEN JULIANDAY(date_modified) - JULIANDAY(date_created) > 1 THEN lines 
-                    ELSE 0 END
-                ) as lines_modified,
-                SUM(lines) as total_lines,
-                SUM(CASE 
-                    WHEN JULIANDAY(date_modified) - JULIANDAY(date_created) > 1 THEN 1 
-                    ELSE 0 END
-                ) as count_files_modified,
-                SUM(CASE 
-                    WHEN JULIANDAY(date_modified) - JULIANDAY(date_created) <= 1 THEN 1 
-                    ELSE 0 END
-                ) as count_new_files,
-                COUNT(*) as count_files
-            FROM {self.tracking_tables["file"].table_name} as t1
-            JOIN (                                              -- use this join to get only the latest record for
-                                                                -- each file to avoid counting duplicates
-                SELECT 
-                    inode,
-                    MAX(date_scanned) as max_date_scanned 
-                FROM {self.tracking_tables["file"].table_name}
-                GROUP BY 
-                    inode
-            ) as t2 
-            ON t1.inode = t2.inode AND t1.date_scanned = t2.max_date_scanned
-            GROUP BY
-                DATE(date_modified)
+        if self.scan_config.incremental_scan:
+            self.logger.debug("Incremental scan.")
+
+        analysis_columns = [
+            column
+            for column, _ in analyzers.get_analyzer_columns(
+                analyzers.get_analyzers(self.scan_config.analyzers)
+            )
+        ]
+        if self.scan_config.shard_by_root:
+            # Checked before the scan, its results couldn't be queried otherwise.
+            self.check_shard_count(
+                len(
+                    set(glob.glob(os.path.join(self.scan_config.shards_path, "*.db")))
+                    | {
+                        self.get_shard_filepath(root_path)
+                        for root_path in self.scan_config.scan_paths
+                    }
+                )
+            )
+            shards = {
+                root_path: Shard(
+                    tracking_tables=self.get_shard_tracking_tables(root_path),
+                    tracking_cache_enabled=self.scan_config.tracking_cache_enabled,
+                    incremental_scan=self.scan_config.incremental_scan,
+                    listing_cache_enabled=self.scan_config.listing_cache_enabled,
+                    analysis_columns=analysis_columns,
+                )
+                for root_path in self.scan_config.scan_paths
+            }
+        else:
+            shard = Shard(
+                tracking_tables=self.tracking_tables,
+                tracking_cache_enabled=self.scan_config.tracking_cache_enabled,
+                incremental_scan=self.scan_config.incremental_scan,
+                listing_cache_enabled=self.scan_config.listing_cache_enabled,
+                analysis_columns=analysis_columns,
+            )
+            shards = {root_path: shard for root_path in self.scan_config.scan_paths}
+
+        pipeline = ScanPipeline(
+            scan_config=self.scan_config,
+            scan_start_time=scan_start_time,
+            shards=shards,
+            on_root_done=on_root_done,
+        )
+        try:
+            roots = pipeline.run(self.scan_config.scan_paths)
+        finally:
+            pipeline.close()
+
+        date_scanned = utils.get_sqlite_datetime(scan_start_time)
+        scan_stat = ScanStat(
+            date_scanned=date_scanned,
+            scan_time=round(time.time() - start_time, 2),
+            files_scanned=sum(root.files_scanned for root in roots),
+            files_skipped=sum(root.files_skipped for root in roots),
+            bytes_read=sum(root.phases["line_count"].bytes_read for root in roots),
+            # Kilobytes on Linux.
+            peak_rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            dirs_deferred=sum(len(root.deferred_dirs) for root in roots),
+            large_files_left=sum(root.large_files_left for root in roots),
+        )
+        phase_stats = [
+            ScanPhaseStat(
+                date_scanned=date_scanned,
+                root_path=root.root_path,
+                phase=phase,
+                busy_time=round(phase_stat.busy_time, 3),
+                items=phase_stat.items,
+                bytes_read=phase_stat.bytes_read,
+            )
+            for root in roots
+            for phase, phase_stat in root.phases.items()
+        ]
+        slow_file_stats = [
+            SlowFileStat(
+                date_scanned=date_scanned,
+                root_path=root.root_path,
+                filepath=file_stat.filepath,
+                stat_time=round(stat_time, 6),
+                line_count_time=round(line_count_time, 6),
+                size=file_stat.size,
+                bytes_read=file_stat.bytes_read,
+                lines=file_stat.lines,
+            )
+            for line_count_time, root, (*_, stat_time), file_stat in (
+                pipeline.slowest_files
+            )
+        ]
+
+        utils.insert_data(self.tracking_tables["scan"], [scan_stat])
+        for shard in pipeline.unique_shards:
+            checkpoint_table = shard.tracking_tables["scan_checkpoint"]
+            with utils.SqliteCursorWithLock(
+                filepath=checkpoint_table.file_path, lock=checkpoint_table.lock
+            ) as curs:
+                curs.execute(
+                    f"DELETE FROM {checkpoint_table.table_name} WHERE date_scanned = ?",
+                    (date_scanned,),
+                )
+            self.prune_tracking_cache(
+                shard, [root for root in roots if root.shard is shard], date_scanned
+            )
+        utils.insert_data(self.tracking_tables["scan_phase"], phase_stats)
+        utils.insert_data(self.tracking_tables["scan_slow_file"], slow_file_stats)
+        for root in roots:
+            self.update_dir_history(root, date_scanned)
+        self.log_scan_summary(scan_stat, phase_stats, slow_file_stats)
+
+        return scan_stat
+
+    def prune_tracking_cache(
+        self, shard: Shard, roots: List[RootScan], date_scanned: str
+    ) -> None:
+        """
+        Forgets the cached xattrs of files the scan didn't see (deleted or
+        excluded since), the entries of the files seen were written with
+        the scan's date. Only once all of the shard's roots were walked
+        completely.
+        """
+        if not self.scan_config.tracking_cache_enabled or any(
+            root.deferred_dirs for root in roots
+        ):
+            return
+
+        tracking_cache_table = shard.tracking_tables["tracking_cache"]
+        with utils.SqliteCursorWithLock(
+            filepath=tracking_cache_table.file_path, lock=tracking_cache_table.lock
+        ) as curs:
+            curs.execute(
+                f"""
+                    DELETE FROM {tracking_cache_table.table_name}
+                    WHERE date_last_seen IS NULL OR date_last_seen < ?
+                """,
+                (date_scanned,),
+            )
+
+    # Weight of the latest scan in the directories' "change_rate".
+    DIR_CHANGE_RATE_WEIGHT = 0.3
+
+    def update_dir_history(self, root: RootScan, date_scanned: str) -> None:
+        """
+        Updates the change rate (exponential moving average of whether any of
+        the directory's files changed) of the root's walked directories and
+        marks its deferred directories. Once a root is walked completely,
+        directories that no longer exist are forgotten (along with their
+        cached listings).
         """
+        dir_history_table = root.shard.tracking_tables["dir_history"]
+        dir_listing_table = root.shard.tracking_tables["dir_listing"]
+        weight = self.DIR_CHANGE_RATE_WEIGHT
+
+        with utils.SqliteCursorWithLock(
+            filepath=dir_history_table.file_path, lock=dir_history_table.lock
+        ) as curs:
+            curs.execute("begin")
+            curs.executemany(
+                f"""
+                    INSERT INTO {dir_history_table.table_name} ({dir_history_table.column_names_string})
+                    VALUES ({dir_history_table.columns_placeholder_string})
+                    ON CONFLICT (dirpath) DO UPDATE SET
+                        change_rate = change_rate * {1 - weight} + excluded.change_rate * {weight},
+                        date_last_scanned = excluded.date_last_scanned,
+                        date_last_changed = COALESCE(excluded.date_last_changed, date_last_changed),
+                        deferred = 0
+                """,
+                [
+                    (
+                        dirpath,
+                        root.root_path,
+                        1.0 if changed else 0.0,
+                        date_scanned,
+                        date_scanned if changed else None,
+                        0,
+                    )
+                    for dirpath in root.walked_dirs
+                    for changed in [dirpath in root.changed_dirs]
+                ],
+            )
+            curs.executemany(
+                f"""
+                    INSERT INTO {dir_history_table.table_name} ({dir_history_table.column_names_string})
+                    VALUES ({dir_history_table.columns_placeholder_string})
+                    ON CONFLICT (dirpath) DO UPDATE SET deferred = 1
+                """,
+                [
+                    (dirpath, root.root_path, 1.0, None, None, 1)
+                    for dirpath in root.deferred_dirs
+                ],
+            )
+            if not root.deferred_dirs:
+                curs.execute(
+                    f"""
+                        DELETE FROM {dir_history_table.table_name}
+                        WHERE
+                            root_path = ?
+                            AND (date_last_scanned IS NULL OR date_last_scanned < ?)
+                    """,
+                    (root.root_path, date_scanned),
+                )
+                curs.execute(f"""
+                        DELETE FROM {dir_listing_table.table_name}
+                        WHERE dirpath NOT IN (
+                            SELECT dirpath FROM {dir_history_table.table_name}
+                        )
+                    """)
+            curs.execute("commit")
+
+        if root.deferred_dirs:
+            self.logger.debug(
+                f"Time budget spent, deferred {len(root.deferred_dirs)} directories of {root.root_path}."
+            )
+
+    def log_scan_summary(
+        self,
+        scan_stat: ScanStat,
+        phase_stats: List[ScanPhaseStat],
+        slow_file_stats: List[SlowFileStat],
+    ) -> None:
+        mib = 1024 * 1024
+        self.logger.debug(
+            f"Scan took {scan_stat.scan_time}s. Files scanned: {scan_stat.files_scanned}. "
+            f"Read {scan_stat.bytes_read / mib:.1f} MiB. Peak RSS: {scan_stat.peak_rss / mib:.1f} MiB."
+        )
+
+        # Phases of all of the roots together, time is summed over the workers.
+        for phase in PHASES:
+            stats = [stat for stat in phase_stats if stat.phase == phase]
+            self.logger.debug(
+                f"Phase {phase}: {sum(stat.busy_time for stat in stats):.2f}s busy, "
+                f"{sum(stat.items for stat in stats)} items."
+            )
 
-        df = utils.pandas_read_sql_without_warnings(sql, conn)
-        df.to_csv(daily_report_total, index=False, header=True)
+        for slow_file_stat in slow_file_stats:
+            self.logger.debug(
+                f"Slow file: {slow_file_stat.filepath} read in {slow_file_stat.line_count_time:.3f}s "
+                f"({slow_file_stat.size / mib:.1f} MiB, stat {slow_file_stat.stat_time:.3f}s)."
+            )
 
+    def resume_scan_start_time(self) -> Optional[datetime]:
+        """
+        Start time of the latest scan that was interrupted before it finished,
+        running the scan again with the same start time resumes it.
+        """
+        conn, curs = self.get_query_conn()
+        sql = f"""
+            SELECT MAX(date_scanned) FROM {self.tracking_tables["scan_checkpoint"].table_name}
+            WHERE date_scanned NOT IN (
+                SELECT date_scanned FROM {self.tracking_tables["scan"].table_name}
+            )
+        """
+        ((date_scanned,),) = curs.execute(sql).fetchall()
         curs.close()
         conn.close()
 
+        if date_scanned is None:
+            return None
+        return utils.datetime_from_sqlite_datetime(date_scanned)
+
     def should_perform_scan(self) -> bool:
         conn, curs = utils.get_sqlite_conn(self.tracking_tables["scan"].file_path)
         sql = f"""
@@ -318,61 +1499,24 @@ if __name__ == "__main__":
 
     start_time = time.time()
     try:
-        if scan.should_perform_scan():
-            files_scanned = 0
-            files_skipped = 0
-            current_datetime = datetime.now()
-
-            # TODO: can this be reasonably parallelized?
-            for root_path in scan_config.scan_paths:
-                scan.logger.debug(f"Scanning root dir: {root_path}")
-
-                current_dir_files_scanned = 0
-                current_dir_files_skipped = 0
-                current_dir_scan_start_time = time.time()
-                file_stats: List[FileStat] = []
-
-                for foldername, subfolders, filenames in os.walk(root_path):
-                    for filename in filenames:
-                        filepath = os.path.join(foldername, filename)
-                        if utils.is_tracked(filepath):
-                            file_stat = utils.collect_file_stats(
-                                filepath=filepath, scan_start_time=current_datetime
-                            )
-                            file_stats.append(file_stat)
-                            current_dir_files_scanned += 1
-                            files_scanned += 1
-                        else:
-                            current_dir_files_skipped += 1
-                            files_skipped += 1
-
-                utils.insert_data(scan.tracking_tables["file"], file_stats)
-                current_dir_elapsed_time = round(
-                    time.time() - current_dir_scan_start_time, 2
-                )
-                scan.logger.debug(
-                    f"Scanned {root_path} in {current_dir_elapsed_time}s. Files scanned: {current_dir_files_scanned}. Files skipped: {current_dir_files_skipped}."
-                )
-
-            total_scan_time = round(time.time() - start_time, 2)
-            utils.insert_data(
-                scan.tracking_tables["scan"],
-                [
-                    ScanStat(
-                        date_scanned=utils.get_sqlite_datetime(current_datetime),
-                        scan_time=total_scan_time,
-                        files_scanned=files_scanned,
-                        files_skipped=files_skipped,
-                    )
-                ],
+        resume_scan_start_time = scan.resume_scan_start_time()
+        if resume_scan_start_time is not None:
+            scan.logger.debug(
+                f"Resuming interrupted scan started at {resume_scan_start_time}."
             )
+            scan.perform_scan(scan_start_time=resume_scan_start_time)
+
+        elif scan.should_perform_scan():
+            scan.perform_scan(scan_start_time=datetime.now())
 
         else:
             scan.logger.debug(
                 f"Skipping scan. The cooldown period ({scan_config.scan_period_wait_time_hours} hours) has not elapsed yet."
             )
 
-        scan.dump_db_to_csv()
+        scan.dump_db()
+        # Every scan is dumped before its records can be downsampled.
+        scan.compact_history()
         scan.create_daily_file_report()
     except Exception:
         scan.logger.error(str(traceback.format_exc()).replace("\n", ","))
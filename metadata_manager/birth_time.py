@@ -0,0 +1,132 @@
+"""
+Birth time of files read through the "statx" syscall. Used by both the metadata
+manager and the file scanner (imported as "metadata_manager.birth_time"), so it
+must not depend on anything else of the metadata manager.
+"""
+
+import ctypes
+import errno
+import os
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+# Linux doesn't expose file's birth time through "os.stat", but the "statx"
+# syscall (glibc >= 2.28) does. Calling it through ctypes is orders of magnitude
+# cheaper than spawning "stat -c %W" for every file.
+AT_FDCWD = -100
+AT_SYMLINK_NOFOLLOW = 0x100
+STATX_BTIME = 0x800
+
+
+class StatxTimestamp(ctypes.Structure):
+    _fields_ = [
+        ("tv_sec", ctypes.c_int64),
+        ("tv_nsec", ctypes.c_uint32),
+        ("reserved", ctypes.c_int32),
+    ]
+
+
+class Statx(ctypes.Structure):
+    _fields_ = [
+        ("stx_mask", ctypes.c_uint32),
+        ("stx_blksize", ctypes.c_uint32),
+        ("stx_attributes", ctypes.c_uint64),
+        ("stx_nlink", ctypes.c_uint32),
+        ("stx_uid", ctypes.c_uint32),
+        ("stx_gid", ctypes.c_uint32),
+        ("stx_mode", ctypes.c_uint16),
+        ("spare0", ctypes.c_uint16),
+        ("stx_ino", ctypes.c_uint64),
+        ("stx_size", ctypes.c_uint64),
+        ("stx_blocks", ctypes.c_uint64),
+        ("stx_attributes_mask", ctypes.c_uint64),
+        ("stx_atime", StatxTimestamp),
+        ("stx_btime", StatxTimestamp),
+        ("stx_ctime", StatxTimestamp),
+        ("stx_mtime", StatxTimestamp),
+        ("stx_rdev_major", ctypes.c_uint32),
+        ("stx_rdev_minor", ctypes.c_uint32),
+        ("stx_dev_major", ctypes.c_uint32),
+        ("stx_dev_minor", ctypes.c_uint32),
+        ("spare2", ctypes.c_uint64 * 14),
+    ]
+
+
+def load_statx() -> Optional[Any]:
+    try:
+        statx = ctypes.CDLL(None, use_errno=True).statx
+    except (OSError, AttributeError):
+        return None
+
+    statx.argtypes = [
+        ctypes.c_int,
+        ctypes.c_char_p,
+        ctypes.c_int,
+        ctypes.c_uint,
+        ctypes.POINTER(Statx),
+    ]
+    statx.restype = ctypes.c_int
+    return statx
+
+
+STATX = load_statx()
+
+
+def read_birth_time(dir_fd: int, name: bytes, buf: Statx) -> int:
+    """
+    Returns birth time of the file "name" relative to the "dir_fd" directory.
+    Same as "stat -c %W", symlinks are not followed and 0 is returned when
+    the filesystem doesn't record birth time.
+    """
+    if STATX is not None:
+        if (
+            STATX(dir_fd, name, AT_SYMLINK_NOFOLLOW, STATX_BTIME, ctypes.byref(buf))
+            == 0
+        ):
+            return buf.stx_btime.tv_sec if buf.stx_mask & STATX_BTIME else 0
+
+        err = ctypes.get_errno()
+        if err != errno.ENOSYS:
+            raise OSError(err, os.strerror(err), os.fsdecode(name))
+
+    # Fallback for platforms without "statx". Some of them (BSD, macOS) provide
+    # birth time directly in "os.stat" result.
+    file_stat = os.stat(
+        name, dir_fd=None if dir_fd == AT_FDCWD else dir_fd, follow_symlinks=False
+    )
+    return int(getattr(file_stat, "st_birthtime", 0))
+
+
+def read_birth_times(
+    filepaths: Sequence[Union[str, "os.PathLike[str]"]],
+) -> List[Optional[int]]:
+    """
+    Returns birth time of each of the files (see "read_birth_time") or None if it
+    couldn't be read. Files of the same directory are looked up relative to
+    a single directory file descriptor, so a whole directory costs one open and
+    one syscall per file.
+    """
+    timestamps: List[Optional[int]] = [None] * len(filepaths)
+    buf = Statx()
+
+    indices_by_dir: Dict[str, List[int]] = {}
+    for i, filepath in enumerate(filepaths):
+        dirpath = os.path.dirname(os.fspath(filepath)) or "."
+        indices_by_dir.setdefault(dirpath, []).append(i)
+
+    for dirpath, indices in indices_by_dir.items():
+        try:
+            dir_fd = os.open(dirpath, os.O_RDONLY | getattr(os, "O_DIRECTORY", 0))
+        except OSError:
+            continue
+
+        try:
+            for i in indices:
+                name = os.path.basename(os.fspath(filepaths[i]))
+                try:
+                    timestamps[i] = read_birth_time(dir_fd, os.fsencode(name), buf)
+                except OSError:
+                    pass
+        finally:
+            os.close(dir_fd)
+
+    return timestamps
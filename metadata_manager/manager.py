@@ -430,10 +430,14 @@ class MetadataManager:
         session: Session,
         filepath: Path,
         branch_name: Optional[str] = None,
+        timestamp_created: Optional[Union[datetime, Exception]] = None,
     ) -> Optional[List[Exception]]:
         """
         Refreshes exising repository file record. Adds new history record and
         recreates hash file.
+
+        timestamp_created:  birth time of the file if it was already looked up
+                            (see "md_utils.get_files_created_timestamps")
         """
         errors: List[Exception] = []
         try:
@@ -441,8 +445,10 @@ class MetadataManager:
             if isinstance(file_stat_or_err, Exception):
                 return [file_stat_or_err]
 
-            timestamp_created_or_err = md_utils.get_file_created_timestamp(
-                filepath=filepath
+            timestamp_created_or_err = (
+                timestamp_created
+                if timestamp_created is not None
+                else md_utils.get_file_created_timestamp(filepath=filepath)
             )
             if isinstance(timestamp_created_or_err, Exception):
                 return [timestamp_created_or_err]
@@ -530,11 +536,17 @@ class MetadataManager:
             refresh_stats.error = exc
             return refresh_stats
 
-        for filepath in tracked_filepaths:
+        # Look up birth time of all of the files at once.
+        timestamps_created = md_utils.get_files_created_timestamps(
+            [Path(filepath) for filepath in tracked_filepaths]
+        )
+
+        for filepath, timestamp_created in zip(tracked_filepaths, timestamps_created):
             maybe_errors = self.refresh_repository_record(
                 session=session,
                 filepath=Path(filepath),
                 branch_name=self.get_current_git_branch(dir=self.repository_root),
+                timestamp_created=timestamp_created,
             )
 
             if maybe_errors is not None:
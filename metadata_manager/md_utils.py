@@ -6,6 +6,7 @@ import shutil
 from collections import Counter
 import hashlib
 import subprocess
+import os
 from datetime import datetime
 from pathlib import Path
 import uuid
@@ -19,13 +20,29 @@ from models.local_models import FileStat, LineChanges, Config, FileORM, HistoryO
 from models.global_models import RepositoriesORM
 from md_enums import FileStatus
 from db import GlobalSession
+from birth_time import read_birth_times
+
+
+def get_files_created_timestamps(
+    filepaths: List[Path],
+) -> List[Union[datetime, Exception]]:
+    """
+    Returns birth time of each of the files or an exception if it couldn't be read,
+    see "read_birth_times".
+    """
+    return [
+        (
+            datetime.fromtimestamp(timestamp)
+            if timestamp is not None
+            else Exception(f"failed to get 'date_created' for file: {filepath}")
+        )
+        for filepath, timestamp in zip(filepaths, read_birth_times(filepaths))
+    ]
 
 
 def get_file_created_timestamp(filepath: Path) -> Union[datetime, Exception]:
     # Running "os.stat(filepath).st_ctime" doesn't return date of file creation,
-    # instead it returns last date of file's metadata modification. There
-    # doesn't seem to be more straightforward way to pull the file's creation
-    # date on linux then this.
+    # instead it returns last date of file's metadata modification.
 
     # from docs (https://docs.python.org/3/library/stat.html):
     # stat.ST_CTIME
@@ -33,13 +50,7 @@ def get_file_created_timestamp(filepath: Path) -> Union[datetime, Exception]:
     #     is the time of the last metadata change, and, on others (like Windows),
     #     is the creation time (see platform documentation for details).
 
-    proc = subprocess.run(["stat", "-c", "%W", filepath], capture_output=True)
-
-    if proc.stderr:
-        return Exception(f"failed to get 'date_created' for file: {filepath}")
-
-    timestamp = int(proc.stdout.strip())
-    return datetime.fromtimestamp(timestamp)
+    return get_files_created_timestamps([filepath])[0]
 
 
 def get_line_hash(line: str) -> str:
@@ -1,5 +1,7 @@
 import pytest
 from pathlib import Path
+from datetime import datetime
+import subprocess
 
 from md_utils import (
     count_line_changes,
@@ -8,6 +10,7 @@ from md_utils import (
     move_mdm_records,
     move_hash_files,
     move_mdm_data,
+    get_files_created_timestamps,
 )
 from manager import MetadataManager
 from models.local_models import FileORM, HistoryORM
@@ -504,3 +507,28 @@ def test_move_mdm_data(working_dir, mdm_config):
 
     parent_session.close()
     child_session.close()
+
+
+@pytest.mark.a7c31e52d4
+@pytest.mark.utils
+@pytest.mark.sanity
+def test_get_files_created_timestamps(working_dir):
+    dir_ = working_dir.joinpath("dir1")
+    dir_.mkdir()
+    filepaths = [
+        working_dir.joinpath("file1"),
+        dir_.joinpath("file2"),
+        dir_.joinpath("file3"),
+    ]
+    for filepath in filepaths:
+        filepath.touch()
+
+    missing_filepath = dir_.joinpath("missing")
+    timestamps = get_files_created_timestamps(filepaths + [missing_filepath])
+
+    assert len(timestamps) == 4
+    for filepath, timestamp in zip(filepaths, timestamps):
+        proc = subprocess.run(["stat", "-c", "%W", filepath], capture_output=True)
+        assert timestamp == datetime.fromtimestamp(int(proc.stdout.strip()))
+
+    assert isinstance(timestamps[3], Exception)
@@ -1,4 +1,5 @@
-from typing import Any, List, Tuple
+import os
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
 
 from pydantic import BaseModel, Field
 from enum import Enum, unique
@@ -21,6 +22,95 @@ class Environment(Enum):
             )
 
 
+@unique
+class ExportFormat(Enum):
+    CSV = "CSV"
+    PARQUET = "PARQUET"  # requires the optional "pyarrow" package
+
+    @property
+    def extension(self) -> str:
+        return f".{self.value.lower()}"
+
+
+@unique
+class BinaryFilePolicy(Enum):
+    SKIP = "SKIP"  # don't count lines of binary files at all
+    COUNT = "COUNT"  # count newline bytes of the whole file
+    SAMPLE = "SAMPLE"  # estimate the count from the beginning of the file
+
+
+class LineCountConfig(BaseModel):
+    # Files are read in chunks of this size...
+    chunk_size: int = Field(default=1024 * 1024, ge=1)
+    # ...unless they are at least this large, then they are memory mapped.
+    mmap_threshold: int = Field(default=64 * 1024 * 1024, ge=1)
+    # File is considered binary if its first "binary_sniff_size" bytes
+    # contain a NUL byte.
+    binary_sniff_size: int = Field(default=8 * 1024, ge=1)
+    binary_file_policy: BinaryFilePolicy = BinaryFilePolicy.SKIP
+    # How much of a binary file is read to estimate its line count
+    # (BinaryFilePolicy.SAMPLE).
+    binary_sample_size: int = Field(default=1024 * 1024, ge=1)
+
+
+class LargeFileConfig(BaseModel):
+    """
+    Files of at least "size_threshold" bytes are read by a pool of workers of
+    their own, see "ScanPipeline". Their records are written without lines right
+    away and completed once the file is read, later in the same scan.
+    """
+
+    # None reads all of the files in the analyze stage.
+    size_threshold: Optional[int] = Field(default=None, ge=1)
+    workers: int = Field(default=1, ge=1)
+    # Throttles the large files' reads on top of "ScanConfig.device_limits",
+    # None means they are not throttled.
+    max_read_bytes_per_sec: Optional[int] = Field(default=None, ge=1)
+    # Large files not started within this many seconds of the scan's start are
+    # left for the next scan, their records keep no lines. None means no limit.
+    time_budget_seconds: Optional[float] = Field(default=None, gt=0)
+
+
+class ScanRules(BaseModel):
+    """
+    Limits what part of a scan root is walked. Glob patterns without a "/" are
+    matched against the name of a file or directory, the other ones against its
+    path relative to the scan root. Excluded directories are pruned entirely.
+    """
+
+    include: List[str] = Field(default_factory=list)  # empty means everything
+    exclude: List[str] = Field(default_factory=list)
+    # How many directory levels below the root are walked, None means unlimited.
+    max_depth: Optional[int] = Field(default=None, ge=0)
+    # Allowed values of "utils.get_file_type", None means all of them.
+    filetypes: Optional[List[str]] = None
+
+
+class DeviceLimits(BaseModel):
+    """
+    Limits of the file reads from one device (st_dev), see "scan_engine.DeviceQueue".
+    """
+
+    # Number of batches of the device's files analyzed at the same time (its
+    # queue depth), None means as many as there are analyze workers.
+    max_concurrency: Optional[int] = Field(default=None, ge=1)
+    # None means the reads are not throttled.
+    max_read_bytes_per_sec: Optional[int] = Field(default=None, ge=1)
+
+
+class RetentionPolicy(BaseModel):
+    """
+    How long records of past scans are kept. Scans older than "daily_days" are
+    downsampled to the last scan of each week and scans older than "weekly_days"
+    to the last scan of each month, see "Scan.compact_history".
+    """
+
+    # None keeps records of every scan forever.
+    daily_days: Optional[int] = Field(default=None, ge=0)
+    # None keeps the last scan of each week forever.
+    weekly_days: Optional[int] = Field(default=None, ge=0)
+
+
 class ScanConfig(BaseModel):
     scan_paths: List[str]
     database_filepath: str
@@ -29,6 +119,54 @@ class ScanConfig(BaseModel):
     log_file: str
     reports_path: str
     environment: Environment
+    # Rules of individual roots (keyed by the root's path as listed in
+    # "scan_paths"), roots without their own rules use "default_scan_rules".
+    scan_rules: Dict[str, ScanRules] = Field(default_factory=dict)
+    default_scan_rules: ScanRules = Field(default_factory=ScanRules)
+    # Limits of individual devices keyed by any path on the device (usually
+    # a scan root), other devices use "default_device_limits".
+    device_limits: Dict[str, DeviceLimits] = Field(default_factory=dict)
+    default_device_limits: DeviceLimits = Field(default_factory=DeviceLimits)
+    # Number of workers of each of the scan pipeline's stages, see "ScanPipeline".
+    scan_workers: int = Field(default_factory=lambda: os.cpu_count() or 1, ge=1)
+    filter_workers: int = Field(default_factory=lambda: os.cpu_count() or 1, ge=1)
+    stat_workers: int = Field(default_factory=lambda: os.cpu_count() or 1, ge=1)
+    analyze_workers: int = Field(default_factory=lambda: os.cpu_count() or 1, ge=1)
+    # Maximum number of file batches waiting between two pipeline stages.
+    pipeline_queue_size: int = Field(default=64, ge=1)
+    # Number of rows the writer inserts before committing.
+    write_batch_size: int = Field(default=10_000, ge=1)
+    line_counting: LineCountConfig = Field(default_factory=LineCountConfig)
+    # Names of "analyzers.ANALYZERS" run on the contents read for the line count,
+    # each of them adds its columns to the file records. Records of unchanged
+    # files carried forward by the incremental scan keep their earlier values.
+    analyzers: List[str] = Field(default_factory=list)
+    large_files: LargeFileConfig = Field(default_factory=LargeFileConfig)
+    # Remember xattr lookups between scans, see "utils.TrackingFilter".
+    tracking_cache_enabled: bool = True
+    # Reuse listings of directories that didn't change since the previous scan,
+    # see "utils.DirListingCache".
+    listing_cache_enabled: bool = True
+    # Carry "lines" and "date_created" of files that didn't change since
+    # the previous scan forward instead of reading the files again.
+    incremental_scan: bool = False
+    # Write each root into its own database (in WAL mode) with its own writer,
+    # see "Scan.get_query_conn" for how they are queried together.
+    shard_by_root: bool = False
+    # Number of the slowest files (by the time spent reading them) recorded
+    # for every scan.
+    slowest_files_count: int = Field(default=20, ge=0)
+    # Format of the table dumps and of the reports.
+    export_format: ExportFormat = ExportFormat.CSV
+    retention: RetentionPolicy = Field(default_factory=RetentionPolicy)
+    # Stop listing directories once the scan has run this long, directories most
+    # likely to have changed are listed first and the rest is deferred to the
+    # next scan, see "scan_engine.PriorityWalker". None walks the whole roots.
+    scan_time_budget_seconds: Optional[float] = Field(default=None, gt=0)
+
+    @property
+    def shards_path(self) -> str:
+        return os.path.join(os.path.dirname(self.database_filepath), "shards")
 
 
 class TableDescription(BaseModel):
@@ -36,13 +174,31 @@ class TableDescription(BaseModel):
     file_path: str
     lock: Any  # threading.Lock
     columns: List[Tuple[str, str]]
-    csv_dump_file: str
+    # Path of the dump without the extension of the export format,
+    # None for internal tables that are not dumped.
+    csv_dump_file: Optional[str]
+    # Dumps the table into a directory (csv_dump_file) with one file per date
+    # of this column. Its values must start with the date and it must be indexed.
+    csv_partition_column: Optional[str] = None
+    # Table the dates of the partitions are looked up in (it must have the
+    # partition column as well), defaults to the table itself.
+    csv_partition_table: Optional[str] = None
     primary_key: List[str]
+    without_rowid: bool = False
+    indexes: List[List[str]] = []  # columns of each secondary index
+    unique_indexes: List[List[str]] = []
+    # The "table" is a view defined by this query over the other tables,
+    # it's recreated on every start and its columns are never altered.
+    view_sql: Optional[str] = None
 
     @property
     def columns_string(self) -> str:
         return ",".join(f"{v[0]} {v[1]}" for v in self.columns)
 
+    @property
+    def column_names_string(self) -> str:
+        return ",".join(v[0] for v in self.columns)
+
     @property
     def columns_placeholder_string(self) -> str:
         return ",".join(["?" for _ in range(len(self.columns))])
@@ -54,41 +210,108 @@ class TableDescription(BaseModel):
         else:
             return ""
 
+    @property
+    def table_options_string(self) -> str:
+        return "WITHOUT ROWID" if self.without_rowid else ""
+
+    @property
+    def create_table_sql(self) -> str:
+        return f"""
+            CREATE TABLE IF NOT EXISTS {self.table_name} (
+                {self.columns_string}
+                {self.primary_key_string}
+            ) {self.table_options_string}
+        """
+
+    @property
+    def create_indexes_sql(self) -> List[str]:
+        return [
+            f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS "
+            f"idx__{self.table_name}__{'__'.join(index)} "
+            f"ON {self.table_name} ({','.join(index)})"
+            for indexes, unique in [(self.indexes, False), (self.unique_indexes, True)]
+            for index in indexes
+        ]
+
+
+class FileStat(NamedTuple):
+    """
+    Record of one scanned file. Created for every file during the scan,
+    therefore it's a plain tuple (fields in the order of the "file" view's
+    and the "file_latest" table's columns, followed by the analyzers' columns
+    in "analysis") instead of a validated model.
+    """
 
-class FileStat(BaseModel):
     date__inode: str
     date_scanned: str
-    date_modified: str
-    date_created: str
     inode: int
     filename: str
     filepath: str
     filetype: str
-    lines: int
+    lines: Optional[int]  # None until a deferred large file is read
+    date_created: str
+    date_modified: str
     error_occured: bool
+    # Stored once per "error_fingerprint" in the "file_error" table,
+    # the record's own column is left empty.
     error_traceback: str
+    size: int
+    mtime_ns: int
+    error_fingerprint: Optional[str] = None
+    error_class: Optional[str] = None
+    dev: Optional[int] = None  # st_dev, inodes are unique only within a device
+    analysis: Tuple[Any, ...] = ()  # see "analyzers.FileAnalyzer"
+    bytes_read: int = 0  # not stored, scan instrumentation only
 
     def to_tuple(self) -> Tuple[Any, ...]:
+        return (*self[:10], None, *self[11:-2], *self.analysis)
+
+    def to_record_tuple(self, scan_id: int, path_id: int) -> Tuple[Any, ...]:
+        """
+        Row of the "file_record" table, the strings shared by many records
+        are stored in the "scan_date", "path" and "filetype" tables.
+        """
         return (
-            self.date__inode,
-            self.date_scanned,
+            scan_id,
+            path_id,
             self.inode,
-            self.filename,
-            self.filepath,
-            self.filetype,
             self.lines,
             self.date_created,
             self.date_modified,
             self.error_occured,
-            self.error_traceback,
+            self.size,
+            self.mtime_ns,
+            self.error_fingerprint,
+            self.error_class,
+            self.dev,
+            *self.analysis,
         )
 
 
+class PreviousFileStat(NamedTuple):
+    """
+    Values of the most recent "file" record of a (device, inode) that are needed
+    to decide whether the file changed and to carry its stats forward.
+    """
+
+    size: int
+    mtime_ns: int
+    lines: int
+    date_created: str
+    analysis: Tuple[Any, ...] = ()
+
+
 class ScanStat(BaseModel):
     date_scanned: str
     scan_time: float
     files_scanned: int
     files_skipped: int
+    bytes_read: int = 0
+    peak_rss: int = 0  # bytes
+    # Directories left for the next scan, see "ScanConfig.scan_time_budget_seconds".
+    dirs_deferred: int = 0
+    # Large files left for the next scan, see "LargeFileConfig.time_budget_seconds".
+    large_files_left: int = 0
 
     def to_tuple(self) -> Tuple[Any, ...]:
         return (
@@ -96,10 +319,74 @@ class ScanStat(BaseModel):
             self.scan_time,
             self.files_scanned,
             self.files_skipped,
+            self.bytes_read,
+            self.peak_rss,
+            self.dirs_deferred,
+            self.large_files_left,
+        )
+
+
+class ScanPhaseStat(BaseModel):
+    date_scanned: str
+    root_path: str
+    phase: str
+    # Time spent in the phase summed over all of its workers.
+    busy_time: float
+    items: int
+    bytes_read: int
+
+    def to_tuple(self) -> Tuple[Any, ...]:
+        return (
+            self.date_scanned,
+            self.root_path,
+            self.phase,
+            self.busy_time,
+            self.items,
+            self.bytes_read,
         )
 
 
-class LineCountStat(BaseModel):
-    count: int = Field(default=0)
-    error_occured: bool = Field(default=False)
-    error_traceback: str = Field(default="")
+class SlowFileStat(BaseModel):
+    date_scanned: str
+    root_path: str
+    filepath: str
+    stat_time: float
+    line_count_time: float
+    size: int
+    bytes_read: int
+    lines: int
+
+    def to_tuple(self) -> Tuple[Any, ...]:
+        return (
+            self.date_scanned,
+            self.root_path,
+            self.filepath,
+            self.stat_time,
+            self.line_count_time,
+            self.size,
+            self.bytes_read,
+            self.lines,
+        )
+
+
+class Mount(NamedTuple):
+    """
+    Line of "/proc/self/mountinfo": the directory "root" of the file system on
+    "device" is mounted at "mount_point".
+    """
+
+    device: int
+    root: str
+    mount_point: str
+
+
+class LineCountStat(NamedTuple):
+    count: int = 0
+    is_binary: bool = False
+    error_occured: bool = False
+    error_traceback: str = ""
+    bytes_read: int = 0
+    error_class: str = ""
+    # Values of the analyzers' columns, None for each one if the file was not
+    # read whole.
+    analysis: Tuple[Any, ...] = ()
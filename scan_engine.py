@@ -0,0 +1,1991 @@
+import fnmatch
+import heapq
+import math
+import os
+import queue
+import random
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    List,
+    Optional,
+    Pattern,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
+
+from models import (
+    DeviceLimits,
+    FileStat,
+    PreviousFileStat,
+    ScanConfig,
+    ScanRules,
+    TableDescription,
+)
+import analyzers
+import utils
+
+
+class CompiledScanRules:
+    """
+    "ScanRules" compiled into a handful of regular expressions, so every entry
+    is matched in one pass no matter how many patterns there are.
+    """
+
+    def __init__(self, rules: ScanRules) -> None:
+        self.include_name, self.include_path = self._compile(rules.include)
+        self.exclude_name, self.exclude_path = self._compile(rules.exclude)
+        self.has_include = bool(rules.include)
+        self.max_depth = rules.max_depth
+        self.filetypes = (
+            frozenset(filetype.lower() for filetype in rules.filetypes)
+            if rules.filetypes is not None
+            else None
+        )
+
+    @staticmethod
+    def _compile(
+        patterns: List[str],
+    ) -> Tuple[Optional[Pattern[str]], Optional[Pattern[str]]]:
+        name_patterns = [fnmatch.translate(p) for p in patterns if "/" not in p]
+        path_patterns = [fnmatch.translate(p.strip("/")) for p in patterns if "/" in p]
+        return (
+            re.compile("|".join(name_patterns)) if name_patterns else None,
+            re.compile("|".join(path_patterns)) if path_patterns else None,
+        )
+
+    @staticmethod
+    def _matches(
+        name_re: Optional[Pattern[str]],
+        path_re: Optional[Pattern[str]],
+        name: str,
+        relpath: str,
+    ) -> bool:
+        return (name_re is not None and name_re.match(name) is not None) or (
+            path_re is not None and path_re.match(relpath) is not None
+        )
+
+    def is_dir_walked(self, name: str, relpath: str, depth: int) -> bool:
+        """
+        depth:  depth of the directory itself, subdirectories of the root are at 1
+        """
+        if self.max_depth is not None and depth > self.max_depth:
+            return False
+        return not self._matches(self.exclude_name, self.exclude_path, name, relpath)
+
+    def is_file_scanned(self, name: str, relpath: str) -> bool:
+        if self._matches(self.exclude_name, self.exclude_path, name, relpath):
+            return False
+        if self.has_include and not self._matches(
+            self.include_name, self.include_path, name, relpath
+        ):
+            return False
+        return self.filetypes is None or utils.get_file_type(name) in self.filetypes
+
+
+class Shard:
+    """
+    Database the records of one or more roots are written to. Every shard
+    has its own writer, so shards are written in parallel.
+    """
+
+    def __init__(
+        self,
+        tracking_tables: Dict[str, TableDescription],
+        tracking_cache_enabled: bool,
+        incremental_scan: bool,
+        listing_cache_enabled: bool = False,
+        analysis_columns: Sequence[str] = (),
+    ) -> None:
+        """
+        analysis_columns:   columns of "ScanConfig.analyzers", carried forward
+                            by the incremental scan
+        """
+        self.tracking_tables = tracking_tables
+        self.tracking_filter = utils.TrackingFilter(
+            table=tracking_tables["tracking_cache"], use_cache=tracking_cache_enabled
+        )
+        self.latest_files = utils.LatestFileStats(
+            tracking_tables["file_latest"], analysis_columns=analysis_columns
+        )
+        self.latest_file_stats = self.latest_files if incremental_scan else None
+        self.dir_listings = (
+            utils.DirListingCache(tracking_tables["dir_listing"])
+            if listing_cache_enabled
+            else None
+        )
+        self.write_queue: "Optional[queue.Queue[Optional[FileBatch]]]" = None
+
+    def close(self) -> None:
+        self.tracking_filter.close()
+        self.latest_files.close()
+        if self.dir_listings is not None:
+            self.dir_listings.close()
+
+
+# Phases of the scan timed for every root, see "PhaseStat".
+PHASES = ["walk", "filter", "stat", "birth_time", "line_count", "insert"]
+
+
+class PhaseStat:
+    """
+    Time spent in one phase of a root's scan summed over all of the phase's
+    workers, along with the number of items (entries, files or rows) processed.
+    """
+
+    __slots__ = ("busy_time", "items", "bytes_read")
+
+    def __init__(self) -> None:
+        self.busy_time = 0.0
+        self.items = 0
+        self.bytes_read = 0
+
+
+class RootScan:
+    """
+    Progress of a single scan root. Files of one root are processed by all of
+    the pipeline's workers, therefore the counters are guarded by a lock.
+    """
+
+    def __init__(self, root_path: str, rules: ScanRules, shard: Shard) -> None:
+        self.root_path = root_path
+        self.rules = CompiledScanRules(rules)
+        self.shard = shard
+        # Entry paths are sliced at this offset to get their path relative to the root.
+        self.relpath_offset = len(os.path.join(root_path, ""))
+        self.files_scanned = 0
+        self.files_skipped = 0
+        self.start_time = time.time()
+        self.elapsed_time = 0.0
+        self.pending_dirs = 0  # directories not yet listed by the walker
+        self.pending_batches = 0  # batches emitted but not yet written
+        self.walk_done = False
+        # Directories whose files were written by an interrupted run of the same
+        # scan, only their subdirectories are walked.
+        self.checkpointed_dirs: Set[str] = set()
+        # Other roots of the scan within this one, they are walked as roots
+        # of their own only.
+        self.nested_roots: Set[str] = set()
+        # Devices of the root's tree and whether other roots (not nested ones)
+        # reach some of its files through bind mounts, see "ReadFiles".
+        self.devices: Set[int] = set()
+        self.overlapping = False
+        # Change history of the directories, see "Scan.update_dir_history".
+        self.dir_priorities: Dict[str, float] = {}
+        # Own priorities of the directories listed early only to reach their
+        # subdirectories, their files are scanned at their own priority.
+        self.files_priorities: Dict[str, float] = {}
+        self.walked_dirs: List[str] = []
+        self.changed_dirs: Set[str] = set()
+        # Directories left for the next scan once the time budget was spent,
+        # none of their subdirectories were walked either.
+        self.deferred_dirs: List[str] = []
+        # Deferred large files that were not read before the time budget ran out.
+        self.large_files_left = 0
+        self.phases = {phase: PhaseStat() for phase in PHASES}
+        self.lock = threading.Lock()
+
+    def add_phase_time(
+        self, phase: str, busy_time: float, items: int, bytes_read: int = 0
+    ) -> None:
+        with self.lock:
+            phase_stat = self.phases[phase]
+            phase_stat.busy_time += busy_time
+            phase_stat.items += items
+            phase_stat.bytes_read += bytes_read
+
+
+# (file's directory entry, os.stat result, birth time, stats from the previous scan,
+#  time spent stat-ing the file)
+StatEntry = Tuple[
+    os.DirEntry,
+    Optional[os.stat_result],
+    Optional[int],
+    Optional[PreviousFileStat],
+    float,
+]
+
+
+class CachedDirEntry:
+    """
+    Stands in for the "os.DirEntry" of a file whose directory listing was
+    taken from "utils.DirListingCache". Has the part of the interface used by
+    the pipeline, the file is stat-ed on the first "stat" call.
+    """
+
+    __slots__ = ("name", "path", "_stat")
+
+    def __init__(self, path: str, name: str) -> None:
+        self.name = name
+        self.path = path
+        self._stat: Optional[os.stat_result] = None
+
+    def stat(self) -> os.stat_result:
+        if self._stat is None:
+            self._stat = os.stat(self.path)
+        return self._stat
+
+
+# (time spent reading the file, root, stat entry, collected stats)
+SlowFile = Tuple[float, RootScan, StatEntry, FileStat]
+
+
+class FileBatch:
+    """
+    Files of (a part of) one directory travelling through the pipeline. Every
+    stage fills in its own fields and passes the batch on. Batch with "last" set
+    carries no files, it is emitted once the whole root has been walked.
+
+    Files are passed around as "os.DirEntry" objects, the entry caches the result
+    of its "stat" call so every file is stat-ed only once during the scan.
+
+    dirpath:        directory the files were listed from
+    dir_batches:    number of batches the directory was split into, the directory
+                    is checkpointed once all of them are written
+    dir_listing:    new row of the "dir_listing" table written along with the batch,
+                    directories whose listing is cached but that have no files
+                    get an empty batch for it
+    device:         st_dev of the batch's files, known once they are stat-ed
+    large_files:    batch of the files deferred by the analyze stage to the large
+                    file stage, see "LargeFileConfig"
+    backfill:       the batch completes records of large files already written
+                    (without lines) by an earlier batch of the directory
+    foreign_files:  (st_dev, st_ino) of the files whose latest record is kept
+                    by another shard, see "LatestFileOwners"
+    """
+
+    __slots__ = (
+        "root",
+        "entries",
+        "dirpath",
+        "dir_batches",
+        "last",
+        "dir_listing",
+        "device",
+        "large_files",
+        "backfill",
+        "foreign_files",
+        "tracked_entries",
+        "tracking_cache_entries",
+        "stat_entries",
+        "file_stats",
+    )
+
+    def __init__(
+        self,
+        root: RootScan,
+        entries: List[os.DirEntry],
+        dirpath: str = "",
+        dir_batches: int = 0,
+        last: bool = False,
+        dir_listing: Optional[Tuple[str, int, int, bytes]] = None,
+        backfill: bool = False,
+    ) -> None:
+        self.root = root
+        self.entries = entries
+        self.dirpath = dirpath
+        self.dir_batches = dir_batches
+        self.last = last
+        self.dir_listing = dir_listing
+        self.backfill = backfill
+        self.foreign_files: Set[Tuple[int, int]] = set()
+        self.device: Optional[int] = None
+        self.large_files: Optional[FileBatch] = None
+        self.tracked_entries: List[os.DirEntry] = []
+        self.tracking_cache_entries: List[Tuple[int, int, int, int]] = []
+        self.stat_entries: List[StatEntry] = []
+        self.file_stats: List[FileStat] = []
+
+
+# Tells a stage's worker that there is no more work.
+STOP = None
+
+
+class PipelineAborted(Exception):
+    pass
+
+
+class ParallelWalker:
+    """
+    Walks directory trees with a pool of worker threads.
+
+    Every worker owns a deque of directories. New subdirectories are pushed to
+    the tail of the worker's own deque and the worker also takes its next
+    directory from there (depth first, good locality). Once a worker runs out of
+    work, it steals the oldest directory from the head of another worker's deque.
+    Oldest directories are the ones closest to the root and therefore usually
+    represent the largest chunks of remaining work.
+
+    Directories of all of the roots share the same pool, so a single large root
+    gets spread across all of the workers instead of holding up the whole scan.
+    Directories excluded by the root's rules are pruned without being listed.
+
+    emit:       called with batches of files found in each directory and with
+                the final ("last") batch of each root
+    is_aborted: tells the walker to stop early
+    deadline:   "time.monotonic" time after which no more directories are listed,
+                directories that are left are added to their root's "deferred_dirs"
+    """
+
+    IDLE_WAIT_SECONDS = 0.05
+    BATCH_SIZE = 512
+    # Listings of directories modified this recently aren't cached, the directory
+    # could still be changed within the same mtime tick after it was listed.
+    LISTING_CACHE_MIN_AGE_NS = 2_000_000_000
+
+    def __init__(
+        self,
+        n_workers: int,
+        emit: Callable[[FileBatch], None],
+        is_aborted: Callable[[], bool],
+        deadline: Optional[float] = None,
+    ) -> None:
+        assert n_workers > 0, f"Expected at least one worker. Got {n_workers}"
+
+        self.n_workers = n_workers
+        self.emit = emit
+        self.is_aborted = is_aborted
+        self.deadline = deadline
+        # (root, directory path, depth of the directory below the root)
+        self.deques: List[Deque[Tuple[RootScan, str, int]]] = [
+            deque() for _ in range(n_workers)
+        ]
+        self.pending_dirs = 0
+        self.condition = threading.Condition()
+        self.error: Optional[BaseException] = None
+
+    def run(self, roots: List[RootScan]) -> None:
+        for root in roots:
+            root.pending_dirs = 1
+        self._seed(roots)
+        self.pending_dirs = len(roots)
+
+        workers = [
+            threading.Thread(
+                target=self._worker, args=(i,), name=f"scan-walk-{i}", daemon=True
+            )
+            for i in range(self.n_workers)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        if self.error is not None:
+            raise self.error
+
+        if self.pending_dirs:
+            self._defer_remaining()
+
+    def _seed(self, roots: List[RootScan]) -> None:
+        # Seed the roots round-robin, idle workers will steal the rest.
+        for i, root in enumerate(roots):
+            self.deques[i % self.n_workers].append((root, root.root_path, 0))
+
+    def _push(self, worker_id: int, tasks: List[Tuple[RootScan, str, int]]) -> None:
+        """
+        Called with "condition" held.
+        """
+        self.deques[worker_id].extend(tasks)
+
+    def _pop(self, worker_id: int) -> Optional[Tuple[RootScan, str, int]]:
+        try:
+            return self.deques[worker_id].pop()
+        except IndexError:
+            return self._steal(worker_id)
+
+    def _remaining_tasks(self) -> List[Tuple[RootScan, str, int]]:
+        return [task for own in self.deques for task in own]
+
+    def _defer_remaining(self) -> None:
+        """
+        Finishes the walk of roots cut short by the deadline, their directories
+        that weren't listed are deferred.
+        """
+        deferred_roots: Dict[int, RootScan] = {}
+        for root, dirpath, _ in self._remaining_tasks():
+            root.deferred_dirs.append(dirpath)
+            deferred_roots[id(root)] = root
+
+        for root in deferred_roots.values():
+            with root.lock:
+                root.pending_dirs -= len(root.deferred_dirs)
+                walk_done = root.pending_dirs == 0
+            if walk_done:
+                self.emit(FileBatch(root=root, entries=[], last=True))
+        self.pending_dirs = 0
+
+    def _is_past_deadline(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def _worker(self, worker_id: int) -> None:
+        try:
+            while True:
+                task = self._next_task(worker_id)
+                if task is None:
+                    return
+                self._process_dir(worker_id, *task)
+        except BaseException as err:
+            with self.condition:
+                if self.error is None:
+                    self.error = err
+                # Stop every other worker, the walk can't be completed anyway.
+                self.condition.notify_all()
+
+    def _next_task(self, worker_id: int) -> Optional[Tuple[RootScan, str, int]]:
+        while (
+            self.error is None
+            and not self.is_aborted()
+            and not self._is_past_deadline()
+        ):
+            task = self._pop(worker_id)
+            if task is not None:
+                return task
+
+            with self.condition:
+                if self.pending_dirs == 0:
+                    return None
+                self.condition.wait(timeout=self.IDLE_WAIT_SECONDS)
+
+        return None
+
+    def _steal(self, worker_id: int) -> Optional[Tuple[RootScan, str, int]]:
+        # Start at a random victim so that idle workers don't all hammer
+        # the same deque.
+        offset = random.randrange(self.n_workers)
+        for i in range(self.n_workers):
+            victim = (offset + i) % self.n_workers
+            if victim == worker_id:
+                continue
+            try:
+                return self.deques[victim].popleft()
+            except IndexError:
+                continue
+        return None
+
+    def _process_dir(
+        self,
+        worker_id: int,
+        root: RootScan,
+        dirpath: str,
+        depth: int,
+        scan_files: bool = True,
+        walk_subdirs: bool = True,
+    ) -> None:
+        """
+        scan_files:     emit the directory's files
+        walk_subdirs:   push the directory's subdirectories
+        """
+        start_time = time.perf_counter()
+        rules = root.rules
+        subdirs: List[str] = []
+        entries: List[Any] = []  # os.DirEntry or CachedDirEntry
+        # Files of checkpointed directories were written by the interrupted run.
+        list_files = scan_files and dirpath not in root.checkpointed_dirs
+
+        dir_listings = root.shard.dir_listings
+        dir_stat: Optional[os.stat_result] = None
+        cached_listing: Optional[bytes] = None
+        if dir_listings is not None:
+            try:
+                dir_stat = os.stat(dirpath)
+            except OSError:
+                pass
+        if dir_stat is not None:
+            cached = dir_listings.get(dirpath)
+            if (
+                cached is not None
+                and cached[0] == dir_stat.st_ino
+                and cached[1] == dir_stat.st_mtime_ns
+            ):
+                cached_listing = cached[2]
+
+        # (kind, name) of the directory's entries, see "utils.encode_dir_listing".
+        listing: List[Tuple[str, str]] = []
+        dir_listing: Optional[Tuple[str, int, int, bytes]] = None
+
+        if cached_listing is not None:
+            for kind, name in utils.decode_dir_listing(cached_listing):
+                path = os.path.join(dirpath, name)
+                relpath = path[root.relpath_offset :]
+                if kind == "f":
+                    if list_files and rules.is_file_scanned(name, relpath):
+                        entries.append(CachedDirEntry(path, name))
+                elif walk_subdirs and rules.is_dir_walked(name, relpath, depth + 1):
+                    subdirs.append(path)
+        else:
+            listing_time_ns = time.time_ns()
+            # Mirror "os.walk" semantics - unreadable directories are skipped and
+            # symlinks to directories are listed but not followed.
+            try:
+                with os.scandir(dirpath) as it:
+                    for entry in it:
+                        relpath = entry.path[root.relpath_offset :]
+                        try:
+                            is_dir = entry.is_dir()
+                        except OSError:
+                            is_dir = False
+
+                        if not is_dir:
+                            listing.append(("f", entry.name))
+                            if list_files and rules.is_file_scanned(
+                                entry.name, relpath
+                            ):
+                                entries.append(entry)
+                            continue
+
+                        try:
+                            is_symlink = entry.is_symlink()
+                        except OSError:
+                            is_symlink = False
+                        if is_symlink:
+                            continue
+                        listing.append(("d", entry.name))
+                        if walk_subdirs and rules.is_dir_walked(
+                            entry.name, relpath, depth + 1
+                        ):
+                            subdirs.append(entry.path)
+
+                # Written along with the files, a directory listed without them
+                # would otherwise get an empty batch checkpointing it.
+                if (
+                    scan_files
+                    and dir_stat is not None
+                    and dir_stat.st_mtime_ns
+                    < listing_time_ns - self.LISTING_CACHE_MIN_AGE_NS
+                ):
+                    dir_listing = (
+                        dirpath,
+                        dir_stat.st_ino,
+                        dir_stat.st_mtime_ns,
+                        utils.encode_dir_listing(listing),
+                    )
+            except OSError:
+                pass
+
+        root.add_phase_time(
+            "walk", time.perf_counter() - start_time, items=len(entries)
+        )
+
+        if root.nested_roots:
+            subdirs = [
+                subdir
+                for subdir in subdirs
+                if os.path.normpath(subdir) not in root.nested_roots
+            ]
+        with root.lock:
+            if scan_files:
+                root.walked_dirs.append(dirpath)
+            root.pending_dirs += len(subdirs)
+        if subdirs:
+            with self.condition:
+                self.pending_dirs += len(subdirs)
+                self._push(worker_id, [(root, subdir, depth + 1) for subdir in subdirs])
+                self.condition.notify_all()
+
+        # Large directories are split so that no single batch holds up
+        # a pipeline stage or grows the memory.
+        dir_batches = math.ceil(len(entries) / self.BATCH_SIZE)
+        if dir_listing is not None:
+            dir_batches = max(dir_batches, 1)
+        for i in range(dir_batches):
+            self.emit(
+                FileBatch(
+                    root=root,
+                    entries=entries[i * self.BATCH_SIZE : (i + 1) * self.BATCH_SIZE],
+                    dirpath=dirpath,
+                    dir_batches=dir_batches,
+                    dir_listing=dir_listing if i == 0 else None,
+                )
+            )
+
+        with root.lock:
+            root.pending_dirs -= 1
+            walk_done = root.pending_dirs == 0
+
+        if walk_done:
+            self.emit(FileBatch(root=root, entries=[], last=True))
+
+        with self.condition:
+            self.pending_dirs -= 1
+            if self.pending_dirs == 0:
+                self.condition.notify_all()
+
+
+class PriorityWalker(ParallelWalker):
+    """
+    "ParallelWalker" listing the directories most likely to have changed first,
+    meant to be used with a deadline. All of the workers share one heap of
+    directories ordered by "RootScan.dir_priorities" (directories are known
+    only once their parent is listed, so a directory's priority includes
+    the priorities of its subdirectories), deeper directories go first among
+    the ones of the same priority.
+
+    Directories listed early only to reach their subdirectories (see
+    "RootScan.files_priorities") are listed twice. First only their
+    subdirectories are pushed, their files are emitted once the directory
+    comes up again at its own priority, so each run doesn't spend its budget
+    on the same ancestors' files before it gets to the deferred directories.
+    """
+
+    # Priority of directories without any history, new directories
+    # are always worth listing.
+    NEW_DIR_PRIORITY = 1.0
+
+    def __init__(
+        self,
+        n_workers: int,
+        emit: Callable[[FileBatch], None],
+        is_aborted: Callable[[], bool],
+        deadline: Optional[float] = None,
+    ) -> None:
+        super().__init__(n_workers, emit, is_aborted, deadline)
+        # (negated priority, negated depth, tie breaker, task)
+        self.heap: List[Tuple[float, int, int, Tuple[RootScan, str, int]]] = []
+        self.heap_counter = 0
+        # (root's id, directory) whose subdirectories were pushed, see "_process_dir".
+        self.listed_dirs: Set[Tuple[int, str]] = set()
+
+    def _seed(self, roots: List[RootScan]) -> None:
+        self._push(0, [(root, root.root_path, 0) for root in roots])
+
+    def _push(self, worker_id: int, tasks: List[Tuple[RootScan, str, int]]) -> None:
+        for task in tasks:
+            root, dirpath, depth = task
+            if (id(root), dirpath) in self.listed_dirs:
+                priority = root.files_priorities[dirpath]
+            else:
+                priority = root.dir_priorities.get(dirpath, self.NEW_DIR_PRIORITY)
+            self.heap_counter += 1
+            heapq.heappush(self.heap, (-priority, -depth, self.heap_counter, task))
+
+    def _pop(self, worker_id: int) -> Optional[Tuple[RootScan, str, int]]:
+        with self.condition:
+            if not self.heap:
+                return None
+            return heapq.heappop(self.heap)[3]
+
+    def _remaining_tasks(self) -> List[Tuple[RootScan, str, int]]:
+        return [task for *_, task in sorted(self.heap)]
+
+    def _process_dir(
+        self,
+        worker_id: int,
+        root: RootScan,
+        dirpath: str,
+        depth: int,
+        scan_files: bool = True,
+        walk_subdirs: bool = True,
+    ) -> None:
+        if dirpath not in root.files_priorities:
+            super()._process_dir(worker_id, root, dirpath, depth)
+            return
+
+        with self.condition:
+            is_listed = (id(root), dirpath) in self.listed_dirs
+        if is_listed:
+            super()._process_dir(worker_id, root, dirpath, depth, walk_subdirs=False)
+            return
+
+        # The directory's files are pushed back as a directory of their own.
+        with root.lock:
+            root.pending_dirs += 1
+        with self.condition:
+            self.listed_dirs.add((id(root), dirpath))
+            self.pending_dirs += 1
+            self._push(worker_id, [(root, dirpath, depth)])
+        super()._process_dir(worker_id, root, dirpath, depth, scan_files=False)
+
+
+class DeviceQueue:
+    """
+    Input queue of the analyze stage. Batches are kept per device and handed
+    out only while fewer than the device's "max_concurrency" batches are being
+    analyzed, so a slow disk can't occupy every worker while batches of the
+    other devices wait behind it. Devices are served round-robin.
+
+    Has the "put" and "get" of "queue.Queue", every batch of a device taken
+    with "get" is given back with "release" once it's analyzed. STOP is handed
+    out only after all of the batches. Reads outside of the queue take one of
+    the device's slots with "acquire".
+    """
+
+    def __init__(self, maxsize: int, get_limits: Callable[[int], DeviceLimits]) -> None:
+        self.maxsize = maxsize
+        self.get_limits = get_limits
+        self.condition = threading.Condition()
+        # Device -> its waiting batches, in the order the devices are served.
+        self.batches: Dict[Optional[int], Deque[FileBatch]] = {}
+        self.in_flight: Dict[int, int] = {}
+        self.size = 0
+        self.stops = 0
+
+    def put(self, item: Optional[FileBatch], timeout: Optional[float] = None) -> None:
+        with self.condition:
+            if item is STOP:
+                self.stops += 1
+            else:
+                if not self.condition.wait_for(
+                    lambda: self.size < self.maxsize, timeout
+                ):
+                    raise queue.Full
+                self.batches.setdefault(item.device, deque()).append(item)
+                self.size += 1
+            self.condition.notify_all()
+
+    def get(self, timeout: Optional[float] = None) -> Optional[FileBatch]:
+        with self.condition:
+            end_time = time.monotonic() + timeout if timeout is not None else None
+            while True:
+                for device, batches in self.batches.items():
+                    if device is not None and self.in_flight.get(device, 0) >= (
+                        self.get_limits(device).max_concurrency or math.inf
+                    ):
+                        continue
+
+                    batch = batches.popleft()
+                    # Served last next time.
+                    del self.batches[device]
+                    if batches:
+                        self.batches[device] = batches
+                    if device is not None:
+                        self.in_flight[device] = self.in_flight.get(device, 0) + 1
+                    self.size -= 1
+                    self.condition.notify_all()
+                    return batch
+
+                if self.size == 0 and self.stops:
+                    self.stops -= 1
+                    return STOP
+
+                remaining = (
+                    end_time - time.monotonic() if end_time is not None else None
+                )
+                if remaining is not None and remaining <= 0:
+                    raise queue.Empty
+                self.condition.wait(remaining)
+
+    def acquire(self, device: int) -> None:
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.in_flight.get(device, 0)
+                < (self.get_limits(device).max_concurrency or math.inf)
+            )
+            self.in_flight[device] = self.in_flight.get(device, 0) + 1
+
+    def release(self, device: int) -> None:
+        with self.condition:
+            self.in_flight[device] -= 1
+            self.condition.notify_all()
+
+
+class RateLimiter:
+    """
+    Token bucket throttling the reads of one device to "rate" bytes per second,
+    bursts of up to a second's worth of reads pass right away.
+    """
+
+    def __init__(self, rate: int) -> None:
+        self.rate = rate
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, n_bytes: int) -> None:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= n_bytes
+            wait_time = -self.tokens / self.rate
+
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+class ReadFile:
+    """
+    Entry of "ReadFiles", "file_stat" is set by the file's first reader.
+    """
+
+    __slots__ = ("done", "file_stat", "links_left")
+
+    def __init__(self, links_left: Optional[int]) -> None:
+        self.done = False
+        self.file_stat: Optional[FileStat] = None
+        self.links_left = links_left
+
+
+class FilesByDevice:
+    """
+    Entries of files reachable by several paths keyed by device and inode. The
+    entries of a device are dropped once all of the roots whose tree is on the
+    device are done, no other path can lead to the files then.
+    """
+
+    def __init__(self, roots: List[RootScan]) -> None:
+        self.roots_left = list(roots)
+        self.files: Dict[int, Dict[int, Any]] = {}
+        self.lock = threading.Lock()
+
+    def release_root(self, root: RootScan) -> None:
+        with self.lock:
+            self.roots_left.remove(root)
+            for device in list(self.files):
+                if not any(device in other.devices for other in self.roots_left):
+                    del self.files[device]
+
+
+class ReadFiles(FilesByDevice):
+    """
+    Stats of the files read during the scan, so that a file reachable by several
+    paths (hard links, roots overlapping through bind mounts) is read only once.
+    The first worker to claim a file reads it and the others wait for its stats,
+    they never wait long since the file is already being read.
+
+    Only files that can be reached again are kept: hard links until all of their
+    links were seen, files of overlapping roots until the roots are done.
+    """
+
+    def __init__(self, roots: List[RootScan]) -> None:
+        super().__init__(roots)
+        self.published = threading.Condition(self.lock)
+
+    @staticmethod
+    def is_shared(root: RootScan, file_stat: os.stat_result) -> bool:
+        return file_stat.st_nlink > 1 or root.overlapping
+
+    def claim(self, root: RootScan, file_stat: os.stat_result) -> Tuple[ReadFile, bool]:
+        """
+        Returns the file's entry and whether the caller is its first reader,
+        the first reader has to "publish" the file's stats.
+        """
+        with self.lock:
+            device_files = self.files.setdefault(file_stat.st_dev, {})
+            read_file = device_files.get(file_stat.st_ino)
+            if read_file is None:
+                read_file = device_files[file_stat.st_ino] = ReadFile(
+                    links_left=file_stat.st_nlink - 1 if not root.overlapping else None
+                )
+                return read_file, True
+
+            if read_file.links_left is not None:
+                read_file.links_left -= 1
+                if read_file.links_left <= 0:
+                    del device_files[file_stat.st_ino]
+            return read_file, False
+
+    def publish(self, read_file: ReadFile, file_stat: Optional[FileStat]) -> None:
+        """
+        None tells the other readers to read the file themselves.
+        """
+        with self.lock:
+            read_file.file_stat = file_stat
+            read_file.done = True
+            self.published.notify_all()
+
+    def wait(self, read_file: ReadFile) -> Optional[FileStat]:
+        with self.lock:
+            self.published.wait_for(lambda: read_file.done)
+            return read_file.file_stat
+
+
+class LatestFileOwners(FilesByDevice):
+    """
+    Shard keeping the latest record of each file reachable from the roots of
+    several shards (hard links, roots overlapping through bind mounts), so the
+    file is in "file_latest" and in the rollups of one shard only. The other
+    shards write just the file's records.
+
+    The shard that already has the file's latest record keeps it, a new file
+    belongs to the first shard to see it.
+    """
+
+    def __init__(self, roots: List[RootScan], shards: List[Shard]) -> None:
+        super().__init__(roots)
+        self.shards = shards
+
+    def get_owner(self, shard: Shard, file_stat: os.stat_result) -> Shard:
+        with self.lock:
+            owner = self.files.get(file_stat.st_dev, {}).get(file_stat.st_ino)
+        if owner is not None:
+            return owner
+
+        # Looked up outside of the lock, shards seeing a new file at the same
+        # time agree on the one stored first.
+        owner = next(
+            (
+                other
+                for other in self.shards
+                if other.latest_files.has_record(file_stat.st_dev, file_stat.st_ino)
+            ),
+            shard,
+        )
+        with self.lock:
+            return self.files.setdefault(file_stat.st_dev, {}).setdefault(
+                file_stat.st_ino, owner
+            )
+
+
+class Stage:
+    """
+    Pool of workers taking batches from "input_queue", processing them and
+    passing them on to the next stage (or to the writer).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        n_workers: int,
+        process: Callable[[FileBatch], None],
+        input_queue: "Union[queue.Queue[Optional[FileBatch]], DeviceQueue]",
+    ) -> None:
+        assert n_workers > 0, f"Expected at least one {name} worker. Got {n_workers}"
+
+        self.name = name
+        self.n_workers = n_workers
+        self.process = process
+        self.input_queue = input_queue
+        self.next_stage: Optional["Stage"] = None
+        self.running_workers = n_workers
+        self.lock = threading.Lock()
+
+
+class ScanPipeline:
+    """
+    Scans the roots in stages joined by bounded queues:
+
+        walk -> filter -> stat -> analyze -> write
+
+    walk:       lists directories (work stealing, see "ParallelWalker") and
+                prunes them according to the root's "ScanRules"
+    filter:     keeps only tracked files (see "utils.TrackingFilter")
+    stat:       stats the files and looks up their birth time per batch
+    analyze:    reads the files that changed, limited per device (see "DeviceQueue"
+                and "ScanConfig.device_limits"), large files are deferred
+    large file: reads the deferred large files (see "LargeFileConfig") off the
+                path of the other files, their records are written without lines
+                first and completed by a second write
+    write:      long-lived writer of each shard committing every "write_batch_size"
+                rows, it also keeps the latest records and the daily rollup
+                tables up to date
+
+    Every stage has its own number of workers and each queue holds at most
+    "pipeline_queue_size" batches, so the memory stays flat regardless of the
+    size of the roots and the database writes overlap with the file reads.
+
+    shards:         shard of each root (keyed by the root's path), several roots
+                    can share one shard
+    on_root_done:   called (from a writer thread) once all of the records of
+                    a root have been committed
+    """
+
+    POLL_SECONDS = 0.1
+
+    def __init__(
+        self,
+        scan_config: ScanConfig,
+        scan_start_time: datetime,
+        shards: Dict[str, Shard],
+        on_root_done: Callable[[RootScan], None],
+    ) -> None:
+        self.scan_config = scan_config
+        self.scan_start_time = scan_start_time
+        self.shards = shards
+        # Every shard once, in the order of the roots.
+        self.unique_shards = list(
+            {id(shard): shard for shard in shards.values()}.values()
+        )
+        self.on_root_done = on_root_done
+        self.error: Optional[BaseException] = None
+        self.error_lock = threading.Lock()
+        # Min-heap of the slowest files to read, see "slowest_files".
+        self.slow_files: List[Tuple[float, int, SlowFile]] = []
+        self.slow_files_counter = 0  # heap entries' tie breaker
+        self.slow_file_items: Dict[str, Tuple[float, int, SlowFile]] = {}  # by path
+        self.slow_files_lock = threading.Lock()
+        # Devices of the configured paths, unavailable ones are left out.
+        self.device_limits: Dict[int, DeviceLimits] = {}
+        for path, limits in scan_config.device_limits.items():
+            try:
+                self.device_limits[os.stat(path).st_dev] = limits
+            except OSError:
+                pass
+        self.rate_limiters: Dict[int, Optional[RateLimiter]] = {}
+        self.rate_limiters_lock = threading.Lock()
+        self.analyze_queue = DeviceQueue(
+            maxsize=scan_config.pipeline_queue_size,
+            get_limits=self._get_device_limits,
+        )
+        self.read_files = ReadFiles(roots=[])
+        self.latest_file_owners: Optional[LatestFileOwners] = None
+        self.analyzers = analyzers.get_analyzers(scan_config.analyzers)
+        large_files = scan_config.large_files
+        self.large_file_rate_limiter = (
+            RateLimiter(large_files.max_read_bytes_per_sec)
+            if large_files.max_read_bytes_per_sec is not None
+            else None
+        )
+        self.large_file_deadline: Optional[float] = None
+
+        self.stages = [
+            Stage(
+                name="filter",
+                n_workers=scan_config.filter_workers,
+                process=self._filter,
+                input_queue=self._new_queue(),
+            ),
+            Stage(
+                name="stat",
+                n_workers=scan_config.stat_workers,
+                process=self._stat,
+                input_queue=self._new_queue(),
+            ),
+            Stage(
+                name="analyze",
+                n_workers=scan_config.analyze_workers,
+                process=self._analyze,
+                input_queue=self.analyze_queue,
+            ),
+        ]
+        for stage, next_stage in zip(self.stages, self.stages[1:]):
+            stage.next_stage = next_stage
+        # Not a part of the chain, its batches go to the writers. The queue is
+        # unbounded so that the analyze stage never waits for the large files.
+        self.large_file_stage = (
+            Stage(
+                name="large_file",
+                n_workers=large_files.workers,
+                process=self._analyze_large_files,
+                input_queue=queue.Queue(),
+            )
+            if large_files.size_threshold is not None
+            else None
+        )
+        for shard in self.unique_shards:
+            shard.write_queue = self._new_queue()
+
+    def _new_queue(self) -> "queue.Queue[Optional[FileBatch]]":
+        return queue.Queue(maxsize=self.scan_config.pipeline_queue_size)
+
+    def run(self, root_paths: List[str]) -> List[RootScan]:
+        roots = [
+            RootScan(
+                root_path=root_path,
+                rules=self.scan_config.scan_rules.get(
+                    root_path, self.scan_config.default_scan_rules
+                ),
+                shard=self.shards[root_path],
+            )
+            for root_path in root_paths
+        ]
+        self._load_checkpoints(roots)
+        root_normpaths = [os.path.normpath(root.root_path) for root in roots]
+        for root, root_normpath in zip(roots, root_normpaths):
+            root.nested_roots = {
+                normpath
+                for normpath in root_normpaths
+                if normpath.startswith(os.path.join(root_normpath, ""))
+            }
+
+        # Roots overlap through bind mounts only, as read from the mount table.
+        mounts = utils.get_mounts()
+        root_sources = {}
+        for root in roots:
+            root_sources[root.root_path] = utils.get_root_sources(
+                root.root_path, mounts
+            )
+            root.devices = {device for device, _ in root_sources[root.root_path]}
+        overlapping_roots = utils.get_overlapping_roots(root_sources)
+        for root in roots:
+            root.overlapping = root.root_path in overlapping_roots
+        self.read_files = ReadFiles(roots)
+        if len(self.unique_shards) > 1:
+            self.latest_file_owners = LatestFileOwners(roots, self.unique_shards)
+
+        threads = [
+            threading.Thread(
+                target=self._writer,
+                args=(shard,),
+                name=f"scan-write-{i}",
+                daemon=True,
+            )
+            for i, shard in enumerate(self.unique_shards)
+        ]
+        for stage in self.stages + (
+            [self.large_file_stage] if self.large_file_stage is not None else []
+        ):
+            threads.extend(
+                threading.Thread(
+                    target=self._stage_worker,
+                    args=(stage,),
+                    name=f"scan-{stage.name}-{i}",
+                    daemon=True,
+                )
+                for i in range(stage.n_workers)
+            )
+        for thread in threads:
+            thread.start()
+
+        large_file_time_budget = self.scan_config.large_files.time_budget_seconds
+        if large_file_time_budget is not None:
+            self.large_file_deadline = time.monotonic() + large_file_time_budget
+
+        time_budget = self.scan_config.scan_time_budget_seconds
+        if time_budget is not None:
+            self._load_dir_priorities(roots)
+        walker = (PriorityWalker if time_budget is not None else ParallelWalker)(
+            n_workers=self.scan_config.scan_workers,
+            emit=self._emit,
+            is_aborted=lambda: self.error is not None,
+            deadline=(
+                time.monotonic() + time_budget if time_budget is not None else None
+            ),
+        )
+        try:
+            walker.run(roots)
+            self._stop_stage(self.stages[0])
+        except PipelineAborted:
+            pass
+        except BaseException as err:
+            self._abort(err)
+
+        for thread in threads:
+            thread.join()
+
+        if self.error is not None:
+            raise self.error
+
+        return roots
+
+    def _load_checkpoints(self, roots: List[RootScan]) -> None:
+        """
+        Resumes an interrupted run of the same scan (same "scan_start_time"),
+        directories it has checkpointed are not scanned again.
+        """
+        date_scanned = utils.get_sqlite_datetime(self.scan_start_time)
+        roots_by_path = {root.root_path: root for root in roots}
+
+        for shard in self.unique_shards:
+            conn, curs = utils.get_sqlite_conn(
+                shard.tracking_tables["scan_checkpoint"].file_path
+            )
+            for dirpath, root_path, files_scanned, files_skipped in curs.execute(
+                f"""
+                    SELECT dirpath, root_path, files_scanned, files_skipped
+                    FROM {shard.tracking_tables["scan_checkpoint"].table_name}
+                    WHERE date_scanned = ?
+                """,
+                (date_scanned,),
+            ):
+                root = roots_by_path.get(root_path)
+                if root is None or root.shard is not shard:
+                    continue
+                root.checkpointed_dirs.add(dirpath)
+                root.files_scanned += files_scanned
+                root.files_skipped += files_skipped
+            curs.close()
+            conn.close()
+
+    def _get_device_limits(self, device: int) -> DeviceLimits:
+        return self.device_limits.get(device, self.scan_config.default_device_limits)
+
+    def _get_rate_limiter(self, device: int) -> Optional[RateLimiter]:
+        rate_limiter = self.rate_limiters.get(device)
+        if rate_limiter is None and device not in self.rate_limiters:
+            rate = self._get_device_limits(device).max_read_bytes_per_sec
+            with self.rate_limiters_lock:
+                rate_limiter = self.rate_limiters.setdefault(
+                    device, RateLimiter(rate) if rate is not None else None
+                )
+        return rate_limiter
+
+    def _load_dir_priorities(self, roots: List[RootScan]) -> None:
+        """
+        Directories deferred by the previous scan come first, the rest is
+        ordered by how often the directory changed in the earlier scans.
+        """
+        roots_by_path = {root.root_path: root for root in roots}
+        own_priorities: Dict[Tuple[int, str], float] = {}
+
+        for shard in self.unique_shards:
+            dir_history_table = shard.tracking_tables["dir_history"]
+            conn, curs = utils.get_sqlite_conn(dir_history_table.file_path)
+            for dirpath, root_path, change_rate, deferred in curs.execute(f"""
+                    SELECT dirpath, root_path, change_rate, deferred
+                    FROM {dir_history_table.table_name}
+                """):
+                root = roots_by_path.get(root_path)
+                if root is None or root.shard is not shard:
+                    continue
+
+                priority = change_rate + (2 if deferred else 0)
+                own_priorities[id(root), dirpath] = priority
+                # Ancestors have to be listed first, they inherit the priority.
+                while True:
+                    if root.dir_priorities.get(dirpath, -1) >= priority:
+                        break
+                    root.dir_priorities[dirpath] = priority
+                    if len(dirpath) <= len(root.root_path):
+                        break
+                    dirpath = os.path.dirname(dirpath)
+            curs.close()
+            conn.close()
+
+        for root in roots:
+            root.files_priorities = {
+                dirpath: own_priorities[id(root), dirpath]
+                for dirpath, priority in root.dir_priorities.items()
+                if own_priorities.get((id(root), dirpath), priority) < priority
+            }
+
+    @property
+    def slowest_files(self) -> List[SlowFile]:
+        """
+        "slowest_files_count" files that took the longest to read, slowest first.
+        """
+        return [slow_file for _, _, slow_file in sorted(self.slow_files, reverse=True)]
+
+    def close(self) -> None:
+        for shard in self.unique_shards:
+            shard.close()
+
+    def _emit(self, batch: FileBatch) -> None:
+        with batch.root.lock:
+            batch.root.pending_batches += 1
+        self._put(self.stages[0].input_queue, batch)
+
+    def _abort(self, err: BaseException) -> None:
+        with self.error_lock:
+            if self.error is None:
+                self.error = err
+
+    def _put(
+        self, q: "Union[queue.Queue[Optional[FileBatch]], DeviceQueue]", item: Any
+    ) -> None:
+        # Don't block forever on a full queue if the consumer died.
+        while True:
+            if self.error is not None:
+                raise PipelineAborted()
+            try:
+                q.put(item, timeout=self.POLL_SECONDS)
+                return
+            except queue.Full:
+                continue
+
+    def _get(
+        self, q: "Union[queue.Queue[Optional[FileBatch]], DeviceQueue]"
+    ) -> Optional[FileBatch]:
+        while True:
+            if self.error is not None:
+                raise PipelineAborted()
+            try:
+                return q.get(timeout=self.POLL_SECONDS)
+            except queue.Empty:
+                continue
+
+    def _stop_stage(self, stage: Stage) -> None:
+        for _ in range(stage.n_workers):
+            self._put(stage.input_queue, STOP)
+
+    def _stage_worker(self, stage: Stage) -> None:
+        try:
+            while True:
+                batch = self._get(stage.input_queue)
+                if batch is STOP:
+                    break
+                if not batch.last:
+                    stage.process(batch)
+                self._put(
+                    (
+                        stage.next_stage.input_queue
+                        if stage.next_stage is not None
+                        else batch.root.shard.write_queue
+                    ),
+                    batch,
+                )
+                # Only once the batch is queued for the writer, its records
+                # have to be written before the large files complete them.
+                if batch.large_files is not None:
+                    assert self.large_file_stage is not None
+                    self._put(self.large_file_stage.input_queue, batch.large_files)
+
+            # The last worker to finish stops the next stage, the writers wait
+            # for the large files as well.
+            with stage.lock:
+                stage.running_workers -= 1
+                last_worker = stage.running_workers == 0
+            if last_worker:
+                if stage.next_stage is not None:
+                    self._stop_stage(stage.next_stage)
+                elif (
+                    self.large_file_stage is not None
+                    and stage is not self.large_file_stage
+                ):
+                    self._stop_stage(self.large_file_stage)
+                else:
+                    for shard in self.unique_shards:
+                        self._put(shard.write_queue, STOP)
+        except PipelineAborted:
+            pass
+        except BaseException as err:
+            self._abort(err)
+
+    def _filter(self, batch: FileBatch) -> None:
+        start_time = time.perf_counter()
+        (
+            batch.tracked_entries,
+            batch.tracking_cache_entries,
+        ) = batch.root.shard.tracking_filter.filter(batch.entries)
+
+        with batch.root.lock:
+            batch.root.files_skipped += len(batch.entries) - len(batch.tracked_entries)
+        batch.root.add_phase_time(
+            "filter", time.perf_counter() - start_time, items=len(batch.entries)
+        )
+
+    def _stat(self, batch: FileBatch) -> None:
+        start_time = time.perf_counter()
+        latest_file_owners = self.latest_file_owners
+        entries: List[
+            Tuple[
+                os.DirEntry,
+                Optional[os.stat_result],
+                Optional[PreviousFileStat],
+                float,
+            ]
+        ] = []
+        for entry in batch.tracked_entries:
+            file_start_time = time.perf_counter()
+            try:
+                # Cached by the entry, the filter has most likely stat-ed it already.
+                file_stat: Optional[os.stat_result] = entry.stat()
+            except OSError:
+                file_stat = None
+
+            shard = batch.root.shard
+            if (
+                file_stat is not None
+                and latest_file_owners is not None
+                and self.read_files.is_shared(batch.root, file_stat)
+            ):
+                shard = latest_file_owners.get_owner(shard, file_stat)
+                if shard is not batch.root.shard:
+                    batch.foreign_files.add((file_stat.st_dev, file_stat.st_ino))
+            previous = (
+                shard.latest_file_stats.get(file_stat.st_dev, file_stat.st_ino)
+                if file_stat is not None and shard.latest_file_stats is not None
+                else None
+            )
+            if not utils.is_file_unchanged(file_stat, previous):
+                previous = None
+            elif utils.is_analysis_missing(entry.name, previous, self.analyzers):
+                # Read again for the columns of the analyzers enabled since.
+                previous = None
+            entries.append(
+                (entry, file_stat, previous, time.perf_counter() - file_start_time)
+            )
+
+        # Look up birth time of the batch's new and changed files at once.
+        changed_filepaths = [
+            entry.path for entry, _, previous, _ in entries if previous is None
+        ]
+        birth_time_start_time = time.perf_counter()
+        timestamps_created = dict(
+            zip(
+                changed_filepaths,
+                utils.get_files_created_timestamps(changed_filepaths),
+            )
+        )
+
+        end_time = time.perf_counter()
+
+        batch.stat_entries = [
+            (entry, file_stat, timestamps_created.get(entry.path), previous, stat_time)
+            for entry, file_stat, previous, stat_time in entries
+        ]
+        # Files of one directory, a mount point is a directory of its own.
+        batch.device = next(
+            (file_stat.st_dev for _, file_stat, _, _ in entries if file_stat),
+            None,
+        )
+
+        batch.root.add_phase_time(
+            "stat",
+            birth_time_start_time - start_time,
+            items=len(batch.tracked_entries),
+        )
+        batch.root.add_phase_time(
+            "birth_time",
+            end_time - birth_time_start_time,
+            items=len(changed_filepaths),
+        )
+
+    def _analyze(self, batch: FileBatch) -> None:
+        if batch.device is None:
+            self._analyze_files(batch, None)
+            return
+
+        try:
+            self._analyze_files(batch, self._get_rate_limiter(batch.device))
+        finally:
+            self.analyze_queue.release(batch.device)
+
+    def _analyze_files(
+        self, batch: FileBatch, rate_limiter: Optional[RateLimiter]
+    ) -> None:
+        batch.file_stats = []
+        slow_files: List[SlowFile] = []
+        busy_time = 0.0
+        bytes_read = 0
+        size_threshold = self.scan_config.large_files.size_threshold
+        large_files: List[StatEntry] = []
+
+        for stat_entry in batch.stat_entries:
+            entry, file_stat, date_created, previous, _ = stat_entry
+            start_time = time.perf_counter()
+            is_large_file = (
+                size_threshold is not None
+                and file_stat is not None
+                and previous is None
+                and file_stat.st_size >= size_threshold
+            )
+            if is_large_file:
+                large_files.append(stat_entry)
+            collected_stat = self._collect_file_stats(
+                batch.root,
+                entry,
+                file_stat,
+                date_created,
+                previous,
+                throttle=rate_limiter.consume if rate_limiter is not None else None,
+                defer_read=is_large_file,
+            )
+            elapsed_time = time.perf_counter() - start_time
+
+            batch.file_stats.append(collected_stat)
+            if not is_large_file:
+                slow_files.append(
+                    (elapsed_time, batch.root, stat_entry, collected_stat)
+                )
+            busy_time += elapsed_time
+            bytes_read += collected_stat.bytes_read
+
+        batch.root.add_phase_time(
+            "line_count",
+            busy_time,
+            items=len(batch.file_stats),
+            bytes_read=bytes_read,
+        )
+        self._record_slow_files(slow_files)
+
+        if large_files:
+            batch.large_files = FileBatch(
+                root=batch.root, entries=[], dirpath=batch.dirpath, backfill=True
+            )
+            batch.large_files.stat_entries = large_files
+            batch.large_files.device = batch.device
+            batch.large_files.foreign_files = batch.foreign_files
+            # Emitted before this batch is written, the root isn't done until
+            # the large files are written as well.
+            with batch.root.lock:
+                batch.root.pending_batches += 1
+
+    def _analyze_large_files(self, batch: FileBatch) -> None:
+        """
+        Reads the large files deferred by the analyze stage, the batch then
+        replaces their records written without lines. Files not started within
+        "LargeFileConfig.time_budget_seconds" keep those records. Every file
+        is read in one of the device's "max_concurrency" slots, shared with the
+        analyze stage.
+        """
+        rate_limiters = [
+            rate_limiter
+            for rate_limiter in [
+                self.large_file_rate_limiter,
+                (
+                    self._get_rate_limiter(batch.device)
+                    if batch.device is not None
+                    else None
+                ),
+            ]
+            if rate_limiter is not None
+        ]
+
+        # Large files are throttled while they are being read, not after.
+        def throttle(n_bytes: int) -> None:
+            for rate_limiter in rate_limiters:
+                rate_limiter.consume(n_bytes)
+
+        batch.file_stats = []
+        slow_files: List[SlowFile] = []
+        busy_time = 0.0
+        bytes_read = 0
+
+        for stat_entry in batch.stat_entries:
+            if (
+                self.large_file_deadline is not None
+                and time.monotonic() > self.large_file_deadline
+            ):
+                with batch.root.lock:
+                    batch.root.large_files_left += 1
+                continue
+
+            entry, file_stat, date_created, previous, _ = stat_entry
+            if batch.device is not None:
+                self.analyze_queue.acquire(batch.device)
+            start_time = time.perf_counter()
+            try:
+                collected_stat = self._collect_file_stats(
+                    batch.root,
+                    entry,
+                    file_stat,
+                    date_created,
+                    previous,
+                    throttle=throttle if rate_limiters else None,
+                )
+            finally:
+                if batch.device is not None:
+                    self.analyze_queue.release(batch.device)
+            elapsed_time = time.perf_counter() - start_time
+
+            batch.file_stats.append(collected_stat)
+            slow_files.append((elapsed_time, batch.root, stat_entry, collected_stat))
+            busy_time += elapsed_time
+            bytes_read += collected_stat.bytes_read
+
+        batch.root.add_phase_time(
+            "line_count",
+            busy_time,
+            items=len(batch.file_stats),
+            bytes_read=bytes_read,
+        )
+        self._record_slow_files(slow_files)
+
+    def _collect_file_stats(
+        self,
+        root: RootScan,
+        entry: os.DirEntry,
+        file_stat: Optional[os.stat_result],
+        date_created: Optional[int],
+        previous: Optional[PreviousFileStat],
+        throttle: Optional[Callable[[int], None]] = None,
+        defer_read: bool = False,
+    ) -> FileStat:
+        """
+        Files reachable by several paths are read only once, see "ReadFiles".
+        """
+
+        def collect() -> FileStat:
+            return utils.collect_file_stats(
+                filepath=entry.path,
+                scan_start_time=self.scan_start_time,
+                file_stat=file_stat,
+                date_created=date_created,
+                previous=previous,
+                line_count_config=self.scan_config.line_counting,
+                analyzers=self.analyzers,
+                throttle=throttle,
+                defer_read=defer_read,
+            )
+
+        # Unchanged files are not read at all, neither are deferred large files.
+        if (
+            file_stat is None
+            or previous is not None
+            or defer_read
+            or not self.read_files.is_shared(root, file_stat)
+        ):
+            return collect()
+
+        read_file, is_first_reader = self.read_files.claim(root, file_stat)
+        if is_first_reader:
+            try:
+                collected_stat = collect()
+            except BaseException:
+                self.read_files.publish(read_file, None)
+                raise
+            self.read_files.publish(read_file, collected_stat)
+            return collected_stat
+
+        first_stat = self.read_files.wait(read_file)
+        # The file could have changed since it was read through the other path.
+        if (
+            first_stat is None
+            or first_stat.size != file_stat.st_size
+            or first_stat.mtime_ns != file_stat.st_mtime_ns
+        ):
+            return collect()
+        return first_stat._replace(
+            filename=entry.name,
+            filepath=entry.path,
+            filetype=utils.get_file_type(entry.name),
+            bytes_read=0,
+        )
+
+    def _record_slow_files(self, slow_files: List[SlowFile]) -> None:
+        n = self.scan_config.slowest_files_count
+        if n == 0:
+            return
+
+        # Pick the batch's candidates first, the heap's lock is taken only once.
+        with self.slow_files_lock:
+            for slow_file in heapq.nlargest(n, slow_files, key=lambda f: f[0]):
+                # A file under overlapping roots is recorded once, by its
+                # slowest read.
+                filepath = slow_file[3].filepath
+                recorded = self.slow_file_items.get(filepath)
+                if recorded is not None:
+                    if recorded[0] >= slow_file[0]:
+                        continue
+                    self.slow_files.remove(recorded)
+                    heapq.heapify(self.slow_files)
+                    del self.slow_file_items[filepath]
+
+                self.slow_files_counter += 1
+                item = (slow_file[0], self.slow_files_counter, slow_file)
+                if len(self.slow_files) < n:
+                    heapq.heappush(self.slow_files, item)
+                elif item[0] > self.slow_files[0][0]:
+                    evicted = heapq.heapreplace(self.slow_files, item)
+                    del self.slow_file_items[evicted[2][3].filepath]
+                else:
+                    break
+                self.slow_file_items[filepath] = item
+
+    def _writer(self, shard: Shard) -> None:
+        file_table = shard.tracking_tables["file"]
+        record_table = shard.tracking_tables["file_record"]
+        file_latest_table = shard.tracking_tables["file_latest"]
+        tracking_cache_table = shard.tracking_tables["tracking_cache"]
+        checkpoint_table = shard.tracking_tables["scan_checkpoint"]
+        error_table = shard.tracking_tables["file_error"]
+        dir_listing_table = shard.tracking_tables["dir_listing"]
+        date_scanned = utils.get_sqlite_datetime(self.scan_start_time)
+
+        # A resumed scan may write records again, records of a directory that
+        # was interrupted before its checkpoint are replaced.
+        insert_record_sql = f"""
+            INSERT OR REPLACE INTO {record_table.table_name} ({record_table.column_names_string})
+            VALUES ({record_table.columns_placeholder_string})
+        """
+        insert_file_latest_sql = f"""
+            INSERT OR REPLACE INTO {file_latest_table.table_name}
+            ({file_latest_table.column_names_string})
+            VALUES ({file_latest_table.columns_placeholder_string})
+        """
+        insert_tracking_cache_sql = f"""
+            INSERT OR REPLACE INTO {tracking_cache_table.table_name}
+            ({tracking_cache_table.column_names_string})
+            VALUES ({tracking_cache_table.columns_placeholder_string})
+        """
+        insert_checkpoint_sql = f"""
+            INSERT OR REPLACE INTO {checkpoint_table.table_name}
+            ({checkpoint_table.column_names_string})
+            VALUES ({checkpoint_table.columns_placeholder_string})
+        """
+        insert_dir_listing_sql = f"""
+            INSERT OR REPLACE INTO {dir_listing_table.table_name}
+            ({dir_listing_table.column_names_string})
+            VALUES ({dir_listing_table.columns_placeholder_string})
+        """
+        upsert_error_sql = f"""
+            INSERT INTO {error_table.table_name} ({error_table.column_names_string})
+            VALUES ({error_table.columns_placeholder_string})
+            ON CONFLICT (error_fingerprint)
+            DO UPDATE SET date_last_seen = excluded.date_last_seen
+        """
+        # Directory -> [batches written, files scanned, files skipped]
+        dir_progress: Dict[str, List[int]] = {}
+
+        try:
+            with utils.SqliteCursorWithLock(
+                filepath=file_table.file_path, lock=file_table.lock
+            ) as curs:
+                uncommitted_rows = 0
+                done_roots: List[RootScan] = []
+                curs.execute(
+                    "INSERT OR IGNORE INTO scan_date (date_scanned) VALUES (?)",
+                    (date_scanned,),
+                )
+                ((scan_id,),) = curs.execute(
+                    "SELECT scan_id FROM scan_date WHERE date_scanned = ?",
+                    (date_scanned,),
+                ).fetchall()
+                filetype_ids: Dict[str, int] = {}
+                curs.execute("begin")
+
+                while True:
+                    batch = self._get(shard.write_queue)
+                    if batch is STOP:
+                        break
+
+                    start_time = time.perf_counter()
+                    latest_file_stats = (
+                        [
+                            file_stat
+                            for file_stat in batch.file_stats
+                            if (file_stat.dev, file_stat.inode)
+                            not in batch.foreign_files
+                        ]
+                        if batch.foreign_files
+                        else batch.file_stats
+                    )
+                    # Must run before "file_latest" is updated, the rollups need
+                    # the records being replaced.
+                    changed_files = self._update_rollups(curs, shard, latest_file_stats)
+                    curs.executemany(
+                        insert_record_sql,
+                        [
+                            file_stat.to_record_tuple(
+                                scan_id,
+                                self._get_path_id(curs, file_stat, filetype_ids),
+                            )
+                            for file_stat in batch.file_stats
+                        ],
+                    )
+                    curs.executemany(
+                        insert_file_latest_sql,
+                        [file_stat.to_tuple() for file_stat in latest_file_stats],
+                    )
+                    curs.executemany(
+                        insert_tracking_cache_sql,
+                        [
+                            (*cache_entry, date_scanned)
+                            for cache_entry in batch.tracking_cache_entries
+                        ],
+                    )
+                    errors = {
+                        file_stat.error_fingerprint: (
+                            file_stat.error_fingerprint,
+                            file_stat.error_class,
+                            file_stat.error_traceback,
+                            date_scanned,
+                            date_scanned,
+                        )
+                        for file_stat in batch.file_stats
+                        if file_stat.error_occured
+                    }
+                    curs.executemany(upsert_error_sql, list(errors.values()))
+                    if batch.dir_listing is not None:
+                        curs.execute(insert_dir_listing_sql, batch.dir_listing)
+                    uncommitted_rows += len(batch.file_stats) + len(
+                        batch.tracking_cache_entries
+                    )
+
+                    # Checkpointed in the same transaction as the directory's
+                    # last records. Records of large files completed afterwards
+                    # are not a part of the checkpoint, an interrupted scan
+                    # leaves them without lines. Directories checkpointed by
+                    # the interrupted run keep their counts, they get only
+                    # an empty batch carrying their listing.
+                    if (
+                        not batch.last
+                        and not batch.backfill
+                        and batch.dirpath not in batch.root.checkpointed_dirs
+                    ):
+                        progress = dir_progress.setdefault(batch.dirpath, [0, 0, 0])
+                        progress[0] += 1
+                        progress[1] += len(batch.file_stats)
+                        progress[2] += len(batch.entries) - len(batch.tracked_entries)
+                        if progress[0] == batch.dir_batches:
+                            curs.execute(
+                                insert_checkpoint_sql,
+                                (
+                                    date_scanned,
+                                    batch.dirpath,
+                                    batch.root.root_path,
+                                    progress[1],
+                                    progress[2],
+                                ),
+                            )
+                            del dir_progress[batch.dirpath]
+
+                    root = batch.root
+                    with root.lock:
+                        if changed_files:
+                            root.changed_dirs.add(batch.dirpath)
+                        if not batch.backfill:
+                            root.files_scanned += len(batch.file_stats)
+                        root.pending_batches -= 1
+                        root.walk_done = root.walk_done or batch.last
+                        if root.walk_done and root.pending_batches == 0:
+                            done_roots.append(root)
+
+                    # Commit as soon as a root is complete so that it can be
+                    # reported right away.
+                    commit = (
+                        bool(done_roots)
+                        or uncommitted_rows >= self.scan_config.write_batch_size
+                    )
+                    if commit:
+                        curs.execute("commit")
+                        uncommitted_rows = 0
+
+                    batch.root.add_phase_time(
+                        "insert",
+                        time.perf_counter() - start_time,
+                        items=len(batch.file_stats),
+                    )
+
+                    if commit:
+                        for root in done_roots:
+                            root.elapsed_time = round(time.time() - root.start_time, 2)
+                            self.read_files.release_root(root)
+                            if self.latest_file_owners is not None:
+                                self.latest_file_owners.release_root(root)
+                            self.on_root_done(root)
+                        done_roots = []
+                        curs.execute("begin")
+
+                curs.execute("commit")
+        except PipelineAborted:
+            pass
+        except BaseException as err:
+            self._abort(err)
+
+    @staticmethod
+    def _get_path_id(
+        curs: Any, file_stat: FileStat, filetype_ids: Dict[str, int]
+    ) -> int:
+        """
+        Id of the file's path in the "path" dictionary, the path is added
+        if it's seen for the first time. Filetypes are few, their ids are kept
+        in "filetype_ids".
+        """
+        rows = curs.execute(
+            "SELECT path_id FROM path WHERE filepath = ?", (file_stat.filepath,)
+        ).fetchall()
+        if rows:
+            return rows[0][0]
+
+        filetype_id = filetype_ids.get(file_stat.filetype)
+        if filetype_id is None:
+            curs.execute(
+                "INSERT OR IGNORE INTO filetype (filetype) VALUES (?)",
+                (file_stat.filetype,),
+            )
+            ((filetype_id,),) = curs.execute(
+                "SELECT filetype_id FROM filetype WHERE filetype = ?",
+                (file_stat.filetype,),
+            ).fetchall()
+            filetype_ids[file_stat.filetype] = filetype_id
+
+        curs.execute(
+            "INSERT INTO path (filepath, filename, filetype_id) VALUES (?, ?, ?)",
+            (file_stat.filepath, file_stat.filename, filetype_id),
+        )
+        return curs.getconnection().last_insert_rowid()
+
+    def _update_rollups(
+        self, curs: Any, shard: Shard, file_stats: List[FileStat]
+    ) -> int:
+        """
+        Rollups aggregate the latest record of each inode. Every new record
+        therefore removes the contribution of the inode's previous latest record
+        and adds its own. Returns the number of new and modified files.
+
+        Records written before the device was recorded match the inode on any
+        device, they are deleted from "file_latest" once replaced.
+        """
+        file_latest_table = shard.tracking_tables["file_latest"]
+        total_table = shard.tracking_tables["rollup_daily_total"]
+        by_type_table = shard.tracking_tables["rollup_daily_by_type"]
+
+        previous_record_sql = f"""
+            SELECT date_modified, date_created, filetype, lines, dev
+            FROM {file_latest_table.table_name}
+            WHERE inode = ? AND (dev = ? OR dev IS NULL)
+        """
+        delete_legacy_record_sql = f"""
+            DELETE FROM {file_latest_table.table_name}
+            WHERE inode = ? AND dev IS NULL
+        """
+
+        deltas: Dict[Tuple[str, str], List[int]] = {}
+
+        def add(
+            date_modified: str, date_created: str, filetype: str, lines: int, sign: int
+        ) -> None:
+            delta = deltas.setdefault(
+                (date_modified[:10], filetype), [0] * len(utils.ROLLUP_METRICS)
+            )
+            contribution = utils.get_rollup_contribution(
+                date_modified=date_modified, date_created=date_created, lines=lines
+            )
+            for i, value in enumerate(contribution):
+                delta[i] += sign * value
+
+        # Records of the batch replacing each other (an inode listed twice)
+        # aren't in "file_latest" yet.
+        batch_records: Dict[
+            Tuple[Optional[int], int], Tuple[str, str, str, int, Optional[int]]
+        ] = {}
+        changed_files = 0
+
+        for file_stat in file_stats:
+            key = (file_stat.dev, file_stat.inode)
+            if key in batch_records:
+                previous_records = [batch_records[key]]
+            else:
+                previous_records = curs.execute(
+                    previous_record_sql, (file_stat.inode, file_stat.dev)
+                ).fetchall()
+            for *previous, previous_dev in previous_records:
+                add(*previous, sign=-1)
+                if previous_dev is None:
+                    curs.execute(delete_legacy_record_sql, (file_stat.inode,))
+            if (
+                not previous_records
+                or previous_records[0][0] != file_stat.date_modified
+            ):
+                changed_files += 1
+
+            record = (
+                file_stat.date_modified,
+                file_stat.date_created,
+                file_stat.filetype,
+                file_stat.lines,
+                file_stat.dev,
+            )
+            add(*record[:-1], sign=1)
+            batch_records[key] = record
+
+        total_deltas: Dict[str, List[int]] = {}
+        for (date, _), delta in deltas.items():
+            total_delta = total_deltas.setdefault(date, [0] * len(delta))
+            for i, value in enumerate(delta):
+                total_delta[i] += value
+
+        for table, keys, rows in [
+            (
+                by_type_table,
+                ["date", "filetype"],
+                [(*key, *delta) for key, delta in deltas.items()],
+            ),
+            (
+                total_table,
+                ["date"],
+                [(key, *delta) for key, delta in total_deltas.items()],
+            ),
+        ]:
+            curs.executemany(
+                f"""
+                    INSERT INTO {table.table_name} ({table.column_names_string})
+                    VALUES ({table.columns_placeholder_string})
+                    ON CONFLICT ({", ".join(keys)}) DO UPDATE SET
+                    {", ".join(f"{metric} = {metric} + excluded.{metric}" for metric in utils.ROLLUP_METRICS)}
+                """,
+                rows,
+            )
+
+        return changed_files
@@ -0,0 +1,91 @@
+import logging
+import os
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import pytest
+
+from models import Environment, ScanConfig
+import file_scanner
+
+
+@pytest.fixture(scope="function")
+def write_files() -> Callable[..., List[Path]]:
+    """
+    Writes files (relative path -> content) under the root and marks them
+    as tracked, returns their paths.
+    """
+
+    def write(
+        root: Path,
+        files: Dict[str, str],
+        tracked: bool = True,
+        mtime: Optional[float] = None,
+    ) -> List[Path]:
+        filepaths = []
+        for relpath, content in files.items():
+            filepath = root / relpath
+            filepath.parent.mkdir(parents=True, exist_ok=True)
+            filepath.write_text(content)
+            if tracked:
+                os.setxattr(filepath, "user.tracked", b"true")
+            if mtime is not None:
+                os.utime(filepath, (mtime, mtime))
+            filepaths.append(filepath)
+        return filepaths
+
+    return write
+
+
+@pytest.fixture(scope="function")
+def make_scan(tmp_path: Path) -> Iterator[Callable[..., file_scanner.Scan]]:
+    """
+    Creates a "Scan" of the roots with its database, dumps and reports under
+    "tmp_path", extra keyword arguments override the config.
+    """
+    logger = logging.getLogger("scan_logger")
+    handlers = list(logger.handlers)
+    data_path = tmp_path / "scanner"
+
+    def make(scan_paths: List[Path], **config: Any) -> file_scanner.Scan:
+        scan_config = ScanConfig.model_validate(
+            {
+                "environment": Environment.PROD,
+                "scan_paths": [str(scan_path) for scan_path in scan_paths],
+                "database_filepath": str(data_path / "data" / "file_records.dat"),
+                "scan_period_wait_time_hours": 0,
+                "csv_dump_path": str(data_path / "csv_dumps"),
+                "reports_path": str(data_path / "reports"),
+                "log_file": str(data_path / "logs" / "debug.log"),
+                "scan_workers": 2,
+                "filter_workers": 2,
+                "stat_workers": 2,
+                "analyze_workers": 2,
+                **config,
+            }
+        )
+        os.makedirs(os.path.dirname(scan_config.log_file), exist_ok=True)
+        return file_scanner.Scan(scan_config)
+
+    yield make
+
+    for handler in logger.handlers[len(handlers) :]:
+        handler.close()
+    logger.handlers = handlers
+
+
+@pytest.fixture(scope="function")
+def query() -> Callable[..., List[Any]]:
+    """
+    Runs the query through "Scan.get_query_conn", so the shards are included.
+    """
+
+    def run(scan: file_scanner.Scan, sql: str, bindings: Any = ()) -> List[Any]:
+        conn, curs = scan.get_query_conn()
+        try:
+            return curs.execute(sql, bindings).fetchall()
+        finally:
+            curs.close()
+            conn.close()
+
+    return run
@@ -0,0 +1,71 @@
+from datetime import datetime
+
+import pytest
+
+import analyzers
+
+CONTENT = (
+    b"import os\n"
+    b"\n"
+    b"  \t  # comment\n"
+    b"x = '" + b"y" * 100 + b"'\n"
+    b" \r # not a comment\n"
+    b"   \n"
+    b"last line"
+)
+
+
+def analyze(name, filetype, chunk_size):
+    analyzer = analyzers.ANALYZERS[name](filetype)
+    for start in range(0, len(CONTENT), chunk_size):
+        analyzer.update(CONTENT[start : start + chunk_size])
+        assert len(getattr(analyzer, "tail", b"")) <= 5 + 8
+    return analyzer.result()
+
+
+@pytest.mark.a81f5c3e07
+@pytest.mark.scanner
+@pytest.mark.analyzers
+@pytest.mark.parametrize("name", ["blank_lines", "comment_lines", "longest_line"])
+def test_line_analyzers_keep_bounded_state_across_chunks(name):
+    expected = analyze(name, "py", len(CONTENT))
+
+    for chunk_size in range(1, 20):
+        assert analyze(name, "py", chunk_size) == expected
+    results = {"blank_lines": (2,), "comment_lines": (1,), "longest_line": (106,)}
+    assert expected == results[name]
+
+
+@pytest.mark.b2e6d9a415
+@pytest.mark.scanner
+@pytest.mark.analyzers
+def test_incremental_scan_reads_files_for_newly_enabled_analyzers(
+    tmp_path, write_files, make_scan, query
+):
+    root = tmp_path / "root"
+    write_files(root, {"a.py": "# a\nb = 1\n", "c.txt": "cc\n"})
+    make_scan([root], incremental_scan=True).perform_scan(
+        scan_start_time=datetime(2026, 5, 1, 12)
+    )
+
+    scan = make_scan(
+        [root],
+        incremental_scan=True,
+        analyzers=["comment_lines", "longest_line"],
+    )
+    scan_stat = scan.perform_scan(scan_start_time=datetime(2026, 5, 2, 12))
+
+    assert scan_stat.bytes_read == 13
+    rows = query(
+        scan,
+        """
+            SELECT filepath, comment_lines, longest_line FROM file
+            WHERE date_scanned = (SELECT MAX(date_scanned) FROM file)
+            ORDER BY filepath
+        """,
+    )
+    assert rows == [(str(root / "a.py"), 1, 5), (str(root / "c.txt"), None, 2)]
+
+    # Columns NULL for the file type don't make the file read again.
+    scan_stat = scan.perform_scan(scan_start_time=datetime(2026, 5, 3, 12))
+    assert scan_stat.bytes_read == 0
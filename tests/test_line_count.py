@@ -0,0 +1,99 @@
+import mmap
+
+import pytest
+
+import utils
+from models import BinaryFilePolicy, LineCountConfig
+
+CONTENTS = [
+    b"",
+    b"a",
+    b"a\n",
+    b"a\nb",
+    b"\n\n\n",
+    b"a\rb\rc\r",
+    b"a\r\nb\r\nc",
+    b"a\r\n\r\nb\n\rc\r\r\n",
+    b"\r\n" * 10,
+    b"line one\nline two\r\nline three\rlast line",
+]
+CONFIGS = [
+    LineCountConfig(),
+    # Line breaks split by the head and the chunks.
+    LineCountConfig(binary_sniff_size=1, chunk_size=1),
+    LineCountConfig(binary_sniff_size=2, chunk_size=3),
+    # Memory mapped.
+    LineCountConfig(binary_sniff_size=1, chunk_size=2, mmap_threshold=1),
+]
+
+
+@pytest.mark.c8f4a2e6b0
+@pytest.mark.scanner
+@pytest.mark.line_count
+@pytest.mark.parametrize("config", CONFIGS)
+@pytest.mark.parametrize("content", CONTENTS)
+def test_line_count_matches_text_mode(tmp_path, content, config):
+    filepath = tmp_path / "file.txt"
+    filepath.write_bytes(content)
+    with open(filepath) as f:
+        expected = len(f.readlines())
+
+    line_count_stat = utils.get_line_count(str(filepath), config)
+
+    assert line_count_stat.count == expected
+    assert line_count_stat.bytes_read == len(content)
+    assert not line_count_stat.is_binary
+    assert not line_count_stat.error_occured
+
+
+@pytest.mark.d1a9c5f7e3
+@pytest.mark.scanner
+@pytest.mark.line_count
+def test_large_files_are_memory_mapped(tmp_path, monkeypatch):
+    filepath = tmp_path / "file.txt"
+    filepath.write_bytes(b"x\n" * 1000 + b"last")
+    mapped_sizes = []
+
+    class RecordingMmap(mmap.mmap):
+        def __init__(self, fileno, length, *args, **kwargs):
+            mapped_sizes.append(length)
+
+    monkeypatch.setattr(utils.mmap, "mmap", RecordingMmap)
+
+    config = LineCountConfig(chunk_size=7, mmap_threshold=2005)
+    assert utils.get_line_count(str(filepath), config).count == 1001
+    assert mapped_sizes == []
+
+    config = LineCountConfig(chunk_size=7, mmap_threshold=2004)
+    assert utils.get_line_count(str(filepath), config).count == 1001
+    assert mapped_sizes == [0]
+
+
+@pytest.mark.e2b0d6a8f4
+@pytest.mark.scanner
+@pytest.mark.line_count
+@pytest.mark.parametrize(
+    "policy, count, bytes_read",
+    [
+        (BinaryFilePolicy.SKIP, 0, 4),
+        (BinaryFilePolicy.COUNT, 26, 400),
+        # 25 line breaks in the first 100 bytes, extrapolated to 400 bytes.
+        (BinaryFilePolicy.SAMPLE, 100, 100),
+    ],
+)
+def test_binary_file_policies(tmp_path, policy, count, bytes_read):
+    filepath = tmp_path / "file.bin"
+    filepath.write_bytes(b"\x00\x01\x02\r" * 25 + b"\x03\x04\x05\x06" * 75)
+    config = LineCountConfig(
+        binary_sniff_size=4,
+        binary_sample_size=100,
+        binary_file_policy=policy,
+        chunk_size=16,
+    )
+
+    line_count_stat = utils.get_line_count(str(filepath), config)
+
+    assert line_count_stat.is_binary
+    assert line_count_stat.count == count
+    assert line_count_stat.bytes_read == bytes_read
+    assert not line_count_stat.error_occured
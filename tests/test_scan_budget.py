@@ -0,0 +1,76 @@
+import os
+from datetime import datetime
+
+import pytest
+
+from scan_engine import PriorityWalker
+import utils
+
+
+@pytest.mark.d52a8c1e96
+@pytest.mark.scanner
+@pytest.mark.budget
+def test_deferred_dirs_are_scanned_first_by_the_next_scan(
+    tmp_path, write_files, make_scan, query, monkeypatch
+):
+    root = tmp_path / "root"
+    write_files(
+        root,
+        {
+            "x.txt": "x\n",
+            **{f"{top}/x.txt": "x\n" for top in "abc"},
+            **{f"{top}/{sub}/x.txt": "x\n" for top in "abc" for sub in "12"},
+        },
+    )
+    scan = make_scan([root], scan_time_budget_seconds=60, scan_workers=1)
+
+    # The budget runs out once "max_listings" directories were listed.
+    listings = []
+    max_listings = [4]
+    process_dir = PriorityWalker._process_dir
+
+    def counted_process_dir(self, worker_id, root, dirpath, depth):
+        listings.append(dirpath)
+        process_dir(self, worker_id, root, dirpath, depth)
+
+    monkeypatch.setattr(PriorityWalker, "_process_dir", counted_process_dir)
+    monkeypatch.setattr(
+        PriorityWalker,
+        "_is_past_deadline",
+        lambda self: len(listings) >= max_listings[0],
+    )
+
+    def get_deferred_dirs():
+        return {
+            dirpath
+            for (dirpath,) in query(
+                scan, "SELECT dirpath FROM dir_history WHERE deferred = 1"
+            )
+        }
+
+    scan.perform_scan(scan_start_time=datetime(2026, 5, 1, 12))
+    deferred_dirs = get_deferred_dirs()
+    assert deferred_dirs
+
+    # Just enough listings for the deferred directories and their ancestors.
+    ancestors = set()
+    for dirpath in deferred_dirs:
+        while dirpath != str(root):
+            dirpath = os.path.dirname(dirpath)
+            ancestors.add(dirpath)
+    listings.clear()
+    max_listings[0] = len(deferred_dirs | ancestors)
+    date_scanned = datetime(2026, 5, 2, 12)
+    scan.perform_scan(scan_start_time=date_scanned)
+
+    scanned_dirs = {
+        os.path.dirname(filepath)
+        for (filepath,) in query(
+            scan,
+            "SELECT filepath FROM file WHERE date_scanned = ?",
+            (utils.get_sqlite_datetime(date_scanned),),
+        )
+    }
+    # Files of the ancestors were scanned by the first scan already.
+    assert scanned_dirs == deferred_dirs
+    assert not deferred_dirs & get_deferred_dirs()
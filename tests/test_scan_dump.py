@@ -0,0 +1,172 @@
+import csv
+from datetime import date, datetime
+
+import apsw
+import pytest
+
+import utils
+
+
+def read_partition(filepath):
+    with open(filepath, newline="") as f:
+        header, *rows = csv.reader(f)
+    return [dict(zip(header, row)) for row in rows]
+
+
+@pytest.mark.f7c1b5a9e2
+@pytest.mark.scanner
+@pytest.mark.dump
+@pytest.mark.parametrize("shard_by_root", [False, True])
+def test_dump_db_writes_missing_and_latest_partitions_only(
+    tmp_path, write_files, make_scan, query, shard_by_root
+):
+    roots = [tmp_path / "first", tmp_path / "second"]
+    for root in roots:
+        write_files(root, {"a.txt": "a\n", "b.py": "b\nb\n"})
+    scan = make_scan(roots, shard_by_root=shard_by_root)
+    files_path = tmp_path / "scanner" / "csv_dumps" / "files"
+
+    for day in [1, 2]:
+        scan.perform_scan(scan_start_time=datetime(2026, 5, day, 12))
+    scan.dump_db()
+
+    assert sorted(filepath.name for filepath in files_path.iterdir()) == [
+        "2026-05-01.csv",
+        "2026-05-02.csv",
+    ]
+    for filepath in files_path.iterdir():
+        filepath.write_text("stale\n")
+
+    # The second scan of the day goes into the latest partition.
+    scan.perform_scan(scan_start_time=datetime(2026, 5, 2, 18))
+    scan.dump_db()
+
+    assert (files_path / "2026-05-01.csv").read_text() == "stale\n"
+    rows = read_partition(files_path / "2026-05-02.csv")
+    expected = query(
+        scan,
+        """
+            SELECT filepath, date_scanned, lines
+            FROM file
+            WHERE date_scanned >= '2026-05-02'
+            ORDER BY 1, 2
+        """,
+    )
+    assert len(expected) == 8
+    rows = sorted(
+        (row["filepath"], row["date_scanned"], int(row["lines"])) for row in rows
+    )
+    assert rows == expected
+
+    # A missing partition is written again.
+    (files_path / "2026-05-01.csv").unlink()
+    scan.dump_db()
+
+    rows = read_partition(files_path / "2026-05-01.csv")
+    assert sorted(row["filepath"] for row in rows) == sorted(
+        str(root / filename) for root in roots for filename in ["a.txt", "b.py"]
+    )
+    assert {row["date_scanned"] for row in rows} == {"2026-05-01 12:00:00"}
+
+
+@pytest.mark.a3d9f1c7b5
+@pytest.mark.scanner
+@pytest.mark.dump
+def test_parquet_columns_are_typed(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    conn = apsw.Connection(":memory:")
+    curs = conn.cursor()
+    curs.execute("""
+        CREATE TABLE t (
+            date_scanned DATETIME,
+            day DATE,
+            lines INTEGER,
+            ratio REAL,
+            name TEXT
+        )
+        """)
+    curs.executemany(
+        "INSERT INTO t VALUES (?, ?, ?, ?, ?)",
+        [
+            ("2026-05-01 12:00:00", "2026-05-01", 3, 0.5, "a.txt"),
+            (None, None, None, None, None),
+            ("2026-05-02 18:30:15", "2026-05-02", 2**40, 1.0, "b.py"),
+        ],
+    )
+    column_types = {
+        "date_scanned": "DATETIME",
+        "day": "DATE",
+        "lines": "INTEGER",
+        "ratio": "REAL",
+    }
+
+    n_rows = utils.write_query_to_parquet(
+        curs,
+        "SELECT * FROM t ORDER BY rowid",
+        str(tmp_path / "t.parquet"),
+        column_types=column_types,
+    )
+
+    assert n_rows == 3
+    table = pq.read_table(tmp_path / "t.parquet")
+    # Parquet has no unit of seconds, they are stored as milliseconds.
+    assert [(field.name, str(field.type)) for field in table.schema] == [
+        ("date_scanned", "timestamp[ms]"),
+        ("day", "date32[day]"),
+        ("lines", "int64"),
+        ("ratio", "double"),
+        ("name", "string"),
+    ]
+    assert table.to_pylist() == [
+        {
+            "date_scanned": datetime(2026, 5, 1, 12),
+            "day": date(2026, 5, 1),
+            "lines": 3,
+            "ratio": 0.5,
+            "name": "a.txt",
+        },
+        {
+            "date_scanned": None,
+            "day": None,
+            "lines": None,
+            "ratio": None,
+            "name": None,
+        },
+        {
+            "date_scanned": datetime(2026, 5, 2, 18, 30, 15),
+            "day": date(2026, 5, 2),
+            "lines": 2**40,
+            "ratio": 1.0,
+            "name": "b.py",
+        },
+    ]
+
+
+@pytest.mark.b6e2a8d4c0
+@pytest.mark.scanner
+@pytest.mark.dump
+def test_switching_export_format_writes_all_partitions(
+    tmp_path, write_files, make_scan
+):
+    pq = pytest.importorskip("pyarrow.parquet")
+    root = tmp_path / "root"
+    write_files(root, {"a.txt": "a\n", "b.py": "b\nb\n"})
+    scan = make_scan([root])
+    for day in [1, 2]:
+        scan.perform_scan(scan_start_time=datetime(2026, 5, day, 12))
+    scan.dump_db()
+
+    scan = make_scan([root], export_format="PARQUET")
+    scan.dump_db()
+
+    files_path = tmp_path / "scanner" / "csv_dumps" / "files"
+    for day in ["2026-05-01", "2026-05-02"]:
+        table = pq.read_table(files_path / f"{day}.parquet")
+        rows = sorted(
+            (row["filename"], row["date_scanned"], row["lines"])
+            for row in table.to_pylist()
+        )
+        date_scanned = datetime.fromisoformat(f"{day} 12:00:00")
+        assert rows == [("a.txt", date_scanned, 1), ("b.py", date_scanned, 2)]
+        assert read_partition(files_path / f"{day}.csv")
+    assert pq.read_table(tmp_path / "scanner" / "csv_dumps" / "scans.parquet")
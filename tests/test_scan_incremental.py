@@ -0,0 +1,66 @@
+import os
+from datetime import datetime
+
+import pytest
+
+import utils
+
+COLUMNS = "filename, lines, date_created, longest_line, content_hash"
+
+
+@pytest.mark.d5b1f9c3a7
+@pytest.mark.scanner
+@pytest.mark.incremental
+def test_unchanged_files_carry_their_stats_forward(
+    tmp_path, write_files, make_scan, query, monkeypatch
+):
+    root = tmp_path / "root"
+    write_files(root, {"a.py": "a\nbb\n", "b.txt": "ccc\n"})
+    scan = make_scan(
+        [root], incremental_scan=True, analyzers=["longest_line", "content_hash"]
+    )
+    scan.perform_scan(scan_start_time=datetime(2026, 5, 1, 12))
+    first_rows = query(scan, f"SELECT {COLUMNS} FROM file_latest ORDER BY 1")
+    assert [row[:2] for row in first_rows] == [("a.py", 2), ("b.txt", 1)]
+    assert not any(value is None for row in first_rows for value in row)
+
+    # The date of creation recorded by the first scan, so that a lookup
+    # by the second one would stand out.
+    created_at = datetime(2026, 4, 1, 10).timestamp()
+    read_filepaths = []
+    get_line_count = utils.get_line_count
+
+    def recorded_get_line_count(filepath, *args, **kwargs):
+        read_filepaths.append(os.path.basename(filepath))
+        return get_line_count(filepath, *args, **kwargs)
+
+    monkeypatch.setattr(utils, "get_line_count", recorded_get_line_count)
+    monkeypatch.setattr(
+        utils,
+        "get_files_created_timestamps",
+        lambda filepaths: [int(created_at)] * len(filepaths),
+    )
+    write_files(root, {"c.txt": "dddd\n"})
+    scan_stat = scan.perform_scan(scan_start_time=datetime(2026, 5, 2, 12))
+
+    assert read_filepaths == ["c.txt"]
+    assert scan_stat.files_scanned == 3
+    assert scan_stat.bytes_read == 5
+    rows = query(
+        scan,
+        f"""
+            SELECT {COLUMNS} FROM file
+            WHERE date_scanned = '2026-05-02 12:00:00'
+            ORDER BY 1
+        """,
+    )
+    assert rows[:2] == first_rows
+    assert rows[2][:4] == (
+        "c.txt",
+        1,
+        utils.get_sqlite_datetime(datetime.fromtimestamp(created_at)),
+        4,
+    )
+    # Only the new file was read.
+    rows = query(scan, "SELECT date_scanned, bytes_read FROM scan ORDER BY 1")
+    assert rows == [("2026-05-01 12:00:00", 9), ("2026-05-02 12:00:00", 5)]
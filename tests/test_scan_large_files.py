@@ -0,0 +1,102 @@
+import time
+from datetime import datetime
+
+import apsw
+import pytest
+
+from scan_engine import ScanPipeline
+
+FILES = {"big.txt": "x\n" * 1000, "small.txt": "a\nb\n"}
+
+
+def get_state(database_filepath):
+    """
+    Lines of "big.txt" in its record and in "file_latest" and the day's rollup
+    totals (files, lines) as committed so far.
+    """
+    conn = apsw.Connection(str(database_filepath))
+    try:
+        curs = conn.cursor()
+        return curs.execute("""
+            SELECT
+                (SELECT lines FROM file WHERE filename = 'big.txt'),
+                (SELECT lines FROM file_latest WHERE filename = 'big.txt'),
+                (SELECT SUM(count_files) FROM rollup_daily_total),
+                (SELECT SUM(total_lines) FROM rollup_daily_total)
+            """).fetchone()
+    finally:
+        conn.close()
+
+
+@pytest.mark.c9a5e1f3d7
+@pytest.mark.scanner
+@pytest.mark.large_files
+def test_large_files_are_written_first_and_completed_later(
+    tmp_path, write_files, make_scan, query, monkeypatch
+):
+    root = tmp_path / "root"
+    write_files(root, FILES)
+    # Every batch is committed right away, its rows can be seen by "get_state".
+    scan = make_scan([root], write_batch_size=1, large_files={"size_threshold": 1000})
+    database_filepath = scan.scan_config.database_filepath
+    states_before_read = []
+    analyze_large_files = ScanPipeline._analyze_large_files
+
+    def checked_analyze_large_files(self, batch):
+        # Waits for the first write of the file.
+        deadline = time.monotonic() + 10
+        while not query(scan, "SELECT 1 FROM file WHERE filename = 'big.txt'"):
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        states_before_read.append(get_state(database_filepath))
+        analyze_large_files(self, batch)
+
+    monkeypatch.setattr(
+        ScanPipeline, "_analyze_large_files", checked_analyze_large_files
+    )
+
+    scan_stat = scan.perform_scan(scan_start_time=datetime(2026, 5, 1, 12))
+
+    # Counted right away without its lines...
+    assert states_before_read == [(None, None, 2, 2)]
+    # ...which are filled in by the second write.
+    assert get_state(database_filepath) == (1000, 1000, 2, 1002)
+    assert scan_stat.files_scanned == 2
+    assert scan_stat.large_files_left == 0
+    assert query(scan, "SELECT COUNT(*) FROM file") == [(2,)]
+
+
+@pytest.mark.d2f8b4a0e6
+@pytest.mark.scanner
+@pytest.mark.large_files
+def test_large_files_past_the_time_budget_are_left_for_the_next_scan(
+    tmp_path, write_files, make_scan, query
+):
+    root = tmp_path / "root"
+    write_files(root, FILES)
+    large_files = {"size_threshold": 1000, "time_budget_seconds": 1e-9}
+    scan = make_scan([root], incremental_scan=True, large_files=large_files)
+
+    scan_stat = scan.perform_scan(scan_start_time=datetime(2026, 5, 1, 12))
+
+    assert scan_stat.files_scanned == 2
+    assert scan_stat.large_files_left == 1
+    assert query(scan, "SELECT large_files_left FROM scan") == [(1,)]
+    assert get_state(scan.scan_config.database_filepath) == (None, None, 2, 2)
+
+    # The next scan reads it, though the file didn't change.
+    scan = make_scan([root], incremental_scan=True)
+    scan_stat = scan.perform_scan(scan_start_time=datetime(2026, 5, 2, 12))
+
+    assert scan_stat.large_files_left == 0
+    assert scan_stat.bytes_read == 2000
+    rows = query(
+        scan,
+        "SELECT filename, lines FROM file_latest ORDER BY filename",
+    )
+    assert rows == [("big.txt", 1000), ("small.txt", 2)]
+    rows = query(
+        scan,
+        "SELECT SUM(count_files), SUM(total_lines) FROM rollup_daily_total",
+    )
+    assert rows == [(2, 1002)]
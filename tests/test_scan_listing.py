@@ -0,0 +1,58 @@
+import os
+import time
+from datetime import datetime
+
+import pytest
+
+import scan_engine
+
+
+@pytest.mark.c2a8e4b0f6
+@pytest.mark.scanner
+@pytest.mark.listing
+def test_unchanged_directories_are_not_listed_again(
+    tmp_path, write_files, make_scan, query, monkeypatch
+):
+    root = tmp_path / "root"
+    write_files(root, {"a.txt": "a\n", "sub/b.txt": "b\n"})
+    # Listings of directories modified just now are not cached.
+    an_hour_ago = time.time() - 3600
+    for dirpath in [root, root / "sub"]:
+        os.utime(dirpath, (an_hour_ago, an_hour_ago))
+
+    listed_dirs = []
+    scandir = os.scandir
+
+    def recording_scandir(path="."):
+        relpath = os.path.relpath(path, root)
+        if not relpath.startswith(".."):
+            listed_dirs.append(relpath)
+        return scandir(path)
+
+    monkeypatch.setattr(scan_engine.os, "scandir", recording_scandir)
+    scan = make_scan([root], listing_cache_enabled=True)
+
+    def scan_listed_dirs(day):
+        listed_dirs.clear()
+        scan_stat = scan.perform_scan(scan_start_time=datetime(2026, 5, day, 12))
+        return scan_stat.files_scanned, sorted(listed_dirs)
+
+    assert scan_listed_dirs(1) == (2, [".", "sub"])
+    assert scan_listed_dirs(2) == (2, [])
+
+    # A new file changes the directory's mtime.
+    write_files(root, {"sub/c.txt": "c\n"})
+    half_an_hour_ago = time.time() - 1800
+    os.utime(root / "sub", (half_an_hour_ago, half_an_hour_ago))
+    assert scan_listed_dirs(3) == (3, ["sub"])
+    assert scan_listed_dirs(4) == (3, [])
+
+    rows = query(
+        scan,
+        """
+            SELECT filename, COUNT(*) FROM file
+            GROUP BY filename
+            ORDER BY filename
+        """,
+    )
+    assert rows == [("a.txt", 4), ("b.txt", 4), ("c.txt", 2)]
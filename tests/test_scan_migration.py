@@ -0,0 +1,198 @@
+from datetime import datetime
+
+import apsw
+import pytest
+
+import utils
+
+# Tables as written by the scanner before the file records were interned.
+BASELINE_SCHEMA = """
+    CREATE TABLE file (
+        date__inode TEXT,
+        date_scanned DATETIME,
+        inode INTEGER,
+        filename TEXT,
+        filepath TEXT,
+        filetype TEXT,
+        lines INTEGER,
+        date_created DATETIME,
+        date_modified DATETIME,
+        error_occured INTEGER,
+        error_traceback TEXT,
+        PRIMARY KEY (date__inode)
+    );
+    CREATE TABLE scan (
+        date_scanned DATETIME,
+        scan_time REAL,
+        files_scanned INTEGER,
+        files_skipped INTEGER
+    );
+"""
+BASELINE_RECORDS = [
+    (
+        "2026-05-01__11",
+        "2026-05-01 12:00:00",
+        11,
+        "a.py",
+        "/data/a.py",
+        "py",
+        3,
+        "2026-04-01 10:00:00",
+        "2026-04-30 10:00:00",
+        0,
+        "",
+    ),
+    (
+        "2026-05-01__12",
+        "2026-05-01 12:00:00",
+        12,
+        "b.txt",
+        "/data/b.txt",
+        "txt",
+        0,
+        "2026-04-01 10:00:00",
+        "2026-04-01 10:00:00",
+        1,
+        "Traceback,PermissionError",
+    ),
+    (
+        "2026-05-02__11",
+        "2026-05-02 12:00:00",
+        11,
+        "a.py",
+        "/data/a.py",
+        "py",
+        4,
+        "2026-04-01 10:00:00",
+        "2026-05-01 18:00:00",
+        0,
+        "",
+    ),
+    (
+        "2026-05-02__12",
+        "2026-05-02 12:00:00",
+        12,
+        "b.txt",
+        "/data/b.txt",
+        "txt",
+        0,
+        "2026-04-01 10:00:00",
+        "2026-04-01 10:00:00",
+        1,
+        "Traceback,PermissionError",
+    ),
+]
+
+
+@pytest.fixture(scope="function")
+def baseline_db(tmp_path):
+    """
+    Database of the baseline scanner at the path "make_scan" uses.
+    """
+    database_filepath = tmp_path / "scanner" / "data" / "file_records.dat"
+    database_filepath.parent.mkdir(parents=True)
+    conn = apsw.Connection(str(database_filepath))
+    curs = conn.cursor()
+    curs.execute(BASELINE_SCHEMA)
+    curs.executemany(
+        "INSERT INTO file VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", BASELINE_RECORDS
+    )
+    curs.execute("INSERT INTO scan VALUES ('2026-05-02 12:00:00', 1.5, 2, 0)")
+    conn.close()
+    return database_filepath
+
+
+@pytest.mark.e5a90c7d31
+@pytest.mark.scanner
+@pytest.mark.migration
+def test_baseline_file_records_are_migrated(tmp_path, baseline_db, make_scan, query):
+    scan = make_scan([tmp_path])
+
+    rows = query(
+        scan,
+        """
+            SELECT
+                date__inode,
+                date_scanned,
+                inode,
+                filename,
+                filepath,
+                filetype,
+                lines,
+                date_created,
+                date_modified,
+                error_occured,
+                IFNULL(error_traceback, '')
+            FROM file
+            ORDER BY date__inode
+        """,
+    )
+    assert rows == BASELINE_RECORDS
+    rows = query(scan, "SELECT type FROM sqlite_master WHERE name = 'file'")
+    assert rows == [("view",)]
+    rows = query(
+        scan,
+        """
+            SELECT
+                (SELECT COUNT(*) FROM scan_date),
+                (SELECT COUNT(*) FROM path),
+                (SELECT COUNT(*) FROM filetype)
+        """,
+    )
+    assert rows == [(2, 2, 2)]
+
+    # The latest records and the rollups are built from the migrated history.
+    rows = query(scan, "SELECT inode, lines FROM file_latest ORDER BY inode")
+    assert rows == [(11, 4), (12, 0)]
+    rows = query(
+        scan, "SELECT SUM(count_files), SUM(total_lines) FROM rollup_daily_total"
+    )
+    assert rows == [(2, 4)]
+
+    # The migrated database is scanned into like a new one.
+    scan.perform_scan(scan_start_time=datetime(2026, 5, 3, 12))
+    assert query(scan, "SELECT COUNT(*) FROM scan") == [(2,)]
+
+
+@pytest.mark.f1b7e3a820
+@pytest.mark.scanner
+@pytest.mark.migration
+def test_errors_are_stored_once(
+    tmp_path, baseline_db, write_files, make_scan, query, monkeypatch
+):
+    root = tmp_path / "root"
+    write_files(root, {"c.txt": "c\n", "d.txt": "d\n"})
+    scan = make_scan([root])
+
+    def get_line_count(filepath, *args, **kwargs):
+        raise PermissionError(13, "Permission denied", filepath)
+
+    monkeypatch.setattr(utils, "get_line_count", get_line_count)
+    scan.perform_scan(scan_start_time=datetime(2026, 5, 3, 12))
+
+    # One error of the baseline records and one of the scan, the path
+    # of the file is left out of the traceback.
+    rows = query(
+        scan,
+        "SELECT error_traceback, date_first_seen, date_last_seen FROM file_error",
+    )
+    assert len(rows) == 2
+    assert (
+        "Traceback,PermissionError",
+        "2026-05-01 12:00:00",
+        "2026-05-02 12:00:00",
+    ) in rows
+    assert not any(str(root) in error_traceback for error_traceback, _, _ in rows)
+    rows = query(
+        scan,
+        """
+            SELECT filename, error_occured, error_class, error_traceback IS NOT NULL
+            FROM file
+            WHERE date_scanned = '2026-05-03 12:00:00'
+            ORDER BY filename
+        """,
+    )
+    assert rows == [
+        ("c.txt", 1, "PermissionError", 1),
+        ("d.txt", 1, "PermissionError", 1),
+    ]
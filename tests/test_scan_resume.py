@@ -0,0 +1,50 @@
+import os
+import time
+from datetime import datetime
+
+import pytest
+
+import utils
+
+
+@pytest.mark.c61e0b7f25
+@pytest.mark.scanner
+@pytest.mark.resume
+def test_resumed_scan_keeps_counts_of_checkpointed_dirs(
+    tmp_path, write_files, make_scan, query, monkeypatch
+):
+    root = tmp_path / "root"
+    write_files(root, {f"d{i}/f{j}.txt": "x\n" * j for i in range(3) for j in range(2)})
+    write_files(root, {f"d{i}/untracked.txt": "x\n" for i in range(3)}, tracked=False)
+    scan = make_scan([root])
+    scan_start_time = datetime(2026, 5, 1, 12)
+
+    # The scan is interrupted after all of its directories were checkpointed.
+    insert_data = utils.insert_data
+
+    def interrupted_insert_data(table, records):
+        if table.table_name == "scan":
+            raise RuntimeError("interrupted")
+        insert_data(table, records)
+
+    monkeypatch.setattr(utils, "insert_data", interrupted_insert_data)
+    with pytest.raises(RuntimeError):
+        scan.perform_scan(scan_start_time=scan_start_time)
+    assert scan.resume_scan_start_time() == scan_start_time
+
+    # Listings of the directories are old enough to be cached by the resumed run,
+    # the checkpointed directories are emitted again with their listings only.
+    old_time = time.time() - 3600
+    for dirpath in [root, *(path for path in root.iterdir() if path.is_dir())]:
+        os.utime(dirpath, (old_time, old_time))
+    with pytest.raises(RuntimeError):
+        scan.perform_scan(scan_start_time=scan_start_time)
+
+    monkeypatch.undo()
+    scan_stat = scan.perform_scan(scan_start_time=scan_start_time)
+
+    assert scan_stat.files_scanned == 6
+    assert scan_stat.files_skipped == 3
+    assert query(scan, "SELECT COUNT(*) FROM file") == [(6,)]
+    assert query(scan, "SELECT COUNT(*) FROM scan_checkpoint") == [(0,)]
+    assert scan.resume_scan_start_time() is None
@@ -0,0 +1,52 @@
+from datetime import datetime
+
+import pytest
+
+
+@pytest.mark.c4f90b2d78
+@pytest.mark.scanner
+@pytest.mark.retention
+@pytest.mark.parametrize("shard_by_root", [False, True])
+def test_compact_history_downsamples_old_scans(
+    tmp_path, write_files, make_scan, query, shard_by_root
+):
+    root = tmp_path / "root"
+    write_files(root, {"a.txt": "a\n", "b.txt": "b\n"})
+    scan = make_scan(
+        [root],
+        shard_by_root=shard_by_root,
+        retention={"daily_days": 7, "weekly_days": 30},
+    )
+    for day in [
+        "2026-03-03",  # Tuesday
+        "2026-03-05",  # the last scan of its week
+        "2026-03-10",
+        "2026-03-12",  # the last scan of its week and of the month
+        "2026-04-28",
+        "2026-04-29",
+    ]:
+        scan.perform_scan(scan_start_time=datetime.fromisoformat(f"{day} 12:00:00"))
+
+    scan.compact_history(now=datetime(2026, 4, 30, 12))
+
+    rows = query(
+        scan,
+        "SELECT date_scanned, COUNT(*) FROM file GROUP BY date_scanned ORDER BY 1",
+    )
+    assert rows == [
+        ("2026-03-12 12:00:00", 2),
+        ("2026-04-28 12:00:00", 2),
+        ("2026-04-29 12:00:00", 2),
+    ]
+    if not shard_by_root:
+        # Dates of the shards' scans are not a part of the union views.
+        assert query(scan, "SELECT date_scanned FROM scan_date ORDER BY 1") == [
+            (date_scanned,) for date_scanned, _ in rows
+        ]
+    # Only the history is compacted.
+    assert query(scan, "SELECT COUNT(*) FROM scan") == [(6,)]
+    assert query(scan, "SELECT COUNT(*) FROM file_latest") == [(2,)]
+
+    # Compacting again deletes nothing more.
+    scan.compact_history(now=datetime(2026, 4, 30, 12))
+    assert query(scan, "SELECT COUNT(*) FROM file") == [(6,)]
@@ -0,0 +1,126 @@
+from datetime import datetime
+
+import pytest
+
+# Rollups recounted from the latest record of every inode in the file history.
+RECOUNT_SQL = """
+    SELECT
+        DATE(f.date_modified),
+        f.filetype,
+        SUM(CASE
+            WHEN JULIANDAY(f.date_modified) - JULIANDAY(f.date_created) <= 1
+            THEN f.lines ELSE 0 END
+        ),
+        SUM(CASE
+            WHEN JULIANDAY(f.date_modified) - JULIANDAY(f.date_created) > 1
+            THEN f.lines ELSE 0 END
+        ),
+        SUM(f.lines),
+        SUM(CASE
+            WHEN JULIANDAY(f.date_modified) - JULIANDAY(f.date_created) <= 1
+            THEN 1 ELSE 0 END
+        ),
+        SUM(CASE
+            WHEN JULIANDAY(f.date_modified) - JULIANDAY(f.date_created) > 1
+            THEN 1 ELSE 0 END
+        ),
+        COUNT(*)
+    FROM file as f
+    JOIN (
+        SELECT inode, dev, MAX(date_scanned) as date_scanned
+        FROM file
+        GROUP BY inode, dev
+    ) as latest
+    ON
+        latest.inode = f.inode
+        AND latest.dev IS f.dev
+        AND latest.date_scanned = f.date_scanned
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+"""
+
+
+def scan_changing_files(root, write_files, scan):
+    day = 24 * 3600
+    start_time = datetime(2026, 5, 1, 12).timestamp()
+    write_files(root, {"a.py": "a\n", "b.txt": "b\nb\n"}, mtime=start_time - 5 * day)
+    write_files(root, {"c.py": "c\n" * 3}, mtime=start_time - day)
+    scan.perform_scan(scan_start_time=datetime(2026, 5, 1, 12))
+
+    write_files(root, {"a.py": "a\n" * 4, "d.txt": "d\n"}, mtime=start_time + day / 2)
+    scan.perform_scan(scan_start_time=datetime(2026, 5, 2, 12))
+
+    write_files(root, {"a.py": "a\n" * 5}, mtime=start_time + 3 * day / 2)
+    (root / "b.txt").unlink()
+    scan.perform_scan(scan_start_time=datetime(2026, 5, 3, 12))
+
+
+@pytest.mark.a2c85f1e64
+@pytest.mark.scanner
+@pytest.mark.rollups
+@pytest.mark.parametrize("incremental_scan", [False, True])
+def test_rollups_match_recount_of_the_history(
+    tmp_path, write_files, make_scan, query, incremental_scan
+):
+    root = tmp_path / "root"
+    scan = make_scan([root], incremental_scan=incremental_scan)
+
+    scan_changing_files(root, write_files, scan)
+
+    recount = query(scan, RECOUNT_SQL)
+    assert sum(row[-1] for row in recount) == 4
+    rows = query(
+        scan,
+        "SELECT * FROM rollup_daily_by_type WHERE count_files != 0 ORDER BY 1, 2",
+    )
+    assert rows == recount
+    totals = {}
+    for date, _, *metrics in recount:
+        total = totals.setdefault(date, [0] * len(metrics))
+        for i, value in enumerate(metrics):
+            total[i] += value
+    rows = query(
+        scan,
+        "SELECT * FROM rollup_daily_total WHERE count_files != 0 ORDER BY 1",
+    )
+    assert rows == [(date, *total) for date, total in sorted(totals.items())]
+
+
+@pytest.mark.b8d31a6f05
+@pytest.mark.scanner
+@pytest.mark.rollups
+@pytest.mark.parametrize("incremental_scan", [False, True])
+def test_file_latest_has_the_latest_record_of_every_inode(
+    tmp_path, write_files, make_scan, query, incremental_scan
+):
+    root = tmp_path / "root"
+    scan = make_scan([root], incremental_scan=incremental_scan)
+
+    scan_changing_files(root, write_files, scan)
+
+    rows = query(
+        scan,
+        """
+            SELECT date_scanned, filepath, lines, date_modified
+            FROM file_latest
+            ORDER BY filepath
+        """,
+    )
+    assert rows == query(
+        scan,
+        """
+            SELECT f.date_scanned, f.filepath, f.lines, f.date_modified
+            FROM file as f
+            WHERE f.date_scanned = (
+                SELECT MAX(date_scanned) FROM file
+                WHERE inode = f.inode AND dev IS f.dev
+            )
+            ORDER BY f.filepath
+        """,
+    )
+    assert [(filepath, lines) for _, filepath, lines, _ in rows] == [
+        (str(root / "a.py"), 5),
+        (str(root / "b.txt"), 2),
+        (str(root / "c.py"), 3),
+        (str(root / "d.txt"), 1),
+    ]
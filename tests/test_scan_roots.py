@@ -0,0 +1,172 @@
+import os
+from datetime import datetime
+
+import pytest
+
+import scan_engine
+import utils
+from models import Mount
+
+
+@pytest.mark.b3f19d0a42
+@pytest.mark.scanner
+@pytest.mark.roots
+def test_nested_roots_record_slow_files_once(tmp_path, write_files, make_scan, query):
+    root = tmp_path / "root"
+    write_files(
+        root,
+        {
+            "a.txt": "a\n",
+            "sub/b.txt": "b\nb\n",
+            "sub/deeper/c.py": "c\n" * 3,
+        },
+    )
+    scan = make_scan([root, root / "sub"], slowest_files_count=10)
+
+    scan_stat = scan.perform_scan(scan_start_time=datetime(2026, 5, 1, 12))
+
+    rows = query(scan, "SELECT filepath FROM scan_slow_file")
+    filepaths = sorted(filepath for (filepath,) in rows)
+    assert filepaths == sorted(
+        str(root / relpath) for relpath in ["a.txt", "sub/b.txt", "sub/deeper/c.py"]
+    )
+    assert query(scan, "SELECT COUNT(*) FROM scan") == [(1,)]
+    # The scan went on past the slow files.
+    assert query(scan, "SELECT COUNT(*) FROM dir_history") != [(0,)]
+    assert scan_stat.files_skipped == 0
+
+
+@pytest.mark.c7d04e5b19
+@pytest.mark.scanner
+@pytest.mark.roots
+@pytest.mark.parametrize("shard_by_root", [False, True])
+def test_nested_roots_count_distinct_records(
+    tmp_path, write_files, make_scan, query, shard_by_root
+):
+    root = tmp_path / "root"
+    write_files(root, {"a.txt": "a\n", "sub/b.txt": "b\n", "sub/deeper/c.txt": "c\n"})
+    scan = make_scan([root, root / "sub"], shard_by_root=shard_by_root)
+
+    scan_stat = scan.perform_scan(scan_start_time=datetime(2026, 5, 1, 12))
+
+    assert scan_stat.files_scanned == 3
+    assert query(scan, "SELECT COUNT(*), COUNT(DISTINCT filepath) FROM file") == [
+        (3, 3)
+    ]
+    assert query(scan, "SELECT SUM(count_files) FROM rollup_daily_total") == [(3,)]
+
+
+@pytest.mark.d9e15f6c2a
+@pytest.mark.scanner
+@pytest.mark.roots
+@pytest.mark.parametrize("shard_by_root", [False, True])
+def test_hard_links_across_roots_are_counted_once(
+    tmp_path, write_files, make_scan, query, shard_by_root
+):
+    first_root, second_root = tmp_path / "first", tmp_path / "second"
+    filepaths = write_files(first_root, {"a.txt": "a\n", "b.txt": "b\nb\n"})
+    second_root.mkdir()
+    for filepath in filepaths:
+        os.link(filepath, second_root / filepath.name)
+    scan = make_scan(
+        [first_root, second_root],
+        shard_by_root=shard_by_root,
+        incremental_scan=True,
+    )
+
+    for day in [1, 2]:
+        scan_stat = scan.perform_scan(scan_start_time=datetime(2026, 5, day, 12))
+
+        assert scan_stat.files_scanned == 4
+        assert scan_stat.bytes_read == (6 if day == 1 else 0)
+        assert query(scan, "SELECT COUNT(*) FROM file_latest") == [(2,)]
+        assert query(
+            scan, "SELECT SUM(count_files), SUM(total_lines) FROM rollup_daily_total"
+        ) == [(2, 3)]
+    assert query(scan, "SELECT COUNT(*) FROM file") == [(8,)]
+
+
+@pytest.mark.f6a2d8c4e1
+@pytest.mark.scanner
+@pytest.mark.roots
+def test_only_roots_sharing_a_bind_mount_overlap(tmp_path):
+    base = str(tmp_path.resolve())
+    mounts = [
+        Mount(device=1, root="/", mount_point="/"),
+        # "<base>/data/shared" is mounted again at "<base>/mnt/shared".
+        Mount(device=1, root=f"{base}/data/shared", mount_point=f"{base}/mnt/shared"),
+        # And "<base>/home/project" at "<base>/opt/project".
+        Mount(device=1, root=f"{base}/home/project", mount_point=f"{base}/opt/project"),
+        Mount(device=2, root="/", mount_point=f"{base}/srv"),
+    ]
+    root_paths = [
+        f"{base}/data",
+        f"{base}/mnt/shared/sub",
+        f"{base}/home",
+        f"{base}/home/project",
+        f"{base}/opt",
+        f"{base}/srv",
+        f"{base}/var",
+    ]
+    root_sources = {
+        root_path: utils.get_root_sources(root_path, mounts) for root_path in root_paths
+    }
+
+    assert root_sources[f"{base}/mnt/shared/sub"] == [(1, f"{base}/data/shared/sub")]
+    assert root_sources[f"{base}/opt"] == [
+        (1, f"{base}/opt"),
+        (1, f"{base}/home/project"),
+    ]
+    assert root_sources[f"{base}/srv"] == [(2, "/")]
+    # Roots on the same device overlap only if their trees do, nested roots
+    # are skipped by the outer root.
+    assert utils.get_overlapping_roots(root_sources) == {
+        f"{base}/data",
+        f"{base}/mnt/shared/sub",
+        f"{base}/home",
+        f"{base}/home/project",
+        f"{base}/opt",
+    }
+
+
+@pytest.mark.a7b3e9d5f2
+@pytest.mark.scanner
+@pytest.mark.roots
+def test_read_files_are_dropped_once_the_roots_are_done(
+    tmp_path, write_files, make_scan, monkeypatch
+):
+    first_root, second_root = tmp_path / "first", tmp_path / "second"
+    filepaths = write_files(first_root, {"a.txt": "a\n", "b.txt": "b\n"})
+    write_files(second_root, {"c.txt": "c\n"})
+    os.link(filepaths[0], second_root / "a.txt")
+    # A link outside of the roots is never seen.
+    os.link(filepaths[0], tmp_path / "a.txt")
+
+    claimed_inodes = []
+    released = []
+    claim = scan_engine.ReadFiles.claim
+    release_root = scan_engine.ReadFiles.release_root
+
+    def recording_claim(self, root, file_stat):
+        claimed_inodes.append(file_stat.st_ino)
+        return claim(self, root, file_stat)
+
+    def recording_release_root(self, root):
+        release_root(self, root)
+        released.append((root.root_path, self.files))
+
+    monkeypatch.setattr(scan_engine.ReadFiles, "claim", recording_claim)
+    monkeypatch.setattr(scan_engine.ReadFiles, "release_root", recording_release_root)
+    scan = make_scan([first_root, second_root])
+
+    scan_stat = scan.perform_scan(scan_start_time=datetime(2026, 5, 1, 12))
+
+    assert scan_stat.files_scanned == 4
+    assert scan_stat.bytes_read == 6
+    # Sibling roots on one device don't overlap, only the hard link is shared.
+    assert claimed_inodes == [filepaths[0].stat().st_ino] * 2
+    assert sorted(root_path for root_path, _ in released) == [
+        str(first_root),
+        str(second_root),
+    ]
+    assert released[-1][1] == {}
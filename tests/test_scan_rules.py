@@ -0,0 +1,93 @@
+import os
+from datetime import datetime
+
+import pytest
+
+import scan_engine
+from models import ScanRules
+from scan_engine import CompiledScanRules
+
+
+@pytest.mark.e4c0a6f2b8
+@pytest.mark.scanner
+@pytest.mark.rules
+def test_compiled_rules_match_names_and_paths():
+    rules = CompiledScanRules(
+        ScanRules(
+            include=["*.py", "docs/*.md"],
+            exclude=["build", "*.tmp", "src/generated"],
+            max_depth=2,
+        )
+    )
+
+    # Patterns without a "/" match the name at any depth...
+    assert not rules.is_dir_walked("build", "build", 1)
+    assert not rules.is_dir_walked("build", "src/build", 2)
+    # ...the other ones the path relative to the root.
+    assert not rules.is_dir_walked("generated", "src/generated", 2)
+    assert rules.is_dir_walked("generated", "lib/generated", 2)
+    assert rules.is_dir_walked("src", "src", 1)
+    assert not rules.is_dir_walked("deep", "src/lib/deep", 3)
+
+    assert rules.is_file_scanned("a.py", "a.py")
+    assert rules.is_file_scanned("a.py", "src/lib/a.py")
+    assert rules.is_file_scanned("notes.md", "docs/notes.md")
+    assert not rules.is_file_scanned("notes.md", "src/notes.md")
+    assert not rules.is_file_scanned("a.txt", "a.txt")
+    # Excludes win over includes.
+    assert not rules.is_file_scanned("a.py.tmp", "a.py.tmp")
+
+    rules = CompiledScanRules(ScanRules(filetypes=["PY", "Makefile"]))
+    assert rules.is_file_scanned("a.Py", "src/a.Py")
+    assert rules.is_file_scanned("Makefile", "Makefile")
+    assert not rules.is_file_scanned("a.txt", "a.txt")
+    assert rules.is_dir_walked("src", "src", 100)
+
+
+@pytest.mark.f9d3b7e1a5
+@pytest.mark.scanner
+@pytest.mark.rules
+def test_excluded_directories_are_never_listed(
+    tmp_path, write_files, make_scan, query, monkeypatch
+):
+    root = tmp_path / "root"
+    write_files(
+        root,
+        {
+            "a.py": "a\n",
+            "a.txt": "a\n",
+            "src/b.py": "b\n",
+            "src/build/c.py": "c\n",
+            "src/lib/d.py": "d\n",
+            "src/lib/deep/e.py": "e\n",
+            "node_modules/pkg/f.py": "f\n",
+            "docs/g.py": "g\n",
+        },
+    )
+    listed_dirs = []
+    scandir = os.scandir
+
+    def recording_scandir(path="."):
+        relpath = os.path.relpath(path, root)
+        if not relpath.startswith(".."):
+            listed_dirs.append(relpath)
+        return scandir(path)
+
+    monkeypatch.setattr(scan_engine.os, "scandir", recording_scandir)
+    scan = make_scan(
+        [root],
+        default_scan_rules={
+            "exclude": ["build", "node_modules", "docs"],
+            "max_depth": 2,
+            "filetypes": ["py"],
+        },
+    )
+
+    scan_stat = scan.perform_scan(scan_start_time=datetime(2026, 5, 1, 12))
+
+    assert sorted(listed_dirs) == [".", "src", "src/lib"]
+    rows = query(scan, "SELECT filepath FROM file ORDER BY 1")
+    assert rows == [
+        (str(root / relpath),) for relpath in ["a.py", "src/b.py", "src/lib/d.py"]
+    ]
+    assert scan_stat.files_scanned == 3
@@ -0,0 +1,93 @@
+import glob
+from datetime import datetime
+
+import pytest
+
+import utils
+
+QUERIES = [
+    """
+        SELECT filepath, date_scanned, lines, error_occured, error_traceback
+        FROM file
+        ORDER BY filepath, date_scanned
+    """,
+    "SELECT filepath, date_scanned, lines FROM file_latest ORDER BY filepath",
+    """
+        SELECT date, filetype, SUM(total_lines), SUM(count_files)
+        FROM rollup_daily_by_type
+        GROUP BY date, filetype
+        ORDER BY date, filetype
+    """,
+    """
+        SELECT error_fingerprint, error_traceback, date_first_seen, date_last_seen
+        FROM file_error
+        ORDER BY error_fingerprint
+    """,
+    "SELECT dirpath FROM dir_history ORDER BY dirpath",
+]
+
+
+@pytest.mark.d0a6e2c947
+@pytest.mark.scanner
+@pytest.mark.shards
+def test_union_views_of_shards_match_a_single_database(
+    tmp_path, write_files, make_scan, query, monkeypatch
+):
+    roots = [tmp_path / "first", tmp_path / "second"]
+    for root in roots:
+        write_files(root, {"a.py": "a\n", "sub/b.txt": "b\nb\n", "broken.txt": "x\n"})
+
+    # The same error in both roots is stored by both shards.
+    get_line_count = utils.get_line_count
+
+    def failing_get_line_count(filepath, *args, **kwargs):
+        if filepath.endswith("broken.txt"):
+            raise PermissionError(13, "Permission denied", filepath)
+        return get_line_count(filepath, *args, **kwargs)
+
+    monkeypatch.setattr(utils, "get_line_count", failing_get_line_count)
+
+    single_scan = make_scan(roots)
+    sharded_scan = make_scan(
+        roots,
+        shard_by_root=True,
+        database_filepath=str(tmp_path / "sharded" / "file_records.dat"),
+    )
+    for day in [1, 2]:
+        for scan in [single_scan, sharded_scan]:
+            scan.perform_scan(scan_start_time=datetime(2026, 5, day, 12))
+
+    assert len(glob.glob(str(tmp_path / "sharded" / "shards" / "*.db"))) == 2
+    for sql in QUERIES:
+        rows = query(single_scan, sql)
+        assert rows
+        assert query(sharded_scan, sql) == rows
+    assert len(query(sharded_scan, "SELECT * FROM file_error")) == 1
+
+
+@pytest.mark.b4e7a1c9d3
+@pytest.mark.scanner
+@pytest.mark.shards
+def test_shards_of_dropped_roots_get_new_columns(
+    tmp_path, write_files, make_scan, query
+):
+    first_root, second_root = tmp_path / "first", tmp_path / "second"
+    write_files(first_root, {"a.txt": "a\n"})
+    write_files(second_root, {"b.txt": "bb\n"})
+    scan = make_scan([first_root, second_root], shard_by_root=True)
+    scan.perform_scan(scan_start_time=datetime(2026, 5, 1, 12))
+
+    # The second root is dropped once an analyzer adds a column.
+    scan = make_scan([first_root], shard_by_root=True, analyzers=["longest_line"])
+    scan.dump_db()
+    scan.perform_scan(scan_start_time=datetime(2026, 5, 2, 12))
+    scan.dump_db()
+
+    rows = query(
+        scan, "SELECT filename, date_scanned, longest_line FROM file ORDER BY 1, 2"
+    )
+    assert rows == [
+        ("a.txt", "2026-05-01 12:00:00", None),
+        ("a.txt", "2026-05-02 12:00:00", 1),
+        ("b.txt", "2026-05-01 12:00:00", None),
+    ]
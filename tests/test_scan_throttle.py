@@ -0,0 +1,75 @@
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+from scan_engine import RateLimiter
+import utils
+
+
+@pytest.mark.e07b3d94a1
+@pytest.mark.scanner
+@pytest.mark.throttle
+def test_reads_are_throttled_per_chunk(tmp_path, write_files, make_scan, monkeypatch):
+    root = tmp_path / "root"
+    write_files(root, {"small.txt": "x\n" * 50, "large.txt": "y\n" * 200})
+    scan = make_scan(
+        [root],
+        line_counting={"chunk_size": 16, "binary_sniff_size": 8},
+        large_files={"size_threshold": 300},
+        device_limits={str(root): {"max_read_bytes_per_sec": 2**30}},
+    )
+    consumed = []
+    monkeypatch.setattr(
+        RateLimiter, "consume", lambda self, n_bytes: consumed.append(n_bytes)
+    )
+
+    scan.perform_scan(scan_start_time=datetime(2026, 5, 1, 12))
+
+    assert sum(consumed) == 100 + 400
+    assert max(consumed) <= 16
+
+
+@pytest.mark.f4c2a8e613
+@pytest.mark.scanner
+@pytest.mark.throttle
+def test_large_files_share_the_device_concurrency(
+    tmp_path, write_files, make_scan, monkeypatch
+):
+    root = tmp_path / "root"
+    write_files(
+        root,
+        {
+            **{f"d{i}/small.txt": "x\n" for i in range(4)},
+            **{f"d{i}/large.txt": "y\n" * 100 for i in range(4)},
+        },
+    )
+    scan = make_scan(
+        [root],
+        analyze_workers=4,
+        large_files={"size_threshold": 100, "workers": 4},
+        device_limits={str(root): {"max_concurrency": 1}},
+    )
+    lock = threading.Lock()
+    reads = [0]
+    max_reads = [0]
+    get_line_count = utils.get_line_count
+
+    def counted_get_line_count(*args, **kwargs):
+        with lock:
+            reads[0] += 1
+            max_reads[0] = max(max_reads[0], reads[0])
+        try:
+            time.sleep(0.01)
+            return get_line_count(*args, **kwargs)
+        finally:
+            with lock:
+                reads[0] -= 1
+
+    monkeypatch.setattr(utils, "get_line_count", counted_get_line_count)
+
+    scan_stat = scan.perform_scan(scan_start_time=datetime(2026, 5, 1, 12))
+
+    assert scan_stat.files_scanned == 8
+    assert max_reads[0] == 1
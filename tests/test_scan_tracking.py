@@ -0,0 +1,88 @@
+import os
+from datetime import datetime
+
+import pytest
+
+import utils
+
+
+@pytest.fixture(scope="function")
+def xattr_reads(monkeypatch):
+    """
+    Paths of the files whose "user.tracked" xattr was read.
+    """
+    paths = []
+    is_tracked = utils.is_tracked
+
+    def counted_is_tracked(filepath):
+        paths.append(os.path.basename(filepath))
+        return is_tracked(filepath)
+
+    monkeypatch.setattr(utils, "is_tracked", counted_is_tracked)
+    return paths
+
+
+@pytest.mark.a8e4c2f6d1
+@pytest.mark.scanner
+@pytest.mark.tracking
+def test_tracking_cache_is_invalidated_by_ctime(
+    tmp_path, write_files, make_scan, xattr_reads
+):
+    root = tmp_path / "root"
+    write_files(root, {"a.txt": "a\n", "b.txt": "b\n"})
+    write_files(root, {"c.txt": "c\n"}, tracked=False)
+    scan = make_scan([root])
+
+    scan_stat = scan.perform_scan(scan_start_time=datetime(2026, 5, 1, 12))
+    assert scan_stat.files_scanned == 2
+    assert sorted(xattr_reads) == ["a.txt", "b.txt", "c.txt"]
+
+    # Every file is a cache hit, tracked or not.
+    xattr_reads.clear()
+    scan_stat = scan.perform_scan(scan_start_time=datetime(2026, 5, 2, 12))
+    assert scan_stat.files_scanned == 2
+    assert xattr_reads == []
+
+    # Changing the xattr (or any other metadata) changes the file's ctime.
+    xattr_reads.clear()
+    os.setxattr(root / "b.txt", "user.tracked", b"false")
+    os.setxattr(root / "c.txt", "user.tracked", b"true")
+    os.chmod(root / "a.txt", 0o600)
+    scan_stat = scan.perform_scan(scan_start_time=datetime(2026, 5, 3, 12))
+    assert scan_stat.files_scanned == 2
+    assert sorted(xattr_reads) == ["a.txt", "b.txt", "c.txt"]
+
+
+@pytest.mark.b1f7d3a9e5
+@pytest.mark.scanner
+@pytest.mark.tracking
+@pytest.mark.parametrize("shard_by_root", [False, True])
+def test_tracking_cache_forgets_files_not_seen(
+    tmp_path, write_files, make_scan, query, shard_by_root
+):
+    roots = [tmp_path / "first", tmp_path / "second"]
+    for root in roots:
+        write_files(root, {"a.txt": "a\n", "build/b.txt": "b\n"})
+        write_files(root, {"c.txt": "c\n"}, tracked=False)
+    scan = make_scan(roots, shard_by_root=shard_by_root)
+    scan.perform_scan(scan_start_time=datetime(2026, 5, 1, 12))
+    assert query(scan, "SELECT COUNT(*) FROM tracking_cache") == [(6,)]
+
+    (roots[0] / "a.txt").unlink()
+    (roots[1] / "c.txt").unlink()
+    scan = make_scan(
+        roots, shard_by_root=shard_by_root, default_scan_rules={"exclude": ["build"]}
+    )
+    scan.perform_scan(scan_start_time=datetime(2026, 5, 2, 12))
+
+    rows = query(
+        scan,
+        "SELECT st_ino, tracked, date_last_seen FROM tracking_cache ORDER BY 1",
+    )
+    assert rows == sorted(
+        (filepath.stat().st_ino, tracked, "2026-05-02 12:00:00")
+        for filepath, tracked in [
+            (roots[0] / "c.txt", 0),
+            (roots[1] / "a.txt", 1),
+        ]
+    )
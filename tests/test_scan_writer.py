@@ -0,0 +1,33 @@
+from datetime import datetime
+
+import pytest
+
+import utils
+
+
+@pytest.mark.e3b8f0a6c2
+@pytest.mark.scanner
+@pytest.mark.writer
+def test_transaction_larger_than_page_cache_does_not_block_readers(
+    tmp_path, write_files, make_scan, monkeypatch
+):
+    # Rows of a single write transaction ("write_batch_size") outgrow the page
+    # cache, the transaction is spilled to the database while the pipeline's
+    # readers still look up the tracking cache and the latest records.
+    root = tmp_path / "root"
+    write_files(
+        root,
+        {
+            f"directory_with_a_name_as_long_as_in_a_real_project_{i // 100}/"
+            f"file_with_a_reasonably_long_name_{i % 100}.txt": "x\n"
+            for i in range(30_000)
+        },
+    )
+    # A blocked reader fails fast instead of waiting for a minute.
+    monkeypatch.setattr(utils, "SQLITE_BUSY_TIMEOUT_MS", 5_000)
+    scan = make_scan([root])
+    assert scan.scan_config.write_batch_size == 10_000
+
+    scan_stat = scan.perform_scan(scan_start_time=datetime(2026, 5, 1, 12))
+
+    assert scan_stat.files_scanned == 30_000
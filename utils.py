@@ -1,26 +1,72 @@
+import csv
+import hashlib
+import itertools
+import mmap
 import os
+import re
 import shutil
 import argparse
-import subprocess
 import threading
 import traceback
-import warnings
-from datetime import datetime
-from typing import Any, List, Optional, Tuple
+from datetime import datetime, timedelta
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Type,
+)
 
 import apsw
-import pandas as pd  # type: ignore
 
-from models import LineCountStat, TableDescription, FileStat, ScanConfig, Environment
+from analyzers import FileAnalyzer, get_analyzer_columns
+from metadata_manager.birth_time import read_birth_times
+from models import (
+    BinaryFilePolicy,
+    ExportFormat,
+    LineCountConfig,
+    LineCountStat,
+    Mount,
+    TableDescription,
+    FileStat,
+    PreviousFileStat,
+    ScanConfig,
+    Environment,
+)
+
+# How long should a connection wait for other connections (threads) to release
+# their database locks before failing.
+SQLITE_BUSY_TIMEOUT_MS = 60_000
 
 
 def get_sqlite_conn(filepath: str) -> Tuple[apsw.Connection, Any]:
     conn = apsw.Connection(filepath)
+    conn.setbusytimeout(SQLITE_BUSY_TIMEOUT_MS)
     curs = conn.cursor()
-    curs.execute("PRAGMA main.journal_mode=MEMORY")
+    # Databases switched to WAL (the scanner's databases) stay in WAL mode.
+    ((journal_mode,),) = curs.execute("PRAGMA main.journal_mode").fetchall()
+    if journal_mode != "wal":
+        curs.execute("PRAGMA main.journal_mode=MEMORY")
     return conn, curs
 
 
+def raise_attached_databases_limit(conn: Optional[apsw.Connection] = None) -> int:
+    """
+    Raises the number of databases that can be attached to the connection to
+    the maximum SQLite was compiled with and returns it. Without a connection
+    only returns the maximum.
+    """
+    conn = conn or apsw.Connection(":memory:")
+    # Values above the compile time maximum are truncated to it.
+    conn.limit(apsw.SQLITE_LIMIT_ATTACHED, 2**31 - 1)
+    return conn.limit(apsw.SQLITE_LIMIT_ATTACHED)
+
+
 class SqliteCursorWithLock:
     def __init__(self, filepath: str, lock: threading.Lock) -> None:
         self.filepath: str = filepath
@@ -43,11 +89,17 @@ class SqliteCursorWithLock:
             self.conn = None
 
 
+def get_files_created_timestamps(filepaths: List[str]) -> List[Optional[int]]:
+    """
+    Returns birth time (unix timestamp) of each of the files or None if it
+    couldn't be read, see "read_birth_times".
+    """
+    return read_birth_times(filepaths)
+
+
 def get_file_created_timestamp(filepath: str) -> int:
     # Running "os.stat(filepath).st_ctime" doesn't return date of file creation,
-    # instead it returns last date of file's metadata modification. There
-    # doesn't seem to be more straightforward way to pull the file's creation
-    # date on linux then this.
+    # instead it returns last date of file's metadata modification.
 
     # from docs (https://docs.python.org/3/library/stat.html):
     # stat.ST_CTIME
@@ -55,12 +107,12 @@ def get_file_created_timestamp(filepath: str) -> int:
     #     is the time of the last metadata change, and, on others (like Windows),
     #     is the creation time (see platform documentation for details).
 
-    proc = subprocess.run(["stat", "-c", "%W", filepath], capture_output=True)
+    timestamp = get_files_created_timestamps([filepath])[0]
 
-    if proc.stderr:
+    if timestamp is None:
         raise Exception(f"failed to get 'date_created' for file: {filepath}")
 
-    return int(proc.stdout.strip())
+    return timestamp
 
 
 def get_sqlite_datetime(datetime: datetime) -> str:
@@ -71,47 +123,579 @@ def datetime_from_sqlite_datetime(sqlite_datetime: str) -> datetime:
     return datetime.strptime(sqlite_datetime, "%Y-%m-%d %H:%M:%S")
 
 
-def pandas_read_sql_without_warnings(sql: str, conn: apsw.Connection) -> pd.DataFrame:
-    # Pandas doesn't directly support apsw.Connection object but works fine
-    # with it for our purposes. Therefore we are silencing the warning here.
+def execute_with_header(
+    curs: Any, sql: str, bindings: Tuple = ()
+) -> Tuple[List[str], Any]:
+    """
+    Executes the query and returns its column names along with the rows.
+    The column names are returned even if the query returns no rows.
+    """
+    header: List[str] = []
+
+    # The description isn't available once a query without rows completes,
+    # the execution tracer sees the prepared statement before it runs.
+    def capture_header(cursor: Any, sql: str, bindings: Any) -> bool:
+        header.extend(name for name, _ in cursor.getdescription())
+        return True
+
+    curs.exec_trace = capture_header
+    try:
+        rows = curs.execute(sql, bindings)
+    finally:
+        curs.exec_trace = None
+
+    return header, rows
+
+
+def write_query_to_csv(curs: Any, sql: str, filepath: str, bindings: Tuple = ()) -> int:
+    """
+    Streams rows of the query straight into a CSV file and returns the number
+    of rows written. The file is written next to its destination and moved
+    in place once it's complete, so a partially written file is never left behind.
+    """
+    header, rows = execute_with_header(curs, sql, bindings)
+
+    n_rows = 0
+    tmp_filepath = f"{filepath}.tmp"
+    with open(tmp_filepath, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow(row)
+            n_rows += 1
+
+    os.replace(tmp_filepath, filepath)
+    return n_rows
 
-    # silenced warning:
-    #   UserWarning: pandas only supports SQLAlchemy connectable (engine/connection)
-    #   or database string URI or sqlite3 DBAPI2 connection. Other DBAPI2 objects are not tested.
-    #   Please consider using SQLAlchemy.
-    #       df = pd.read_sql(sql, conn)
 
-    with warnings.catch_warnings():
-        warnings.simplefilter("ignore", category=UserWarning)
-        return pd.read_sql(sql, conn)
+PARQUET_BATCH_ROWS = 100_000
 
 
-def get_line_count(filename: str) -> LineCountStat:
+def write_query_to_parquet(
+    curs: Any,
+    sql: str,
+    filepath: str,
+    column_types: Dict[str, str],
+    bindings: Tuple = (),
+) -> int:
+    """
+    Same as "write_query_to_csv" but writes a zstd compressed Parquet file,
+    one row group per "PARQUET_BATCH_ROWS" rows.
+
+    column_types:   SQLite type of each column (INTEGER, REAL, TEXT, DATETIME
+                    or DATE), columns that are not listed are written as TEXT
+    """
+    # Optional dependency, only needed for this export format.
+    import pyarrow as pa  # type: ignore
+    import pyarrow.parquet as pq  # type: ignore
+
+    arrow_types = {
+        "INTEGER": pa.int64(),
+        "REAL": pa.float64(),
+        "TEXT": pa.string(),
+        "DATETIME": pa.timestamp("s"),
+        "DATE": pa.date32(),
+    }
+
+    header, rows = execute_with_header(curs, sql, bindings)
+    schema = pa.schema(
+        [(name, arrow_types[column_types.get(name, "TEXT")]) for name in header]
+    )
+
+    def to_array(values: Tuple, arrow_type: Any) -> Any:
+        if pa.types.is_temporal(arrow_type):
+            # SQLite stores dates as text.
+            return pa.array(values, type=pa.string()).cast(arrow_type)
+        return pa.array(values, type=arrow_type)
+
+    n_rows = 0
+    tmp_filepath = f"{filepath}.tmp"
+    with pq.ParquetWriter(tmp_filepath, schema, compression="zstd") as writer:
+        while True:
+            batch = list(itertools.islice(rows, PARQUET_BATCH_ROWS))
+            if not batch:
+                break
+
+            columns = list(zip(*batch))
+            writer.write_batch(
+                pa.record_batch(
+                    [
+                        to_array(values, field.type)
+                        for values, field in zip(columns, schema)
+                    ],
+                    schema=schema,
+                )
+            )
+            n_rows += len(batch)
+
+    os.replace(tmp_filepath, filepath)
+    return n_rows
+
+
+def write_query(
+    curs: Any,
+    sql: str,
+    filepath: str,
+    export_format: ExportFormat,
+    column_types: Dict[str, str],
+    bindings: Tuple = (),
+) -> int:
+    """
+    Writes rows of the query to "filepath" + extension of the export format,
+    returns the number of rows written.
+    """
+    filepath = f"{filepath}{export_format.extension}"
+    if export_format == ExportFormat.PARQUET:
+        return write_query_to_parquet(
+            curs, sql, filepath, column_types=column_types, bindings=bindings
+        )
+    return write_query_to_csv(curs, sql, filepath, bindings=bindings)
+
+
+def count_line_breaks(chunk: bytes, after_cr: bool = False) -> int:
+    """
+    Line breaks of universal newlines mode (LF, CR and CRLF) in the chunk.
+    "after_cr" tells that the previous chunk ended with a CR, a CRLF split by
+    the chunks was counted there already.
+    """
+    count = chunk.count(b"\n")
+    cr_count = chunk.count(b"\r")
+    if cr_count:
+        count += cr_count - chunk.count(b"\r\n")
+    if after_cr and chunk[:1] == b"\n":
+        count -= 1
+    return count
+
+
+def count_newlines(
+    f: BinaryIO,
+    size: int,
+    config: LineCountConfig,
+    file_analyzers: Sequence[FileAnalyzer] = (),
+    throttle: Optional[Callable[[int], None]] = None,
+    last_byte: bytes = b"",
+) -> Tuple[int, bytes]:
+    """
+    Counts line breaks of the rest of the file, same as iterating a file opened
+    in text mode. "last_byte" is the byte read before the rest, the returned
+    one is the last byte of the file. The analyzers are fed the same chunks,
+    "throttle" gets the size of each of them.
+    """
+    line_count = 0
+
+    if size >= config.mmap_threshold:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mmap, "MADV_SEQUENTIAL"):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            # Slicing copies only a window of the mapping at a time, there is
+            # no read syscall per chunk.
+            for start in range(f.tell(), len(mm), config.chunk_size):
+                chunk = mm[start : start + config.chunk_size]
+                line_count += count_line_breaks(chunk, after_cr=last_byte == b"\r")
+                last_byte = chunk[-1:]
+                for file_analyzer in file_analyzers:
+                    file_analyzer.update(chunk)
+                if throttle is not None:
+                    throttle(len(chunk))
+    else:
+        while True:
+            chunk = f.read(config.chunk_size)
+            if not chunk:
+                break
+            line_count += count_line_breaks(chunk, after_cr=last_byte == b"\r")
+            last_byte = chunk[-1:]
+            for file_analyzer in file_analyzers:
+                file_analyzer.update(chunk)
+            if throttle is not None:
+                throttle(len(chunk))
+
+    return line_count, last_byte
+
+
+def get_line_count(
+    filename: str,
+    config: Optional[LineCountConfig] = None,
+    analyzers: Sequence[Type[FileAnalyzer]] = (),
+    throttle: Optional[Callable[[int], None]] = None,
+) -> LineCountStat:
+    """
+    Counts lines on the byte level without decoding the file. Binary files (NUL
+    byte within the first "binary_sniff_size" bytes) are handled according to
+    "binary_file_policy". Files read whole are passed through the analyzers
+    in the same pass.
+
+    throttle:   called with the size of every chunk read, it may sleep to slow
+                the reads down
+    """
+    config = config or LineCountConfig()
     error_occured = False
     error_traceback = ""
+    error_class = ""
     line_count = 0
+    is_binary = False
+    bytes_read = 0
+    analysis: Tuple[Any, ...] = (None,) * len(get_analyzer_columns(analyzers))
 
     try:
-        with open(filename) as f:
-            for _ in f:
-                line_count += 1
-    except Exception:
+        with open(filename, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            head = f.read(config.binary_sniff_size)
+            is_binary = b"\x00" in head
+            bytes_read = len(head)
+            if throttle is not None:
+                throttle(len(head))
+
+            if is_binary and config.binary_file_policy == BinaryFilePolicy.SKIP:
+                pass
+            elif is_binary and config.binary_file_policy == BinaryFilePolicy.SAMPLE:
+                sample = head + f.read(max(config.binary_sample_size - len(head), 0))
+                if throttle is not None:
+                    throttle(len(sample) - len(head))
+                line_count = round(count_line_breaks(sample) * size / len(sample))
+                bytes_read = len(sample)
+            else:
+                file_analyzers = [
+                    analyzer(get_file_type(os.path.basename(filename)))
+                    for analyzer in analyzers
+                ]
+                for file_analyzer in file_analyzers:
+                    file_analyzer.update(head)
+                rest_count, last_byte = count_newlines(
+                    f, size, config, file_analyzers, throttle, last_byte=head[-1:]
+                )
+                bytes_read = size
+                line_count = count_line_breaks(head) + rest_count
+                # Last line without a line break.
+                if last_byte and last_byte not in b"\r\n":
+                    line_count += 1
+                analysis = tuple(
+                    value
+                    for file_analyzer in file_analyzers
+                    for value in file_analyzer.result()
+                )
+    except Exception as err:
         error_occured = True
         error_traceback = str(traceback.format_exc()).replace("\n", ",")
+        error_class = type(err).__name__
 
     return LineCountStat(
-        count=line_count, error_occured=error_occured, error_traceback=error_traceback
+        count=line_count,
+        is_binary=is_binary,
+        error_occured=error_occured,
+        error_traceback=error_traceback,
+        bytes_read=bytes_read,
+        error_class=error_class,
+        analysis=analysis,
     )
 
 
 def is_tracked(filepath: str) -> bool:
-    result = subprocess.run(
-        ["getfattr", "--only-values", "-n", "user.tracked", filepath],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-    )
-    return result.stdout.strip() == "true"
+    try:
+        return os.getxattr(filepath, "user.tracked").strip() == b"true"
+    except OSError:
+        # Attribute is not set, or the file or its xattrs can't be read.
+        return False
+
+
+# Characters escaped in "/proc/self/mountinfo" paths (space, tab, newline, backslash).
+MOUNTINFO_ESCAPE = re.compile(r"\\([0-7]{3})")
+
+
+def get_mounts() -> List[Mount]:
+    """
+    Mounts of the process' mount namespace, empty if "/proc/self/mountinfo"
+    can't be read.
+    """
+    mounts = []
+    try:
+        with open("/proc/self/mountinfo") as f:
+            for line in f:
+                # "<mount id> <parent id> <major>:<minor> <root> <mount point> ..."
+                fields = line.split()
+                major, minor = fields[2].split(":")
+                root, mount_point = (
+                    MOUNTINFO_ESCAPE.sub(lambda m: chr(int(m[1], 8)), field)
+                    for field in fields[3:5]
+                )
+                mounts.append(
+                    Mount(
+                        device=os.makedev(int(major), int(minor)),
+                        root=root,
+                        mount_point=mount_point,
+                    )
+                )
+    except OSError:
+        return []
+    return mounts
+
+
+def is_within(path: str, dirpath: str) -> bool:
+    return path == dirpath or path.startswith(os.path.join(dirpath, ""))
+
+
+def get_root_sources(root_path: str, mounts: List[Mount]) -> List[Tuple[int, str]]:
+    """
+    Directories the root's tree is made of as (device, path within the device's
+    file system): the root's own directory and the root of every mount under
+    it. Without "mounts" the root's device is taken whole.
+    """
+    realpath = os.path.realpath(root_path)
+    if not mounts:
+        try:
+            return [(os.stat(realpath).st_dev, "/")]
+        except OSError:
+            return []
+
+    own_mount: Optional[Mount] = None
+    sources = []
+    for mount in mounts:
+        if is_within(realpath, mount.mount_point):
+            # The last of the mounts stacked on the same directory is visible.
+            if own_mount is None or len(mount.mount_point) >= len(
+                own_mount.mount_point
+            ):
+                own_mount = mount
+        elif is_within(mount.mount_point, realpath):
+            sources.append((mount.device, mount.root))
+    if own_mount is not None:
+        relpath = os.path.relpath(realpath, own_mount.mount_point)
+        sources.insert(
+            0,
+            (own_mount.device, os.path.normpath(os.path.join(own_mount.root, relpath))),
+        )
+    return sources
+
+
+def get_overlapping_roots(root_sources: Dict[str, List[Tuple[int, str]]]) -> Set[str]:
+    """
+    Roots sharing files with another root through bind mounts, i.e. roots whose
+    sources (see "get_root_sources") are nested in each other's. Nested roots
+    don't overlap, the outer root skips the nested one.
+    """
+    overlapping = set()
+    for root_path, other_path in itertools.combinations(root_sources, 2):
+        root_normpath = os.path.normpath(root_path)
+        other_normpath = os.path.normpath(other_path)
+        if is_within(root_normpath, other_normpath) or is_within(
+            other_normpath, root_normpath
+        ):
+            continue
+
+        if any(
+            device == other_device
+            and (is_within(path, other_source) or is_within(other_source, path))
+            for device, path in root_sources[root_path]
+            for other_device, other_source in root_sources[other_path]
+        ):
+            overlapping.update((root_path, other_path))
+    return overlapping
+
+
+class ThreadLocalReader:
+    """
+    Gives each thread its own read connection to the table's database, so the
+    pipeline's workers read concurrently with the writer.
+    """
+
+    def __init__(self, table: TableDescription) -> None:
+        self.table = table
+        self.local = threading.local()
+        self.connections: List[apsw.Connection] = []
+        self.lock = threading.Lock()
+
+    def get_cursor(self) -> Any:
+        curs = getattr(self.local, "curs", None)
+        if curs is None:
+            conn, curs = get_sqlite_conn(filepath=self.table.file_path)
+            self.local.curs = curs
+            with self.lock:
+                self.connections.append(conn)
+        return curs
+
+    def close(self) -> None:
+        with self.lock:
+            connections, self.connections = self.connections, []
+
+        for conn in connections:
+            conn.close()
+
+
+class TrackingFilter(ThreadLocalReader):
+    """
+    Decides which files are tracked ("user.tracked" xattr is set to "true").
+
+    Results are cached in the database keyed on (st_dev, st_ino, st_ctime_ns).
+    Setting or removing an xattr changes the file's ctime, therefore files
+    whose metadata didn't change since the previous scan don't need their
+    xattr read again. Each thread reads the cache through its own connection,
+    cache entries of all of the files seen are returned to the caller to be
+    written, so that entries of files no longer seen can be pruned (see
+    "Scan.prune_tracking_cache").
+    """
+
+    def __init__(self, table: TableDescription, use_cache: bool = True) -> None:
+        super().__init__(table)
+        self.use_cache = use_cache
+
+    def filter(
+        self, entries: List[os.DirEntry]
+    ) -> Tuple[List[os.DirEntry], List[Tuple[int, int, int, int]]]:
+        """
+        Returns entries of tracked files and cache entries
+        (st_dev, st_ino, st_ctime_ns, tracked) to be stored.
+        """
+        if not self.use_cache:
+            return [entry for entry in entries if is_tracked(entry.path)], []
+
+        tracked_entries: List[os.DirEntry] = []
+        cache_entries: List[Tuple[int, int, int, int]] = []
+        curs = self.get_cursor()
+
+        for entry in entries:
+            try:
+                # Follows symlinks same as reading the xattr does.
+                file_stat = entry.stat()
+            except OSError:
+                if is_tracked(entry.path):
+                    tracked_entries.append(entry)
+                continue
+
+            # Fetch all of the rows (at most one) so that the statement doesn't
+            # keep holding the read lock.
+            cached = curs.execute(
+                f"""
+                    SELECT st_ctime_ns, tracked FROM {self.table.table_name}
+                    WHERE st_dev = ? AND st_ino = ?
+                """,
+                (file_stat.st_dev, file_stat.st_ino),
+            ).fetchall()
+
+            if cached and cached[0][0] == file_stat.st_ctime_ns:
+                tracked = bool(cached[0][1])
+            else:
+                tracked = is_tracked(entry.path)
+            cache_entries.append(
+                (
+                    file_stat.st_dev,
+                    file_stat.st_ino,
+                    file_stat.st_ctime_ns,
+                    int(tracked),
+                )
+            )
+
+            if tracked:
+                tracked_entries.append(entry)
+
+        return tracked_entries, cache_entries
+
+
+class LatestFileStats(ThreadLocalReader):
+    """
+    Looks up stats of the latest record of an inode in "file_latest" (a primary
+    key lookup), used by the incremental scan. Records of failed scans and of
+    large files not read yet are left out so that those files are always scanned
+    again. Records written before
+    the device was recorded match the inode on any device.
+    """
+
+    def __init__(
+        self, table: TableDescription, analysis_columns: Sequence[str] = ()
+    ) -> None:
+        """
+        analysis_columns:   columns of the analyzers carried forward as well
+        """
+        super().__init__(table)
+        self.analysis_columns = analysis_columns
+
+    def get(self, dev: int, inode: int) -> Optional[PreviousFileStat]:
+        # Fetch all of the rows (at most two) so that the statement doesn't
+        # keep holding the read lock.
+        rows = (
+            self.get_cursor()
+            .execute(
+                f"""
+                    SELECT
+                        size,
+                        mtime_ns,
+                        lines,
+                        date_created
+                        {"".join(f", {column}" for column in self.analysis_columns)}
+                    FROM {self.table.table_name}
+                    WHERE
+                        inode = ?
+                        AND (dev = ? OR dev IS NULL)
+                        AND error_occured = 0
+                        AND lines IS NOT NULL
+                        AND size IS NOT NULL
+                        AND mtime_ns IS NOT NULL
+                    ORDER BY
+                        dev IS NULL
+                """,
+                (inode, dev),
+            )
+            .fetchall()
+        )
+        return PreviousFileStat(*rows[0][:4], analysis=rows[0][4:]) if rows else None
+
+    def has_record(self, dev: int, inode: int) -> bool:
+        """
+        Whether the inode has a latest record, failed or not.
+        """
+        return bool(
+            self.get_cursor()
+            .execute(
+                f"""
+                    SELECT 1 FROM {self.table.table_name}
+                    WHERE inode = ? AND (dev = ? OR dev IS NULL)
+                    LIMIT 1
+                """,
+                (inode, dev),
+            )
+            .fetchall()
+        )
+
+
+class DirListingCache(ThreadLocalReader):
+    """
+    Listings of the directories from the previous scans keyed by the directory's
+    path. A listing is valid as long as the directory's inode and mtime didn't
+    change, adding, removing or renaming an entry changes the mtime.
+    """
+
+    def get(self, dirpath: str) -> Optional[Tuple[int, int, bytes]]:
+        """
+        Returns (directory's inode, directory's mtime_ns, encoded listing),
+        see "encode_dir_listing".
+        """
+        rows = (
+            self.get_cursor()
+            .execute(
+                f"""
+                    SELECT dir_inode, dir_mtime_ns, entries
+                    FROM {self.table.table_name}
+                    WHERE dirpath = ?
+                """,
+                (dirpath,),
+            )
+            .fetchall()
+        )
+        return rows[0] if rows else None
+
+
+def encode_dir_listing(entries: List[Tuple[str, str]]) -> bytes:
+    """
+    entries:    (kind, name) of each entry, "f" for anything but a directory
+                and "d" for a directory
+    """
+    return b"\0".join(kind.encode() + os.fsencode(name) for kind, name in entries)
+
+
+def decode_dir_listing(listing: bytes) -> List[Tuple[str, str]]:
+    if not listing:
+        return []
+    return [
+        (entry[:1].decode(), os.fsdecode(entry[1:])) for entry in listing.split(b"\0")
+    ]
 
 
 def get_file_type(filename: str) -> str:
@@ -125,9 +709,54 @@ def get_file_type(filename: str) -> str:
         return parts[0].lower()
 
 
+def add_missing_columns(curs: Any, table: TableDescription) -> None:
+    """
+    Brings tables created by older versions of the scanner up to date. New
+    columns are always appended to the end of "TableDescription.columns".
+    """
+    existing_columns = {
+        row[1] for row in curs.execute(f"PRAGMA table_info({table.table_name})")
+    }
+
+    for column_name, column_type in table.columns:
+        if column_name not in existing_columns:
+            curs.execute(
+                f"ALTER TABLE {table.table_name} ADD COLUMN {column_name} {column_type}"
+            )
+
+
+def update_primary_key(curs: Any, table: TableDescription) -> None:
+    """
+    Rebuilds a table created by an older version of the scanner with a different
+    primary key, the rows are copied over as they are.
+    """
+    primary_key = [
+        row[1]
+        for row in sorted(
+            curs.execute(f"PRAGMA table_info({table.table_name})"), key=lambda r: r[5]
+        )
+        if row[5]
+    ]
+    if primary_key == table.primary_key:
+        return
+
+    old_table_name = f"{table.table_name}__old"
+    curs.execute("begin")
+    curs.execute(f"ALTER TABLE {table.table_name} RENAME TO {old_table_name}")
+    curs.execute(table.create_table_sql)
+    curs.execute(f"""
+        INSERT INTO {table.table_name} ({table.column_names_string})
+        SELECT {table.column_names_string} FROM {old_table_name}
+        """)
+    # Indexes of the old table go with it, they are created again by the caller.
+    curs.execute(f"DROP TABLE {old_table_name}")
+    curs.execute("commit")
+
+
 def insert_data(table: TableDescription, records: List[Any]) -> None:
     sql = f"""
-        INSERT INTO {table.table_name} VALUES ({table.columns_placeholder_string})
+        INSERT INTO {table.table_name} ({table.column_names_string})
+        VALUES ({table.columns_placeholder_string})
     """
 
     with SqliteCursorWithLock(filepath=table.file_path, lock=table.lock) as curs:
@@ -136,40 +765,192 @@ def insert_data(table: TableDescription, records: List[Any]) -> None:
         curs.execute("commit")
 
 
-def collect_file_stats(filepath: str, scan_start_time: datetime) -> FileStat:
+# Metrics of the daily rollup tables, in the order of their columns.
+ROLLUP_METRICS = [
+    "new_lines",
+    "lines_modified",
+    "total_lines",
+    "count_new_files",
+    "count_files_modified",
+    "count_files",
+]
+
+
+def get_rollup_contribution(
+    date_modified: str, date_created: str, lines: Optional[int]
+) -> Tuple[int, ...]:
+    """
+    Returns what a single file record adds to each of the "ROLLUP_METRICS".
+    File modified within a day from its creation counts as a new file. Records
+    without lines (large files not read yet) count as files without lines, same
+    as in SQL's "SUM".
+    """
+    lines = lines or 0
+    is_new = datetime_from_sqlite_datetime(
+        date_modified
+    ) - datetime_from_sqlite_datetime(date_created) <= timedelta(days=1)
+
+    return (
+        lines if is_new else 0,
+        0 if is_new else lines,
+        lines,
+        int(is_new),
+        int(not is_new),
+        1,
+    )
+
+
+def is_file_unchanged(
+    file_stat: Optional[os.stat_result], previous: Optional[PreviousFileStat]
+) -> bool:
+    return (
+        file_stat is not None
+        and previous is not None
+        and file_stat.st_size == previous.size
+        and file_stat.st_mtime_ns == previous.mtime_ns
+    )
+
+
+def is_analysis_missing(
+    filename: str,
+    previous: Optional[PreviousFileStat],
+    analyzers: Sequence[Type[FileAnalyzer]],
+) -> bool:
+    """
+    Whether a column of the analyzers applicable to the file's type is NULL
+    in its previous record ("previous.analysis" has the columns of "analyzers"),
+    e.g. the analyzer was enabled after the file was read. Binary files not
+    read whole keep the columns NULL, their head is read by every scan.
+    """
+    if previous is None:
+        return False
+
+    filetype = get_file_type(filename)
+    values = iter(previous.analysis)
+    for analyzer in analyzers:
+        analysis = [next(values) for _ in analyzer.columns]
+        if None in analysis and analyzer.is_applicable(filetype):
+            return True
+    return False
+
+
+def get_error_fingerprint(error_traceback: str) -> str:
+    return hashlib.blake2b(error_traceback.encode(), digest_size=8).hexdigest()
+
+
+def collect_file_stats(
+    filepath: str,
+    scan_start_time: datetime,
+    file_stat: Optional[os.stat_result] = None,
+    date_created: Optional[int] = None,
+    previous: Optional[PreviousFileStat] = None,
+    line_count_config: Optional[LineCountConfig] = None,
+    analyzers: Sequence[Type[FileAnalyzer]] = (),
+    throttle: Optional[Callable[[int], None]] = None,
+    defer_read: bool = False,
+) -> FileStat:
+    """
+    file_stat:      result of "os.stat" if the file was already stat-ed
+    date_created:   birth time of the file if it was already looked up
+                    (see "get_files_created_timestamps")
+    previous:       stats from the file's previous scan, they are carried forward
+                    without reading the file if its size and mtime didn't change
+    line_count_config:  see "get_line_count"
+    analyzers:          see "get_line_count"
+    throttle:           see "get_line_count"
+    defer_read:     the file is not read if it changed, its "lines" (and analyzers'
+                    columns) are left empty until it's collected again with the
+                    read (see "LargeFileConfig")
+    """
     error_occured = False
     error_tracebacks = []
+    error_class: Optional[str] = None
     filename = os.path.basename(filepath)
     inode = 0
-    date_created = 0
+    dev: Optional[int] = None
+    size = 0
+    mtime_ns = 0
     date_modified = 0.0
+    date_created_sqlite: Optional[str] = None
     line_count_stat = LineCountStat()
+    is_read_deferred = False
 
     try:
-        file_stat = os.stat(filepath)
+        if file_stat is None:
+            file_stat = os.stat(filepath)
         inode = file_stat.st_ino
-        date_created = get_file_created_timestamp(filepath)
+        dev = file_stat.st_dev
+        size = file_stat.st_size
+        mtime_ns = file_stat.st_mtime_ns
         date_modified = file_stat.st_mtime
-        line_count_stat = get_line_count(filepath)
-    except Exception:
+
+        if previous is not None and is_file_unchanged(file_stat, previous):
+            line_count_stat = LineCountStat(
+                count=previous.lines, analysis=previous.analysis
+            )
+            date_created_sqlite = previous.date_created
+        else:
+            if date_created is None:
+                date_created = get_file_created_timestamp(filepath)
+            if defer_read:
+                is_read_deferred = True
+            else:
+                line_count_stat = get_line_count(
+                    filepath,
+                    config=line_count_config,
+                    analyzers=analyzers,
+                    throttle=throttle,
+                )
+    except Exception as err:
         error_occured = True
         error_tracebacks.append(str(traceback.format_exc()).replace("\n", ","))
+        error_class = type(err).__name__
 
-    error_occured = error_occured or line_count_stat.error_occured
-    error_tracebacks.append(line_count_stat.error_traceback)
+    if line_count_stat.error_occured:
+        error_occured = True
+        error_tracebacks.append(line_count_stat.error_traceback)
+        error_class = error_class or line_count_stat.error_class
+
+    error_traceback = ""
+    error_fingerprint: Optional[str] = None
+    if error_occured:
+        # The same error of different files (or of the same file every day)
+        # is stored only once.
+        error_traceback = " | ".join(error_tracebacks).replace(filepath, "<filepath>")
+        error_fingerprint = get_error_fingerprint(error_traceback)
+
+    if date_created_sqlite is None:
+        date_created_sqlite = get_sqlite_datetime(
+            datetime.fromtimestamp(date_created or 0)
+        )
 
     return FileStat(
-        date__inode=f"{get_sqlite_datetime(scan_start_time)[:10]}__{inode}",
+        date__inode=(
+            f"{get_sqlite_datetime(scan_start_time)[:10]}__{dev}__{inode}"
+            if dev is not None
+            else f"{get_sqlite_datetime(scan_start_time)[:10]}__{inode}"
+        ),
         date_scanned=get_sqlite_datetime(scan_start_time),
         date_modified=get_sqlite_datetime(datetime.fromtimestamp(date_modified)),
-        date_created=get_sqlite_datetime(datetime.fromtimestamp(date_created)),
-        lines=line_count_stat.count,
+        date_created=date_created_sqlite,
+        lines=(
+            None if is_read_deferred and not error_occured else line_count_stat.count
+        ),
         filename=filename,
         filepath=filepath,
         error_occured=error_occured,
-        error_traceback=" | ".join(error_tracebacks),
+        error_traceback=error_traceback,
         filetype=get_file_type(filename),
         inode=inode,
+        size=size,
+        mtime_ns=mtime_ns,
+        error_fingerprint=error_fingerprint,
+        error_class=error_class,
+        dev=dev,
+        # Failed before the file was read.
+        analysis=line_count_stat.analysis
+        or (None,) * len(get_analyzer_columns(analyzers)),
+        bytes_read=line_count_stat.bytes_read,
     )
 
 
@@ -186,8 +967,16 @@ def validate_args(parser: argparse.ArgumentParser) -> argparse.Namespace:
 
 
 def clear_dev_environment(config: ScanConfig, delete_logs: bool = False):
-    if os.path.exists(config.database_filepath):
-        os.remove(config.database_filepath)
+    for filepath in [
+        config.database_filepath,
+        f"{config.database_filepath}-wal",
+        f"{config.database_filepath}-shm",
+    ]:
+        if os.path.exists(filepath):
+            os.remove(filepath)
+
+    if os.path.exists(config.shards_path):
+        shutil.rmtree(config.shards_path)
 
     if os.path.exists(config.csv_dump_path):
         shutil.rmtree(config.csv_dump_path)